@@ -47,27 +47,36 @@ def add_title_author_info(filepath, title, author):
         try:
             temp_filepath = os.path.join(temp_dir, 'temp.p8')
             with open(temp_filepath, 'w') as temp_f:
-                # flag meta data version replacement to avoid replacing an actual code line
-                # starting with "version " later
-                has_replaced_version = False
-                for line in f:
-                    if not has_replaced_version and line.startswith('version '):
-                        temp_f.write('version 27\n')
-                        has_replaced_version = True
-                        continue
-                    temp_f.write(line)
-                    if line.strip() == '__lua__':
-                        # lua block detected, add title and author after the tag line, if any was passed
-                        # if none was passed, we still call this method just so the version header gets update above
-                        if title:
-                            temp_f.write(f'-- {title}\n')
-                        if author:
-                            temp_f.write(f'-- by {author}\n')
+                temp_f.writelines(generate_lines_with_title_author_info(f, title, author))
             shutil.copy(temp_filepath, filepath)
         finally:
             shutil.rmtree(temp_dir)
 
 
+def generate_lines_with_title_author_info(lines, title, author):
+    """
+    Yield each line of iterable lines of a .p8 cartridge, with game title and author added at the top of source code,
+    and the version set to 27 (see add_title_author_info)
+
+    """
+    # flag meta data version replacement to avoid replacing an actual code line
+    # starting with "version " later
+    has_replaced_version = False
+    for line in lines:
+        if not has_replaced_version and line.startswith('version '):
+            yield 'version 27\n'
+            has_replaced_version = True
+            continue
+        yield line
+        if line.strip() == '__lua__':
+            # lua block detected, add title and author after the tag line, if any was passed
+            # if none was passed, we still call this method just so the version header gets update above
+            if title:
+                yield f'-- {title}\n'
+            if author:
+                yield f'-- by {author}\n'
+
+
 # This function is currently unused because preserving label from metadata template is easier
 def add_label_info(filepath, label_filepath):
     """
@@ -1,29 +1,48 @@
 #!/usr/bin/env python3.6
 # -*- coding: utf-8 -*-
 import argparse
+import fnmatch
+import logging
 import os
 import shutil, tempfile
 
+try:
+    from . import lua_tokenizer
+    from . import require_graph
+except ImportError:
+    # script run directly, not as part of the scripts package
+    import lua_tokenizer
+    import require_graph
+
 # This script adds "require" statements to a passed lua file,
 # for each lua file found recursively in a passed directory path.
 # It will only add the statements after the first `--[[add_require]]` tag found in the passed file.
 # Note that it doesn't store a reference to the returned module with something like `local module = require("module")`,
 # so the required modules should be self-sufficient (e.g. define global variables or have a side effect on some singleton)
+# Modules are required in dependency order (modules required by other found modules first), and modules already
+# required, directly or indirectly, by another found module or by the passed file are not required again,
+# so the cartridge doesn't carry redundant require calls. Only requires at the top level of a script are considered,
+# as requires inside a function body (or any other block) may never be run.
 
 # Use it from your PICO-8 game project as a pre-build step to require files you need to find dynamically
 # (e.g. itests)
 
 # Usage:
-# add_require.py requiring_filepath required_dirpath
+# add_require.py requiring_filepath require_root required_relative_dirpath [--include PATTERN ...] [--exclude PATTERN ...]
 # requiring_filepath:           path of the source lua file where to add require statements (.lua is not mandatory). Relative to current working directory.
 # require_root:                 path of the root from which we should require modules listed in required_relative_dirpath
 # required_relative_dirpath:    path of the directory recursively containing lua modules to require, relative to the require root
+# --include / --exclude:        glob patterns on module paths relative to the require root (e.g. "itests/menu/*"),
+#                               as with fnmatch, "*" also matches "/"
 
-def add_require_from_dir(requiring_filepath, require_root, required_relative_dirpath):
+def add_require_from_dir(requiring_filepath, require_root, required_relative_dirpath,
+        include_patterns=None, exclude_patterns=None):
     """
     Add `require("{relative_module_path}")` in `requiring_filepath`, under the first `--[[add_require]]` tag,
-    for each module found under `require_root`/`required_relative_dirpath`, using module paths relative to
-    `require_root`.
+    for each module found under `require_root`/`required_relative_dirpath` and matching the include and exclude
+    patterns (see find_relative_module_paths), using module paths relative to `require_root`.
+    Modules are required in dependency order, and modules already required by another found module
+    or by `requiring_filepath` are skipped (see get_ordered_module_paths).
 
     test.lua:
         -- a test file
@@ -55,8 +74,12 @@ def add_require_from_dir(requiring_filepath, require_root, required_relative_dir
         end
 
     """
-    relative_module_paths = find_relative_module_paths(require_root, required_relative_dirpath)
-    add_require_from_module_paths(requiring_filepath, relative_module_paths)
+    relative_module_paths = find_relative_module_paths(require_root, required_relative_dirpath,
+        include_patterns, exclude_patterns)
+    with open(requiring_filepath, 'r') as f:
+        requiring_code = f.read()
+    ordered_module_paths = get_ordered_module_paths(require_root, relative_module_paths, requiring_code)
+    add_require_from_module_paths(requiring_filepath, ordered_module_paths)
 
 def add_require_from_module_paths(requiring_filepath, relative_module_paths):
     """
@@ -80,10 +103,12 @@ def add_require_from_module_paths(requiring_filepath, relative_module_paths):
             shutil.rmtree(temp_dir)
 
 
-def find_relative_module_paths(require_root, relative_dirpath):
+def find_relative_module_paths(require_root, relative_dirpath, include_patterns=None, exclude_patterns=None):
     """
-    Return list of module paths found recursively under `root`/`relative_dirpath`,
+    Return sorted list of module paths found recursively under `root`/`relative_dirpath`,
     relative to `root`.
+    If include_patterns is not empty, only module paths matching one of them are returned.
+    Module paths matching one of exclude_patterns are never returned.
 
     Result is similar to what find_all_scripts in all_itests_headless_utest.lua would return, but it is meant for
     PICO-8 instead of busted and paths are prefixed with `root` already.
@@ -101,9 +126,113 @@ def find_relative_module_paths(require_root, relative_dirpath):
                 # so we need to retrieve the relative path of the file from the dirpath ourselves
                 full_module_path = os.path.join(root, module_name)
                 relative_module_path = os.path.relpath(full_module_path, require_root)
-                module_names.append(relative_module_path)
+                if is_module_path_matching(relative_module_path, include_patterns, exclude_patterns):
+                    module_names.append(relative_module_path)
+
+    # os.walk order depends on the file system, so sort for reproducible builds
+    return sorted(module_names)
+
+
+def is_module_path_matching(module_path, include_patterns=None, exclude_patterns=None):
+    """
+    Return True if module_path matches one of include_patterns (or include_patterns is empty)
+    and none of exclude_patterns
 
-    return module_names
+    >>> is_module_path_matching('itests/menu/itest_menu', ['itests/*'], ['*/menu/*'])
+    False
+
+    """
+    if include_patterns and not any(fnmatch.fnmatchcase(module_path, pattern) for pattern in include_patterns):
+        return False
+    return not any(fnmatch.fnmatchcase(module_path, pattern) for pattern in exclude_patterns or [])
+
+
+def get_ordered_module_paths(require_root, relative_module_paths, requiring_code=''):
+    """
+    Return the module paths of relative_module_paths to require in this order, so that:
+    - modules come after the modules they require, directly or indirectly (dependency order)
+    - modules already required, directly or indirectly, by another module of the list or by requiring_code are skipped,
+      since requiring them again would only add a redundant require call
+    Requires are followed through any module found under require_root, even outside relative_module_paths.
+    In case of circular requires, only the first module visited in the cycle is kept.
+    Only top-level requires are followed, as requires inside a function body or any other block may not be run
+    (see requires_from_code).
+
+    Ex: if a requires b, and c requires a, get_ordered_module_paths(require_root, ['a', 'b', 'c', 'd'])
+    returns ['c', 'd'].
+
+    """
+    requires_by_module = {}
+
+    def get_requires(module):
+        if module not in requires_by_module:
+            requires_by_module[module] = get_module_requires(require_root, module)
+        return requires_by_module[module]
+
+    def get_reachable_modules(start_modules):
+        reachable_modules = set()
+        modules_to_visit = list(start_modules)
+        while modules_to_visit:
+            module = modules_to_visit.pop()
+            if module not in reachable_modules:
+                reachable_modules.add(module)
+                modules_to_visit += get_requires(module)
+        return reachable_modules
+
+    # depth-first post-order, so dependencies come before the modules requiring them
+    ordered_modules = []
+    visited_modules = set()
+
+    def visit(module):
+        if module in visited_modules:
+            return
+        visited_modules.add(module)
+        for required_module in get_requires(module):
+            visit(required_module)
+        ordered_modules.append(module)
+
+    for module in relative_module_paths:
+        visit(module)
+
+    # keep modules not required by any kept module, starting with the ones that depend on most others
+    covered_modules = get_reachable_modules(requires_from_code(requiring_code, '(requiring file)'))
+    module_set = set(relative_module_paths)
+    kept_modules = set()
+    for module in reversed(ordered_modules):
+        if module in module_set and module not in covered_modules:
+            kept_modules.add(module)
+            covered_modules |= get_reachable_modules([module])
+
+    return [module for module in ordered_modules if module in kept_modules]
+
+
+def get_module_requires(require_root, module):
+    """
+    Return list of modules statically required at the top level of the script of module under require_root,
+    or an empty list if there is no such script
+
+    """
+    filepath = require_graph.resolve_module(module, [require_root])
+    if filepath is None:
+        # module from another root (e.g. engine) or missing module, requires cannot be followed
+        return []
+    with open(filepath, 'r') as f:
+        return requires_from_code(f.read(), module)
+
+
+def requires_from_code(code, module):
+    """
+    Return list of modules statically required at the top level of code of module, ignoring requires with a
+    non-literal argument and requires inside a function body or any other block, which may not be run.
+    If code cannot be tokenized, log a warning and return an empty list.
+
+    """
+    try:
+        required_modules = require_graph.find_requires(code, top_level_only=True)
+    except lua_tokenizer.LuaTokenizeError as e:
+        logging.warning(f"could not find requires of {module}, assuming none: {e}")
+        return []
+    return [required_module for required_module in required_modules if required_module is not None]
 
 
 if __name__ == '__main__':
@@ -111,6 +240,12 @@ if __name__ == '__main__':
     parser.add_argument('requiring_filepath', type=str, help='path of the source lua file where to add require statements (.lua is not mandatory)')
     parser.add_argument('require_root', type=str, help='path of the root from which we should require modules listed in required_relative_dirpath')
     parser.add_argument('required_relative_dirpath', type=str, help='path of the directory recursively containing lua modules to require, relative to the require root')
+    parser.add_argument('-i', '--include', type=str, nargs='+', default=[],
+        help='glob patterns of module paths relative to the require root to require (default: all)')
+    parser.add_argument('-e', '--exclude', type=str, nargs='+', default=[],
+        help='glob patterns of module paths relative to the require root not to require')
     args = parser.parse_args()
-    add_require_from_dir(args.requiring_filepath, args.require_root, args.required_relative_dirpath)
+    logging.basicConfig(level=logging.INFO)
+    add_require_from_dir(args.requiring_filepath, args.require_root, args.required_relative_dirpath,
+        args.include, args.exclude)
     print(f"Added require statements found in \"{args.require_root}/{args.required_relative_dirpath}\" to \"{args.requiring_filepath}\".")
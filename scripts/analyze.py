@@ -1,101 +1,409 @@
 #!/usr/bin/env python3.6
 # -*- coding: utf-8 -*-
 import argparse
+import csv
+import json
 import logging
 import os, sys
-import shutil, tempfile
 import re
-from subprocess import Popen
+import sqlite3
+import subprocess
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
 
-# This script uses p8tool on .lua files to provide interesting stats:
-# A. Count tokens in a single .lua file, ignoring require statements
-# B. Count tokens in each .lua file recursively found in a directory, using the same process as A.
+try:
+    from . import cartridge
+    from . import lua_tokenizer
+    from . import pico8_compression
+    from . import pico8_tokens
+except ImportError:
+    # script run directly, not as part of the scripts package
+    import cartridge
+    import lua_tokenizer
+    import pico8_compression
+    import pico8_tokens
+
+# This script provides interesting stats on .lua files, with the same rules as PICO-8 (see pico8_tokens.py
+# and pico8_compression.py):
+# A. Count lines, characters, tokens and compressed size of a single .lua file
+# B. Count the same stats for each .lua file recursively found in a directory, using the same process as A.
 #
-# Stats are directly printed to stdout
+# For B., sources are read into memory, then analyzed in parallel on a pool of processes (see --jobs),
+# and stats are printed to stdout in file path order as:
+# - text: one block per file, human-readable (default)
+# - json: a list of objects with the fields of ScriptStats
+# - csv: a header with the fields of ScriptStats, then one row per file
+# Files that cannot be tokenized are skipped with a warning.
 #
 # Apply this script to the intermediate directory *after* building for release config,
 # as this will give the most meaningful results (pre-processing already applied).
+#
+# C. With --record-db, also record the stats of each module (and of the built cartridge with --cartridge)
+# in a SQLite database, keyed by commit and config (see HISTORY_SCHEMA). Recording again for the same commit
+# and config replaces the previous record.
+# D. With the diff subcommand (analyze.py diff DB OLD_COMMIT NEW_COMMIT), print the modules whose stats changed
+# the most between two records of the same config, largest token growth first, so regressions in token budget
+# are caught at commit time rather than just before release.
+
+STATS_FORMAT = """{}
+- lines: {}
+- chars: {}
+- tokens: {}
+- compressed bytes: {}
 
-CARTRIDGE_AND_LUA_HEADER = """pico-8 cartridge // http://www.pico-8.com
-version 16
-__lua__
-"""
-META_INFO_FORMAT = """-- {}
--- by analyze_script
 """
 
+OUTPUT_FORMATS = ['text', 'json', 'csv']
+
 # regex patterns of files to exclude from analysis (utests, bustedhelper and pico8api
 # are never put in a PICO-8 build)
 UTEST_FILE_PATTERN = re.compile(r".+_utest\.lua$")
 BUSTED_ONLY_FILES = ["bustedhelper.lua", "pico8api.lua", "headless_itest.lua"]
 
+# Stats of a single script. module is the path of the script relative to the analyzed directory,
+# without extension and with '/' separators, as in require
+ScriptStats = namedtuple('ScriptStats', ['module', 'lines', 'chars', 'tokens', 'compressed_bytes'])
+
+# Difference of stats of a single module between two records (old and new), deltas are new - old
+# (a module missing from a record counts as 0 for all stats)
+ModuleStatsDiff = namedtuple('ModuleStatsDiff', ['module', 'old_tokens', 'new_tokens', 'tokens', 'chars', 'compressed_bytes'])
+
+DEFAULT_CONFIG = 'release'
+
+# Each record holds the stats of all modules analyzed for a commit and config, and optionally the stats of the
+# __lua__ section of the built cartridge
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    id INTEGER PRIMARY KEY,
+    commit_hash TEXT NOT NULL,
+    config TEXT NOT NULL,
+    recorded_at REAL NOT NULL,
+    UNIQUE (commit_hash, config)
+);
+CREATE TABLE IF NOT EXISTS module_stats (
+    record_id INTEGER NOT NULL REFERENCES records (id),
+    module TEXT NOT NULL,
+    lines INTEGER NOT NULL,
+    chars INTEGER NOT NULL,
+    tokens INTEGER NOT NULL,
+    compressed_bytes INTEGER NOT NULL,
+    PRIMARY KEY (record_id, module)
+);
+CREATE TABLE IF NOT EXISTS cartridge_stats (
+    record_id INTEGER PRIMARY KEY REFERENCES records (id),
+    lines INTEGER NOT NULL,
+    chars INTEGER NOT NULL,
+    tokens INTEGER NOT NULL,
+    compressed_bytes INTEGER NOT NULL
+);
+"""
+
 
-def analyze_scripts_in_dir(dirpath):
-    """Print lua script stats for all the source files inside the given directory"""
+def analyze_scripts_in_dir(dirpath, output_format='text', output_stream=None, jobs=1):
+    """
+    Print lua script stats for all the source files inside the given directory to output_stream
+    (default: stdout), in output_format (see OUTPUT_FORMATS)
+
+    """
+    write_stats(get_scripts_stats_in_dir(dirpath, jobs), output_format, output_stream or sys.stdout)
+
+
+def find_lua_scripts(dirpath):
+    """Return the sorted list of relative paths of .lua files to analyze, recursively found in dirpath"""
+    lua_relative_filepaths = []
     for root, dirs, files in os.walk(dirpath):
         for file in files:
             if file.endswith(".lua") and                        \
                     not UTEST_FILE_PATTERN.match(file) and      \
                     file not in BUSTED_ONLY_FILES:
-                analyze_script(root, file, sys.stdout)
+                lua_relative_filepaths.append(os.path.relpath(os.path.join(root, file), dirpath))
+    return sorted(lua_relative_filepaths)
+
+
+def get_module_name(lua_relative_filepath):
+    """Return the module name of the script at lua_relative_filepath, as used in require"""
+    return os.path.splitext(lua_relative_filepath)[0].replace(os.sep, '/')
+
+
+def get_scripts_stats_in_dir(dirpath, jobs=1):
+    """
+    Return the list of ScriptStats for all the source files inside the given directory, in file path order,
+    skipping files that cannot be tokenized (see get_script_stats).
+    If jobs > 1, scripts are analyzed on a pool of that many processes.
+
+    """
+    sources = []
+    for lua_relative_filepath in find_lua_scripts(dirpath):
+        with open(os.path.join(dirpath, lua_relative_filepath), 'r') as lua_file:
+            sources.append((get_module_name(lua_relative_filepath), lua_file.read()))
+
+    if jobs > 1 and len(sources) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            # map preserves order, and chunks avoid sending each small script separately
+            chunk_size = max(1, len(sources) // (jobs * 4))
+            scripts_stats = list(executor.map(get_script_stats, sources, chunksize=chunk_size))
+    else:
+        scripts_stats = [get_script_stats(source) for source in sources]
+    return [script_stats for script_stats in scripts_stats if script_stats is not None]
+
+
+def get_script_stats(source):
+    """
+    Return ScriptStats for source, a (module name, code) pair,
+    or None with a warning if the code cannot be tokenized, so one invalid file doesn't abort the whole analysis
+
+    """
+    module_name, code = source
+    try:
+        return ScriptStats(module_name, *get_code_stats(code))
+    except lua_tokenizer.LuaTokenizeError as e:
+        logging.warning(f"{module_name}.lua: could not tokenize ({e}), it was skipped")
+        return None
+
+
+def write_stats(scripts_stats, output_format, output_stream):
+    """Write each ScriptStats of scripts_stats to output_stream in output_format (see OUTPUT_FORMATS)"""
+    if output_format == 'text':
+        for script_stats in scripts_stats:
+            output_stream.write(STATS_FORMAT.format(f"{script_stats.module}.lua", *script_stats[1:]))
+    elif output_format == 'json':
+        json.dump([script_stats._asdict() for script_stats in scripts_stats], output_stream, indent=2)
+        output_stream.write("\n")
+    elif output_format == 'csv':
+        csv_writer = csv.writer(output_stream, lineterminator="\n")
+        csv_writer.writerow(ScriptStats._fields)
+        csv_writer.writerows(scripts_stats)
+    else:
+        raise ValueError(f"unknown output format '{output_format}', expected one of {OUTPUT_FORMATS}")
 
 
 def analyze_script(root, lua_relative_filepath, output_stream):
     """
-    Print lua script stats for this file. It must be a Lua source.
-    It is built into a .p8 cartridge only containing that source as an intermediate step,
-    so picotool can analyze it like a cartridge
-    (we could also import picotool Python scripts and use functions directly on the Lua code, e.g.
-    `Lua.from_lines(data.section_lines[section], ...)`)
+    Print lua script stats for this file to output_stream. It must be a Lua source.
 
     """
     lua_filepath = os.path.join(root, lua_relative_filepath)
-
-    # copy script to intermediate folder 'analysis'
     assert lua_filepath.endswith(".lua"), f"filepath {lua_filepath} doesn't end with '.lua'"
-    cartridge_filepath = lua_filepath[:-4] + ".p8"
-    # turn .lua in .p8 cartridge
-    cartridgify(root, lua_relative_filepath, cartridge_filepath)
-    # apply p8tool stats
-    print_stats(cartridge_filepath, output_stream)
-    # cleanup (do not put this in try-finally so in case of error,
-    # we can debug what went wrong in the file)
+
+    with open(lua_filepath, 'r') as lua_file:
+        code = lua_file.read()
+
+    output_stream.write(STATS_FORMAT.format(lua_relative_filepath, *get_code_stats(code)))
+
+
+def get_cartridge_stats(cartridge_filepath):
+    """Return ScriptStats for the __lua__ section of the .p8 cartridge at cartridge_filepath"""
+    lua_lines = cartridge.get_section_lines(cartridge.read_sections(cartridge_filepath), cartridge.LUA_SECTION_NAME)
+    code = "".join(lua_lines) if lua_lines is not None else ""
+    return ScriptStats(os.path.basename(cartridge_filepath), *get_code_stats(code))
+
+
+def get_current_commit():
+    """
+    Return the hash of the commit checked out in the git repository of the current directory,
+    or None if git is not available or the current directory is not inside a git checkout
+
+    """
     try:
-        os.remove(cartridge_filepath)
-    except OSError as e:
-        print("Failed with: ", e.strerror)
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
 
+def open_history_db(db_filepath):
+    """Return a connection to the SQLite history database at db_filepath, creating its tables if needed"""
+    connection = sqlite3.connect(db_filepath)
+    connection.executescript(HISTORY_SCHEMA)
+    return connection
 
-def cartridgify(root, lua_relative_filepath, output_filepath):
+
+def record_stats(db_filepath, commit_hash, config, scripts_stats, cartridge_stats=None):
     """
-    Create .p8 from .lua by just adding PICO-8 cartridge and lua section header.
+    Record scripts_stats (list of ScriptStats) and cartridge_stats (ScriptStats, optional)
+    for commit_hash and config in the history database at db_filepath, replacing any previous record
+    for the same commit and config
 
     """
-    lua_filepath = os.path.join(root, lua_relative_filepath)
+    with closing(open_history_db(db_filepath)) as connection, connection:
+        for record_id, in connection.execute("SELECT id FROM records WHERE commit_hash = ? AND config = ?", (commit_hash, config)).fetchall():
+            connection.execute("DELETE FROM module_stats WHERE record_id = ?", (record_id,))
+            connection.execute("DELETE FROM cartridge_stats WHERE record_id = ?", (record_id,))
+            connection.execute("DELETE FROM records WHERE id = ?", (record_id,))
 
-    with open(lua_filepath, 'r') as lua_file, open(output_filepath, 'w') as output_file:
-        output_file.write(CARTRIDGE_AND_LUA_HEADER)
-        output_file.write(META_INFO_FORMAT.format(lua_relative_filepath))
-        for line in lua_file:
-            output_file.write(line)
+        record_id = connection.execute("INSERT INTO records (commit_hash, config, recorded_at) VALUES (?, ?, ?)",
+            (commit_hash, config, time.time())).lastrowid
+        connection.executemany("INSERT INTO module_stats VALUES (?, ?, ?, ?, ?, ?)",
+            [(record_id, *script_stats) for script_stats in scripts_stats])
+        if cartridge_stats is not None:
+            connection.execute("INSERT INTO cartridge_stats VALUES (?, ?, ?, ?, ?)", (record_id, *cartridge_stats[1:]))
 
 
-def print_stats(cartridge_filepath, output_stream):
+def find_record(connection, commit_hash, config):
     """
-    Print stats for .p8 cartridge
+    Return (id, full commit hash) of the record for config whose commit hash starts with commit_hash.
+    Raise ValueError if there is no such record, or several ones.
 
     """
-    Popen(["p8tool", "stats", cartridge_filepath], stdout=output_stream).communicate()
+    records = connection.execute("SELECT id, commit_hash FROM records WHERE config = ? AND substr(commit_hash, 1, ?) = ?",
+        (config, len(commit_hash), commit_hash)).fetchall()
+    if not records:
+        raise ValueError(f"no record found for commit '{commit_hash}' and config '{config}'")
+    if len(records) > 1:
+        raise ValueError(f"commit '{commit_hash}' is ambiguous for config '{config}', it matches {len(records)} records")
+    return records[0]
 
 
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description='Print stats for each lua file found recursively under a directory.')
+def get_recorded_stats(connection, record_id):
+    """Return (dict of ScriptStats by module, cartridge ScriptStats or None) recorded in record record_id"""
+    stats_by_module = {row[0]: ScriptStats(*row) for row in connection.execute(
+        "SELECT module, lines, chars, tokens, compressed_bytes FROM module_stats WHERE record_id = ?", (record_id,))}
+    cartridge_row = connection.execute(
+        "SELECT lines, chars, tokens, compressed_bytes FROM cartridge_stats WHERE record_id = ?", (record_id,)).fetchone()
+    return stats_by_module, ScriptStats('cartridge', *cartridge_row) if cartridge_row is not None else None
+
+
+def diff_records(db_filepath, old_commit_hash, new_commit_hash, config=DEFAULT_CONFIG):
+    """
+    Return (list of ModuleStatsDiff, cartridge ModuleStatsDiff or None) between the records for old_commit_hash
+    and new_commit_hash (full hashes or prefixes) and config in the history database at db_filepath.
+    Modules with unchanged stats are skipped, and the others are sorted by token growth first, then character growth,
+    then compressed size growth, largest first.
+    Raise ValueError if a record cannot be found (see find_record).
+
+    """
+    with closing(open_history_db(db_filepath)) as connection:
+        old_record_id, _ = find_record(connection, old_commit_hash, config)
+        new_record_id, _ = find_record(connection, new_commit_hash, config)
+        old_stats_by_module, old_cartridge_stats = get_recorded_stats(connection, old_record_id)
+        new_stats_by_module, new_cartridge_stats = get_recorded_stats(connection, new_record_id)
+
+    module_diffs = []
+    for module in set(old_stats_by_module) | set(new_stats_by_module):
+        module_diff = get_module_stats_diff(module, old_stats_by_module.get(module), new_stats_by_module.get(module))
+        if module_diff.tokens or module_diff.chars or module_diff.compressed_bytes:
+            module_diffs.append(module_diff)
+    module_diffs.sort(key=lambda module_diff: (-module_diff.tokens, -module_diff.chars, -module_diff.compressed_bytes, module_diff.module))
+
+    cartridge_diff = None
+    if old_cartridge_stats is not None and new_cartridge_stats is not None:
+        cartridge_diff = get_module_stats_diff('cartridge', old_cartridge_stats, new_cartridge_stats)
+
+    return module_diffs, cartridge_diff
+
+
+def get_module_stats_diff(module, old_stats, new_stats):
+    """Return ModuleStatsDiff for module between old_stats and new_stats (ScriptStats, or None if missing)"""
+    empty_stats = ScriptStats(module, 0, 0, 0, 0)
+    old_stats = old_stats or empty_stats
+    new_stats = new_stats or empty_stats
+    return ModuleStatsDiff(module, old_stats.tokens, new_stats.tokens, new_stats.tokens - old_stats.tokens,
+        new_stats.chars - old_stats.chars, new_stats.compressed_bytes - old_stats.compressed_bytes)
+
+
+def write_stats_diff(module_diffs, cartridge_diff, output_format, output_stream):
+    """
+    Write module_diffs (list of ModuleStatsDiff) and cartridge_diff (ModuleStatsDiff or None) to output_stream
+    in output_format (see OUTPUT_FORMATS). In json and csv, the cartridge diff comes first as module 'cartridge'.
+
+    """
+    rows = ([cartridge_diff] if cartridge_diff is not None else []) + module_diffs
+    if output_format == 'text':
+        if not rows:
+            output_stream.write("No changes.\n")
+        for module_diff in rows:
+            output_stream.write(f"{module_diff.tokens:+6d} tokens {module_diff.chars:+7d} chars {module_diff.compressed_bytes:+6d} compressed bytes  "
+                f"{module_diff.module} ({module_diff.old_tokens} -> {module_diff.new_tokens} tokens)\n")
+    elif output_format == 'json':
+        json.dump([module_diff._asdict() for module_diff in rows], output_stream, indent=2)
+        output_stream.write("\n")
+    elif output_format == 'csv':
+        csv_writer = csv.writer(output_stream, lineterminator="\n")
+        csv_writer.writerow(ModuleStatsDiff._fields)
+        csv_writer.writerows(rows)
+    else:
+        raise ValueError(f"unknown output format '{output_format}', expected one of {OUTPUT_FORMATS}")
+
+
+def get_code_stats(code):
+    """
+    Return (line count, character count, token count, compressed size in bytes) for Lua code (string),
+    as shown by PICO-8
+
+    """
+    line_count = code.count("\n") + (1 if code and not code.endswith("\n") else 0)
+    return line_count, len(code), pico8_tokens.count_tokens(code), pico8_compression.get_compressed_code_size(code)
+
+
+def main_analyze(argv):
+    parser = argparse.ArgumentParser(description='Print stats for each lua file found recursively under a directory. ' +
+        "Run 'analyze.py diff -h' to compare recorded stats instead.")
     parser.add_argument('path', type=str, help='Path of the source directory recursively containing lua sources')
-    args = parser.parse_args()
+    parser.add_argument('-f', '--format', type=str, choices=OUTPUT_FORMATS, default='text',
+        help="output format: human-readable text, or json/csv rows for other tools (default: text)")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+        help="number of processes used to analyze files in parallel (default: number of CPU cores)")
+    parser.add_argument('--record-db', type=str,
+        help="path of a SQLite database where to record the stats, created if needed (optional, no recording if not set)")
+    parser.add_argument('--commit', type=str,
+        help="commit to record the stats for (default: commit checked out in the current directory)")
+    parser.add_argument('-c', '--config', type=str, default=DEFAULT_CONFIG,
+        help=f"config to record the stats for (default: {DEFAULT_CONFIG})")
+    parser.add_argument('--cartridge', type=str,
+        help="path of the built .p8 cartridge whose __lua__ section stats should be printed and recorded (optional)")
+    args = parser.parse_args(argv)
 
-    logging.basicConfig(level=logging.INFO)
+    if args.format == 'text':
+        # keep machine-readable output clean
+        print(f"Analyzing lua scripts in {args.path}...\n")
+
+    scripts_stats = get_scripts_stats_in_dir(args.path, args.jobs)
+    cartridge_stats = get_cartridge_stats(args.cartridge) if args.cartridge else None
+    if args.format == 'text':
+        write_stats(scripts_stats, args.format, sys.stdout)
+        if cartridge_stats is not None:
+            sys.stdout.write(STATS_FORMAT.format(cartridge_stats.module, *cartridge_stats[1:]))
+    else:
+        write_stats(scripts_stats + ([cartridge_stats] if cartridge_stats is not None else []), args.format, sys.stdout)
 
-    # print tends to output after analyze results, so `echo` directly to have precedence
-    Popen(["echo", f"Analyzing lua scripts in {args.path}...\n"]).communicate()
+    if args.record_db:
+        commit_hash = args.commit or get_current_commit()
+        if commit_hash is None:
+            logging.warning("could not find the current commit (git is not available or this is not a git checkout), "
+                "stats were not recorded. Pass --commit to record them.")
+            return
+        record_stats(args.record_db, commit_hash, args.config, scripts_stats, cartridge_stats)
+        logging.info(f"Recorded stats for commit {commit_hash} and config {args.config} in {args.record_db}.")
+
+
+def main_diff(argv):
+    parser = argparse.ArgumentParser(prog='analyze.py diff',
+        description='Print the modules whose stats changed the most between two records, largest token growth first.')
+    parser.add_argument('db', type=str, help='path of the SQLite database where stats were recorded with --record-db')
+    parser.add_argument('old_commit', type=str, help='commit of the old record (full hash or unique prefix)')
+    parser.add_argument('new_commit', type=str, help='commit of the new record (full hash or unique prefix)')
+    parser.add_argument('-c', '--config', type=str, default=DEFAULT_CONFIG,
+        help=f"config of the records to compare (default: {DEFAULT_CONFIG})")
+    parser.add_argument('-n', '--limit', type=int, help="only print the first LIMIT modules (optional)")
+    parser.add_argument('-f', '--format', type=str, choices=OUTPUT_FORMATS, default='text',
+        help="output format: human-readable text, or json/csv rows for other tools (default: text)")
+    args = parser.parse_args(argv)
+
+    try:
+        module_diffs, cartridge_diff = diff_records(args.db, args.old_commit, args.new_commit, args.config)
+    except ValueError as e:
+        logging.error(e)
+        sys.exit(1)
+
+    write_stats_diff(module_diffs[:args.limit], cartridge_diff, args.format, sys.stdout)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
 
-    analyze_scripts_in_dir(args.path)
+    # the diff subcommand is detected manually, so 'analyze.py PATH' keeps working without subcommand
+    if len(sys.argv) > 1 and sys.argv[1] == 'diff':
+        main_diff(sys.argv[2:])
+    else:
+        main_analyze(sys.argv[1:])
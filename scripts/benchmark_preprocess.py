@@ -0,0 +1,80 @@
+#!/usr/bin/env python3.6
+# -*- coding: utf-8 -*-
+import argparse
+import timeit
+
+try:
+    from . import preprocess
+except ImportError:
+    # script run directly, not as part of the scripts package
+    import preprocess
+
+
+# This script measures the time taken by preprocess_lines on a generated corpus of typical source code,
+# mostly made of plain code lines like a real project, for a few lists of defined symbols.
+# It is not part of the unit tests, as wall-clock timings depend on the machine load:
+# run it manually before and after changing the preprocessor to compare timings on the same machine.
+
+# Usage:
+# benchmark_preprocess.py [--blocks BLOCK_COUNT] [--repeat REPEAT_COUNT]
+
+
+# A few typical blocks of source code
+test_blocks = [
+    [
+        'local function update_physics(self)\n',
+        '  local velocity = self.velocity\n',
+        '  -- apply gravity\n',
+        '  velocity.y = velocity.y + gravity * delta_time60\n',
+        '  self.position = self.position + velocity * delta_time60\n',
+        '  log("position: "..self.position, "physics")\n',
+        '  assert(self.position.y < 1000, "fell off")\n',
+        'end\n',
+        '\n',
+    ],
+    [
+        '--#if debug\n',
+        'function debug_draw(self)\n',
+        '  rect(self.position.x, self.position.y, self.position.x + 8, self.position.y + 8, colors.red)\n',
+        'end\n',
+        '--#endif\n',
+        '\n',
+    ],
+    [
+        '--[[#pico8\n',
+        'function _draw()\n',
+        '  cls()\n',
+        '  app:draw()\n',
+        'end\n',
+        '--#pico8]]\n',
+        '\n',
+    ],
+]
+
+# Lists of defined symbols to benchmark, typically used in release and debug builds
+benchmarked_defined_symbols_list = [[], ['debug', 'assert', 'log']]
+
+
+def generate_test_corpus(block_count):
+    """Return a list of source lines made of block_count blocks, 1 block with directives for 8 blocks of plain code"""
+    corpus = []
+    for i in range(block_count):
+        corpus += test_blocks[0] if i % 8 else test_blocks[1 + (i // 8) % 2]
+    return corpus
+
+
+def benchmark_preprocess_lines(corpus, defined_symbols, repeat_count):
+    """Return the best time in seconds taken by preprocess_lines on corpus with defined_symbols, over repeat_count runs"""
+    return min(timeit.repeat(lambda: preprocess.preprocess_lines(corpus, defined_symbols), number=1, repeat=repeat_count))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure the time taken by the preprocessor on a generated corpus.')
+    parser.add_argument('--blocks', type=int, default=10000, help="number of code blocks in the corpus (default: 10000)")
+    parser.add_argument('--repeat', type=int, default=5, help="number of runs, the best time is kept (default: 5)")
+    args = parser.parse_args()
+
+    corpus = generate_test_corpus(args.blocks)
+    for defined_symbols in benchmarked_defined_symbols_list:
+        best_time = benchmark_preprocess_lines(corpus, defined_symbols, args.repeat)
+        print(f"preprocess_lines on {len(corpus)} lines with symbols {defined_symbols}: {best_time:.3f}s")
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3.6
+# -*- coding: utf-8 -*-
+import argparse
+import logging
+import os
+import sys
+
+try:
+    from . import add_metadata
+    from . import add_require
+    from . import bundle
+    from . import cartridge
+    from . import lua_tokenizer
+    from . import minify
+    from . import optimize
+    from . import pico8_compression
+    from . import pico8_tokens
+    from . import preprocess
+    from . import tree_shake
+except ImportError:
+    # script run directly, not as part of the scripts package
+    import add_metadata
+    import add_require
+    import bundle
+    import cartridge
+    import lua_tokenizer
+    import minify
+    import optimize
+    import pico8_compression
+    import pico8_tokens
+    import preprocess
+    import tree_shake
+
+
+# This script builds a .p8 cartridge from a main source file, like build_cartridge.sh and with the same arguments,
+# but runs every step in a single Python process instead of starting one process per step:
+# 1. Preprocess engine and game sources into the intermediate directory (see preprocess.py)
+# 2. Eliminate dead branches in intermediate sources (see optimize.py)
+# 3. If a required directory is passed, add require statements for its modules to the main script (see add_require.py)
+# 4. Read the main script and the modules it requires (see bundle.py), and if tree shaking is enabled,
+#    remove unused functions from their code (see tree_shake.py)
+# 5. Bundle the code with the data sections and the label of the metadata cartridge (see bundle.py)
+# 6. In release config, check the token count (see pico8_tokens.py)
+# 7. Minify the code if asked (see minify.py, failing on compressed size in release config only),
+#    and add title and author (see add_metadata.py)
+# 8. Write the cartridge
+
+# Extra notes:
+
+# a. Steps 1 to 3 still work on the intermediate directory, since it is what makes preprocessing incremental.
+# From step 4, code and sections are passed in memory, and the cartridge is only written at the end,
+# so a failed build leaves no cartridge at the output path, like build_cartridge.sh which removes it first.
+
+# b. Tree shaking works on the code in memory, so unlike build_cartridge.sh, it doesn't need a copy of the
+# intermediate files to leave them untouched. Like build_cartridge.sh, if some module cannot be tokenized,
+# it warns and builds without removing any function.
+
+# c. The luamin engine still runs on node (via the luamin worker, see minify.py), pass --minify-engine python
+# to minify in-process too.
+
+# Usage:
+# build.py GAME_SRC_PATH RELATIVE_MAIN_FILEPATH [REQUIRED_RELATIVE_DIRPATH] [options]
+# (see build_cartridge.sh or build.py --help for options)
+
+
+# Path of pico-boots engine source
+picoboots_src_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, 'src')
+
+# Root of intermediate directories, relative to the current working directory
+INTERMEDIATE_ROOT = 'intermediate'
+
+# Config for which the token count is checked
+RELEASE_CONFIG = 'release'
+
+
+class BuildError(Exception):
+    """Raised when a build step fails"""
+    pass
+
+
+def build_cartridge(game_src_path, relative_main_filepath, required_relative_dirpath=None, output_path='.',
+        output_basename='game', config='', symbols=(), data_filepath=None, metadata_filepath=None, title='', author='',
+        minify_level=0, use_tree_shake=False, tree_shake_keep_filepath=None,
+        minify_engine=minify.DEFAULT_MINIFY_ENGINE, jobs=1, engine_src_path=picoboots_src_path):
+    """
+    Build the cartridge of the main script at game_src_path/relative_main_filepath and return its path.
+    See build_cartridge.sh for parameters. Files from the pico-boots engine are taken from engine_src_path.
+    If jobs > 1, files are preprocessed in parallel on a pool of that many processes.
+    Raise BuildError if some step fails.
+
+    """
+    output_filepath = get_output_filepath(output_path, output_basename, config)
+    print(f"Building '{game_src_path}/{relative_main_filepath}' -> '{output_filepath}'")
+
+    # clean up any existing output file
+    if os.path.isfile(output_filepath):
+        os.remove(output_filepath)
+
+    print("")
+    print("Pre-build...")
+
+    intermediate_path = get_intermediate_path(config)
+    engine_intermediate_path = os.path.join(intermediate_path, 'pico-boots')
+    game_intermediate_path = os.path.join(intermediate_path, 'src')
+    main_filepath = os.path.join(game_intermediate_path, relative_main_filepath)
+    lua_roots = [game_intermediate_path, engine_intermediate_path]
+
+    # Preprocess framework and game source into intermediate directory (see build_cartridge.sh)
+    preprocess_cache_dirpath = os.path.join(INTERMEDIATE_ROOT, '.preprocess_cache')
+    for src_path, src_intermediate_path in [(engine_src_path, engine_intermediate_path), (game_src_path, game_intermediate_path)]:
+        preprocess.preprocess_dir_multi(src_path, {src_intermediate_path: list(symbols)}, preprocess_cache_dirpath, jobs)
+        print(f"Preprocessed all files in {src_path} to {src_intermediate_path} with symbols {list(symbols)}.")
+
+    # Eliminate dead branches of if statements whose conditions became constant after preprocessing
+    for dirpath in [engine_intermediate_path, game_intermediate_path]:
+        changed_file_count = optimize.optimize_dir(dirpath)
+        print(f"Optimized {changed_file_count} file(s) in {dirpath}.")
+
+    # If building an itest main, add itest require statements
+    if required_relative_dirpath:
+        if not os.path.isfile(main_filepath):
+            raise BuildError(f"Add require step failed: main script {main_filepath} not found")
+        add_require.add_require_from_dir(main_filepath, game_intermediate_path, required_relative_dirpath)
+        print(f"Added require statements found in \"{game_intermediate_path}/{required_relative_dirpath}\" to \"{main_filepath}\".")
+
+    try:
+        main_module, code_by_module = bundle.read_bundled_sources(main_filepath, lua_roots)
+    except bundle.BundleError as e:
+        raise BuildError(f"Build step failed: {e}")
+
+    # Remove functions never referenced from the main script, in memory
+    if use_tree_shake:
+        kept_names = tree_shake.read_kept_names_file(tree_shake_keep_filepath) if tree_shake_keep_filepath else []
+        try:
+            shaken_code_by_module, removed_names_by_module = tree_shake.tree_shake_sources(code_by_module, kept_names)
+        except lua_tokenizer.LuaTokenizeError as e:
+            # same behavior as tree_shake.tree_shake used by build_cartridge.sh: build without tree shaking
+            logging.warning(f"could not tokenize a required module ({e}), no function will be removed")
+            shaken_code_by_module, removed_names_by_module = {}, {}
+
+        saved_token_count = 0
+        for module, shaken_code in shaken_code_by_module.items():
+            for name in removed_names_by_module[module]:
+                logging.info(f"{module}: removed unused function '{name}'")
+            saved_token_count += pico8_tokens.count_tokens(code_by_module[module]) - pico8_tokens.count_tokens(shaken_code)
+            code_by_module[module] = shaken_code
+        removed_name_count = sum(len(names) for names in removed_names_by_module.values())
+        print(f"Removed {removed_name_count} unused function(s) in {len(removed_names_by_module)} file(s), "
+            f"saving {saved_token_count} tokens.")
+
+    print("")
+    print("Build...")
+
+    main_code = code_by_module.pop(main_module)
+    lua_code = bundle.get_bundled_code(main_code, code_by_module)
+
+    # The metadata cartridge provides the label (see build_cartridge.sh)
+    existing_sections = None
+    data_sections = None
+    if data_filepath:
+        try:
+            data_sections = cartridge.read_sections(data_filepath)
+        except OSError as e:
+            raise BuildError(f"Build step failed: could not read data cartridge: {e}")
+        if metadata_filepath and os.path.isfile(metadata_filepath):
+            existing_sections = cartridge.read_sections(metadata_filepath)
+    sections = bundle.merge_sections(lua_code, existing_sections, data_sections)
+    print(f"Bundled {main_filepath} with {len(code_by_module)} required module(s).")
+
+    if config == RELEASE_CONFIG:
+        # We are building for release, so check the token count with PICO-8 rules
+        token_count = pico8_tokens.count_tokens(lua_code)
+        print(f"Token count: {token_count}/{pico8_tokens.PICO8_MAX_TOKEN_COUNT}")
+        if token_count > pico8_tokens.PICO8_MAX_TOKEN_COUNT:
+            raise BuildError(f"Token count check failed: maximum token count of {pico8_tokens.PICO8_MAX_TOKEN_COUNT} "
+                "has been exceeded.")
+
+    print("")
+    print("Post-build...")
+
+    if minify_level > 0:
+        # Minified code is cached in a folder shared by all configs (see build_cartridge.sh),
+        # and like the token count, the compressed size only makes the build fail in release
+        max_compressed_size = pico8_compression.PICO8_MAX_COMPRESSED_CODE_SIZE if config == RELEASE_CONFIG else None
+        try:
+            sections = minify.minify_lua_in_sections(sections, minify_level >= 2,
+                cache_dirpath=os.path.join(INTERMEDIATE_ROOT, '.minify_cache'), engine=minify_engine,
+                max_compressed_size=max_compressed_size, cartridge_filepath=output_filepath)
+        except minify.MinifyError as e:
+            raise BuildError(f"Minification failed: {e}")
+
+    output_lines = cartridge.generate_lines(sections)
+    if title or author:
+        output_lines = add_metadata.generate_lines_with_title_author_info(output_lines, title, author)
+
+    # Create directory for output file if it doesn't exist yet
+    os.makedirs(os.path.dirname(os.path.abspath(output_filepath)), exist_ok=True)
+    with open(output_filepath, 'w') as output_file:
+        output_file.writelines(output_lines)
+
+    return output_filepath
+
+
+def get_output_filepath(output_path, output_basename, config=''):
+    """
+    Return the path of the cartridge to build in output_path, for config if any
+
+    >>> get_output_filepath('build', 'game', 'debug')
+    'build/game_debug.p8'
+
+    """
+    output_filename = output_basename
+    # if config is passed, append to output basename
+    if config:
+        output_filename += f"_{config}"
+    return os.path.join(output_path, f"{output_filename}.p8")
+
+
+def get_intermediate_path(config=''):
+    """Return the path of the intermediate directory for config, using a sub-folder if config is passed"""
+    return os.path.join(INTERMEDIATE_ROOT, config) if config else INTERMEDIATE_ROOT
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build .p8 file from a main source file, in a single process.')
+    parser.add_argument('game_src_path', type=str,
+        help="path to the game source root, relative to the current working directory (all 'require's should be relative to it)")
+    parser.add_argument('relative_main_filepath', type=str, help="path to main lua file, relative to game_src_path")
+    parser.add_argument('required_relative_dirpath', type=str, nargs='?',
+        help="path to directory containing files to require in the main lua file, relative to game_src_path (optional)")
+    parser.add_argument('-p', '--output-path', type=str, default='.', help="path to build output directory (default: '.')")
+    parser.add_argument('-o', '--output-basename', type=str, default='game',
+        help="basename of the p8 file to build, '_{CONFIG}' is appended if config is set (default: 'game')")
+    parser.add_argument('-c', '--config', type=str, default='',
+        help="build config, used to determine the intermediate and output paths (default: '')")
+    parser.add_argument('-s', '--symbols', type=str, default='',
+        help="symbols to define for the preprocess step, separated by ',' (default: no symbols defined)")
+    parser.add_argument('-d', '--data', type=str, default='',
+        help="path to data p8 file containing gfx, gff, map, sfx and music sections (default: '')")
+    parser.add_argument('-M', '--metadata', type=str, default='',
+        help="path to the p8 file containing the label picture (default: '')")
+    parser.add_argument('-t', '--title', type=str, default='', help="game title to insert in the cartridge metadata header")
+    parser.add_argument('-a', '--author', type=str, default='', help="author name to insert in the cartridge metadata header")
+    parser.add_argument('-m', '--minify-level', type=int, default=0,
+        help="0: no minification, 1: basic minification, 2: aggressive minification (default: 0)")
+    parser.add_argument('-T', '--tree-shake', action='store_true',
+        help="remove definitions of functions never referenced from the main script")
+    parser.add_argument('-K', '--tree-shake-keep', type=str, default='',
+        help="path of a file listing names of functions to keep when using --tree-shake, one per line (default: '')")
+    parser.add_argument('--minify-engine', type=str, choices=minify.MINIFY_ENGINES, default=minify.DEFAULT_MINIFY_ENGINE,
+        help=f"minifier engine (default: {minify.DEFAULT_MINIFY_ENGINE})")
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+        help="number of processes used to preprocess files in parallel (default: 1, preprocess in this process)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    try:
+        output_filepath = build_cartridge(args.game_src_path, args.relative_main_filepath, args.required_relative_dirpath,
+            args.output_path, args.output_basename, args.config, [symbol for symbol in args.symbols.split(',') if symbol],
+            args.data, args.metadata, args.title, args.author, args.minify_level, args.tree_shake, args.tree_shake_keep,
+            args.minify_engine, args.jobs)
+    except BuildError as e:
+        logging.error(e)
+        print("")
+        print("Build failed, STOP.")
+        sys.exit(1)
+
+    print("")
+    print(f"Build succeeded: '{output_filepath}'")
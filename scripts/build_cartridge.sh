@@ -5,7 +5,7 @@ picoboots_src_path="$(dirname "$0")/../src"
 picoboots_scripts_path="$(dirname "$0")"
 
 help() {
-  echo "Build .p8 file from a main source file with picotool.
+  echo "Build .p8 file from a main source file, bundling required modules with bundle.py.
 
 It may be used to build an actual game or an integration test runner.
 
@@ -15,9 +15,6 @@ and any engine scripts by its relative path from pico-boots source directory.
 If --minify-level MINIFY_LEVEL is passed with MINIFY_LEVEL >= 1,
 the lua code of the output cartridge is minified using the local luamin installed via npm.
 
-System dependencies:
-- picotool (p8tool must be in PATH)
-
 Local dependencies:
 - luamin#feature/newline-separator (installed via npm install/update inside npm folder)
 "
@@ -101,6 +98,17 @@ OPTIONS
                                            for any key you need to preserve during minification (see README.md)
                                 (default: 0)
 
+  -T, --tree-shake              Remove definitions of functions never referenced from the main script
+                                in the intermediate game and engine sources, before the build step.
+                                Names accessed dynamically must be listed with --tree-shake-keep.
+                                (default: no tree shaking)
+
+  -K, --tree-shake-keep KEEP_FILEPATH
+                                Path of a file listing names of functions to keep when using
+                                --tree-shake, one per line.
+                                Path is relative to the current working directory.
+                                (default: '')
+
   -h, --help                    Show this help message
 "
 }
@@ -115,6 +123,8 @@ metadata_filepath=''
 title=''
 author=''
 minify_level=0
+tree_shake=false
+tree_shake_keep_filepath=''
 
 # Read arguments
 positional_args=()
@@ -210,6 +220,20 @@ while [[ $# -gt 0 ]]; do
       shift # past argument
       shift # past value
       ;;
+    -T | --tree-shake )
+      tree_shake=true
+      shift # past argument
+      ;;
+    -K | --tree-shake-keep )
+      if [[ $# -lt 2 ]] ; then
+        echo "Missing argument for $1"
+        usage
+        exit 1
+      fi
+      tree_shake_keep_filepath="$2"
+      shift # past argument
+      shift # past value
+      ;;
     -h | --help )
       help
       exit 0
@@ -259,7 +283,7 @@ rm -f "$output_filepath"
 echo ""
 echo "Pre-build..."
 
-# Copy metadata.p8 to future output file path. When generating the .p8, p8tool will preserve the __label__ present
+# Copy metadata.p8 to future output file path. When generating the .p8, bundle.py will preserve the __label__ present
 # at the output file path, so this is effectively a way to setup the label.
 # However, title and author are lost during the process and must be manually added to the header with add_metadata.py
 
@@ -286,24 +310,26 @@ if [[ -n "$config" ]] ; then
   intermediate_path+="/$config"
 fi
 
-# create intermediate directory to prepare source copy
-# (rsync can create the 'pico-boots' and 'src' sub-folders itself)
-mkdir -p "$intermediate_path"
+# Preprocess framework and game source into intermediate directory, without modifying the original files
+# (preprocess.py writes the output directly, skipping files already up to date since the last build with the same
+# symbols, and removing intermediate files whose source has been removed, so no separate copy is needed)
+# Preprocessed files are also cached in a folder shared by all configs (entries are keyed by symbols),
+# so files changed back to a previous state are not parsed again
+# Symbols are separated by space, so don't surround array var with quotes
+preprocess_options="--cache-dir \"intermediate/.preprocess_cache\" --symbols ${symbols[@]}"
+preprocess_engine_cmd="\"$picoboots_scripts_path/preprocess.py\" \"$picoboots_src_path\" --output-path \"$intermediate_path/pico-boots\" $preprocess_options"
+preprocess_game_cmd="\"$picoboots_scripts_path/preprocess.py\" \"$game_src_path\" --output-path \"$intermediate_path/src\" $preprocess_options"
+echo "> $preprocess_engine_cmd"
+bash -c "$preprocess_engine_cmd"
 
-# Copy framework and game source to intermediate directory
-# to apply pre-build steps without modifying the original files
-rsync -rl --del "$picoboots_src_path/" "$intermediate_path/pico-boots"
-rsync -rl --del "$game_src_path/" "$intermediate_path/src"
 if [[ $? -ne 0 ]]; then
   echo ""
-  echo "Copy source to intermediate step failed, STOP."
+  echo "Preprocess step failed, STOP."
   exit 1
 fi
 
-# Apply preprocessing directives for given symbols (separated by space, so don't surround array var with quotes)
-preprocess_itest_cmd="\"$picoboots_scripts_path/preprocess.py\" \"$intermediate_path\" --symbols ${symbols[@]}"
-echo "> $preprocess_itest_cmd"
-bash -c "$preprocess_itest_cmd"
+echo "> $preprocess_game_cmd"
+bash -c "$preprocess_game_cmd"
 
 if [[ $? -ne 0 ]]; then
   echo ""
@@ -311,6 +337,18 @@ if [[ $? -ne 0 ]]; then
   exit 1
 fi
 
+# Eliminate dead branches of if statements whose conditions became constant after preprocessing
+# (optimize.py preserves modification times, so incremental preprocessing is not affected)
+optimize_cmd="\"$picoboots_scripts_path/optimize.py\" \"$intermediate_path/pico-boots\" \"$intermediate_path/src\""
+echo "> $optimize_cmd"
+bash -c "$optimize_cmd"
+
+if [[ $? -ne 0 ]]; then
+  echo ""
+  echo "Optimize step failed, STOP."
+  exit 1
+fi
+
 # If building an itest main, add itest require statements
 if [[ -n "$required_relative_dirpath" ]] ; then
   add_require_itest_cmd="\"$picoboots_scripts_path/add_require.py\" \"$intermediate_path/src/$relative_main_filepath\" "$intermediate_path/src" \"$required_relative_dirpath\""
@@ -324,53 +362,53 @@ if [[ -n "$required_relative_dirpath" ]] ; then
   fi
 fi
 
+# Requires are resolved from the game source root first, then the pico-boots source root
+bundle_src_path="$intermediate_path/src"
+bundle_picoboots_path="$intermediate_path/pico-boots"
+
+# Remove functions never referenced from the main script, now that all requires are known
+# tree_shake.py modifies files in-place, so run it on a copy of the intermediate files in a separate stage directory:
+# this way, intermediate files stay up to date for incremental preprocessing, and functions removed in one build
+# are still available in the next one
+if [[ "$tree_shake" == true ]] ; then
+  tree_shake_stage_path="$intermediate_path/.tree_shake"
+  rm -rf "$tree_shake_stage_path"
+  mkdir -p "$tree_shake_stage_path"
+  cp -R "$intermediate_path/src" "$intermediate_path/pico-boots" "$tree_shake_stage_path"
+  bundle_src_path="$tree_shake_stage_path/src"
+  bundle_picoboots_path="$tree_shake_stage_path/pico-boots"
+
+  tree_shake_cmd="\"$picoboots_scripts_path/tree_shake.py\" \"$bundle_src_path/$relative_main_filepath\" --roots \"$bundle_src_path\" \"$bundle_picoboots_path\""
+  if [[ -n "$tree_shake_keep_filepath" ]] ; then
+    tree_shake_cmd+=" --keep-file \"$tree_shake_keep_filepath\""
+  fi
+  echo "> $tree_shake_cmd"
+  bash -c "$tree_shake_cmd"
+
+  if [[ $? -ne 0 ]]; then
+    echo ""
+    echo "Tree shake step failed, STOP."
+    exit 1
+  fi
+fi
+
 echo ""
 echo "Build..."
 
-# picotool uses require paths relative to the requiring scripts, so for project source we need to indicate the full path
-# support both requiring game modules and pico-boots modules
-lua_path="$(pwd)/$intermediate_path/src/?.lua;$(pwd)/$intermediate_path/pico-boots/?.lua"
+lua_roots="\"$bundle_src_path\" \"$bundle_picoboots_path\""
 
 # if passing data, add each data section to the cartridge
 if [[ -n "$data_filepath" ]] ; then
-  data_options="--gfx \"$data_filepath\" --gff \"$data_filepath\" --map \"$data_filepath\" --sfx \"$data_filepath\" --music \"$data_filepath\""
+  data_options="--data \"$data_filepath\""
 fi
 
-# Build the game from the main script
-build_cmd="p8tool build --lua \"$intermediate_path/src/$relative_main_filepath\" --lua-path=\"$lua_path\" $data_options \"$output_filepath\""
+# Build the game from the main script, bundling required modules
+build_cmd="\"$picoboots_scripts_path/bundle.py\" \"$bundle_src_path/$relative_main_filepath\" \"$output_filepath\" --roots $lua_roots $data_options"
 echo "> $build_cmd"
 
-if [[ "$config" == "release" ]]; then
-  # We are building for release, so capture warnings mentioning
-  # token count over limit.
-  # (faster than running `p8tool stats` on the output file later)
-  # Indeed, users should be able to play our cartridge with vanilla PICO-8.
-  error=$(bash -c "$build_cmd 2>&1")
-  # Store exit code for fail check later
-  build_exit_code="$?"
-  # Now still print the error for user, this includes real errors that will fail and exit below
-  # and warnings on token/character count
-  >&2 echo "$error"
-
-  # Emphasize error on token count now, with extra comments
-  # regex must be stored in string, then expanded
-  # it doesn't support \d
-  token_regex="token count ([0-9]+)"
-  if [[ "$error" =~ $token_regex ]]; then
-    # Token count above 8192 was detected by p8tool
-    # However, p8tool count is wrong as it ignores the latest counting rules
-    # which are more flexible. So just in case, we still not fail the build and
-    # only print a warning.
-    token_count=${BASH_REMATCH[1]}
-    echo "token count of $token_count detected, but p8tool counts more tokens than PICO-8, so this is only an issue beyond ~8700 tokens."
-  fi
-else
-  # Debug build is often over limit anyway, so don't check warnings
-  # (they will still be output normally)
-  bash -c "$build_cmd"
-  # Store exit code for fail check below (just to be uniform with 'release' case)
-  build_exit_code="$?"
-fi
+bash -c "$build_cmd"
+# Store exit code for fail check below
+build_exit_code="$?"
 
 if [[ "$build_exit_code" -ne 0 ]]; then
   echo ""
@@ -378,14 +416,35 @@ if [[ "$build_exit_code" -ne 0 ]]; then
   exit 1
 fi
 
+if [[ "$config" == "release" ]]; then
+  # We are building for release, so check the token count with PICO-8 rules
+  # Indeed, users should be able to play our cartridge with vanilla PICO-8.
+  # Debug build is often over limit anyway, so don't check it.
+  token_check_cmd="\"$picoboots_scripts_path/pico8_tokens.py\" \"$output_filepath\""
+  echo "> $token_check_cmd"
+  bash -c "$token_check_cmd"
+
+  if [[ $? -ne 0 ]]; then
+    echo ""
+    echo "Token count check failed, STOP."
+    exit 1
+  fi
+fi
+
 echo ""
 echo "Post-build..."
 
 if [[ "$minify_level" -gt 0  ]]; then
-  minify_cmd="$picoboots_scripts_path/minify.py \"$output_filepath\""
+  # Minified code is cached in a folder shared by all configs (entries are keyed by code and options),
+  # so luamin is not run again when only non-code data changed
+  minify_cmd="$picoboots_scripts_path/minify.py \"$output_filepath\" --cache-dir \"intermediate/.minify_cache\""
   if [[ "$minify_level" -ge 2  ]]; then
     minify_cmd+=" --aggressive-minify"
   fi
+  if [[ "$config" == "release" ]]; then
+    # Like the token count, only fail on compressed size in release (other configs only get a warning)
+    minify_cmd+=" --max-compressed-size"
+  fi
   echo "> $minify_cmd"
   bash -c "$minify_cmd"
 
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3.6
+# -*- coding: utf-8 -*-
+import argparse
+import logging
+import os
+import sys
+
+try:
+    from . import cartridge
+    from . import lua_tokenizer
+    from . import require_graph
+except ImportError:
+    # script run directly, not as part of the scripts package
+    import cartridge
+    import lua_tokenizer
+    import require_graph
+
+
+# This script builds a .p8 cartridge from a main Lua script and an optional data cartridge, in-process.
+# It replaces "p8tool build --lua main.lua --lua-path=... --gfx data.p8 ... output.p8" in the build pipeline:
+# 1. Modules required from the main script, directly or indirectly, are resolved in the passed roots
+#    (like picotool's --lua-path, see require_graph.py), each module being bundled once
+# 2. Each module is wrapped in a function registered in package._c, and require is redefined to call it
+#    on first require, with the same preamble as picotool (see get_bundled_code), so modules behave the same
+# 3. The data sections (gfx, gff, map, sfx, music) are taken from the data cartridge, if any, and other sections
+#    (e.g. __label__) are preserved from the cartridge already at the output path, if any, like picotool does
+
+# Extra notes:
+
+# a. Unlike picotool, the preamble is written in clean Lua (no PICO-8 shorthand if), and module code is copied as is,
+# without reformatting, so minify.py has nothing to clean up.
+
+# b. Modules are bundled in order of discovery from the main script (breadth-first), which doesn't matter
+# since module functions are only called on require.
+
+# c. All requires must be resolved: requires with a non-literal argument, or modules that cannot be found in any root,
+# are build errors, as picotool does.
+
+# Usage:
+# bundle.py main_filepath output_filepath --roots root1 [root2 ...] [--data data_filepath]
+
+
+# Default cartridge header when there is no existing cartridge at the output path
+DEFAULT_CARTRIDGE_HEADER_LINES = ["pico-8 cartridge // http://www.pico-8.com\n", "version 27\n"]
+
+# Sections taken from the data cartridge
+DATA_SECTION_NAMES = ['gfx', 'gff', 'map', 'sfx', 'music']
+
+# Order of sections in a cartridge written by PICO-8
+SECTION_ORDER = [cartridge.LUA_SECTION_NAME, 'gfx', 'label', 'gff', 'map', 'sfx', 'music']
+
+# Definition of require used by bundled modules, in clean Lua (picotool writes "if (l[p]==nil) l[p]=...")
+REQUIRE_FUNCTION_CODE = """function require(p)
+local l=package.loaded
+if l[p]==nil then l[p]=package._c[p]() end
+if l[p]==nil then l[p]=true end
+return l[p]
+end
+"""
+
+
+class BundleError(Exception):
+    """Raised when the main script cannot be bundled"""
+    pass
+
+
+def bundle_cartridge(main_filepath, roots, output_filepath, data_filepath=None):
+    """
+    Build the .p8 cartridge at output_filepath from main_filepath, bundling the modules it requires
+    from roots (list of directory paths, in order of priority), with the data sections of the cartridge
+    at data_filepath if any, and the other sections of the cartridge already at output_filepath if any.
+    Raise BundleError if some require cannot be resolved, or some module cannot be tokenized.
+
+    """
+    lua_code = bundle_lua(main_filepath, roots)
+
+    existing_sections = cartridge.read_sections(output_filepath) if os.path.isfile(output_filepath) else None
+    data_sections = cartridge.read_sections(data_filepath) if data_filepath else None
+
+    with open(output_filepath, 'w') as output_file:
+        cartridge.write_sections(output_file, merge_sections(lua_code, existing_sections, data_sections))
+
+
+def bundle_lua(main_filepath, roots):
+    """
+    Return the code of main_filepath with the modules it requires from roots bundled before it
+    (see get_bundled_code).
+    Raise BundleError if some require cannot be resolved, or some module cannot be tokenized.
+
+    """
+    main_module, code_by_module = read_bundled_sources(main_filepath, roots)
+    main_code = code_by_module.pop(main_module)
+    return get_bundled_code(main_code, code_by_module)
+
+
+def read_bundled_sources(main_filepath, roots):
+    """
+    Return (module name of main_filepath, dict of code by module name) for main_filepath and all the modules it requires
+    from roots, directly or indirectly, in bundle order.
+    Raise BundleError if some require cannot be resolved, or some module cannot be tokenized.
+
+    """
+    try:
+        graph = require_graph.build_require_graph(main_filepath, roots)
+    except (ValueError, lua_tokenizer.LuaTokenizeError) as e:
+        raise BundleError(str(e))
+
+    if graph.unresolved_requires:
+        unresolved_requires_text = ", ".join(f"{required_module} (required by {module})"
+            for module, required_module in graph.unresolved_requires)
+        raise BundleError(f"could not resolve requires in roots {roots}: {unresolved_requires_text}")
+
+    code_by_module = {}
+    for node in graph.nodes.values():
+        with open(node.filepath, 'r') as lua_file:
+            code_by_module[node.module] = lua_file.read()
+    return graph.entry_module, code_by_module
+
+
+def get_bundled_code(main_code, code_by_module):
+    """
+    Return main_code (string) preceded by the wrapped code of each module in code_by_module (dict of code by module
+    name, in bundle order) and the definition of require, or main_code alone if there is no module
+
+    >>> print(get_bundled_code('require("a")\\n', {'a': 'x = 1\\n'}), end='')
+    package={loaded={},_c={}}
+    package._c["a"]=function()
+    x = 1
+    end
+    function require(p)
+    local l=package.loaded
+    if l[p]==nil then l[p]=package._c[p]() end
+    if l[p]==nil then l[p]=true end
+    return l[p]
+    end
+    require("a")
+
+    """
+    if not code_by_module:
+        return main_code
+
+    texts = ["package={loaded={},_c={}}\n"]
+    for module, code in code_by_module.items():
+        texts.append(f'package._c["{module}"]=function()\n')
+        texts.append(code)
+        if not code.endswith("\n"):
+            # a final comment would swallow the end keyword
+            texts.append("\n")
+        texts.append("end\n")
+    texts.append(REQUIRE_FUNCTION_CODE)
+    texts.append(main_code)
+    return "".join(texts)
+
+
+def merge_sections(lua_code, existing_sections=None, data_sections=None):
+    """
+    Return the sections of a cartridge with lua_code, the data sections of data_sections (if not None),
+    and the other sections of existing_sections (if not None), in SECTION_ORDER
+
+    """
+    lines_by_section_name = {}
+    header_lines = list(DEFAULT_CARTRIDGE_HEADER_LINES)
+
+    if existing_sections is not None:
+        header_lines = cartridge.get_section_lines(existing_sections, None) or header_lines
+        for name, lines in existing_sections:
+            if name is not None and name != cartridge.LUA_SECTION_NAME:
+                lines_by_section_name.setdefault(name, lines)
+
+    if data_sections is not None:
+        for name in DATA_SECTION_NAMES:
+            lines = cartridge.get_section_lines(data_sections, name)
+            if lines is not None:
+                lines_by_section_name[name] = lines
+
+    # only split on "\n" (str.splitlines also splits on other characters, which may appear in strings)
+    lua_lines = [f"{line}\n" for line in lua_code.split("\n")]
+    if lua_code.endswith("\n") or not lua_code:
+        lua_lines.pop()
+    lines_by_section_name[cartridge.LUA_SECTION_NAME] = lua_lines
+
+    sections = [(None, header_lines)]
+    for name in SECTION_ORDER:
+        if name in lines_by_section_name:
+            sections.append((name, lines_by_section_name.pop(name)))
+    # keep any other section (e.g. __meta:*__) at the end, in original order
+    sections += list(lines_by_section_name.items())
+    return sections
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build a .p8 cartridge from a main Lua script, bundling required modules.')
+    parser.add_argument('main_path', type=str, help='path of the main Lua script')
+    parser.add_argument('output_path', type=str,
+        help='path of the .p8 cartridge to build (sections other than code and data are preserved if it exists)')
+    parser.add_argument('-r', '--roots', type=str, nargs='+', required=True,
+        help='paths of the directories from which required modules are resolved, in order of priority')
+    parser.add_argument('-d', '--data', type=str,
+        help='path of the .p8 cartridge to take data sections (gfx, gff, map, sfx, music) from (optional)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    try:
+        bundle_cartridge(args.main_path, args.roots, args.output_path, args.data)
+    except BundleError as e:
+        logging.error(e)
+        sys.exit(1)
+
+    print(f"Built {args.output_path} from {args.main_path}.")
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3.6
+# -*- coding: utf-8 -*-
+import re
+
+# This module reads and writes the sections of a PICO-8 text cartridge (.p8), in a single pass over the file.
+# A .p8 file is made of a header ("pico-8 cartridge // http://www.pico-8.com" and "version X" lines),
+# followed by sections, each starting with a section header line like "__lua__" or "__gfx__".
+
+# Usage:
+#   sections = read_sections('game.p8')
+#   lua_lines = get_section_lines(sections, 'lua')
+
+
+# Name of the code section
+LUA_SECTION_NAME = 'lua'
+
+# Section header line, capturing the section name, e.g. "__lua__" -> "lua", "__meta:title__" -> "meta:title"
+# Only known sections are recognized, so a line of code like "__foo__" in the __lua__ section is not mistaken for one.
+section_header_pattern = re.compile(r"__(lua|gfx|gff|label|map|sfx|music|meta:\w+)__\s*$")
+
+
+def read_sections(filepath):
+    """
+    Return the list of sections of the .p8 cartridge at filepath (see split_sections)
+
+    """
+    with open(filepath, 'r') as f:
+        return split_sections(f)
+
+
+def split_sections(lines):
+    """
+    Return the list of sections found in iterable lines of a .p8 cartridge, in order, as pairs (section_name, lines)
+    where lines don't include the section header line itself.
+    The first pair is always the cartridge header, with section name None.
+
+    >>> split_sections(['pico-8 cartridge // http://www.pico-8.com\\n', 'version 27\\n', '__lua__\\n', 'print(1)\\n'])
+    [(None, ['pico-8 cartridge // http://www.pico-8.com\\n', 'version 27\\n']), ('lua', ['print(1)\\n'])]
+
+    """
+    current_section_lines = []
+    sections = [(None, current_section_lines)]
+    for line in lines:
+        section_header_match = section_header_pattern.match(line)
+        if section_header_match:
+            current_section_lines = []
+            sections.append((section_header_match.group(1), current_section_lines))
+        else:
+            current_section_lines.append(line)
+    return sections
+
+
+def get_section_lines(sections, section_name):
+    """Return the lines of the first section named section_name in sections, or None if there is none"""
+    for name, lines in sections:
+        if name == section_name:
+            return lines
+    return None
+
+
+def replace_section_lines(sections, section_name, new_lines):
+    """
+    Return a copy of sections where the lines of the first section named section_name are replaced with new_lines.
+    Raise ValueError if there is no such section.
+
+    """
+    for index, (name, _lines) in enumerate(sections):
+        if name == section_name:
+            return sections[:index] + [(name, list(new_lines))] + sections[index + 1:]
+    raise ValueError(f"no section '{section_name}' found")
+
+
+def write_sections(f, sections):
+    """Write sections (as returned by split_sections) to file f (file descriptor: write)"""
+    f.writelines(generate_lines(sections))
+
+
+def generate_lines(sections):
+    """Yield each line of a .p8 cartridge made of sections (as returned by split_sections), including section headers"""
+    for name, lines in sections:
+        if name is not None:
+            yield f"__{name}__\n"
+        yield from lines
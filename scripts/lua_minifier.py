@@ -0,0 +1,614 @@
+#!/usr/bin/env python3.6
+# -*- coding: utf-8 -*-
+import itertools
+import string
+from enum import Enum
+
+try:
+    from . import lua_tokenizer
+    from .lua_tokenizer import TokenType
+except ImportError:
+    # script run directly, not as part of the scripts package
+    import lua_tokenizer
+    from lua_tokenizer import TokenType
+
+
+# This module minifies clean Lua code in-process, as an alternative to luamin (see minify.py). Like luamin -fn, it:
+# 1. strips comments and whitespace, keeping only the separators required between tokens
+# 2. renames local variables to the shortest names available
+# 3. separates statements with a newline instead of ";", only when a separator is required
+# With minify_member_names, it also renames member names and table keys like luamin -fnmk.
+
+# Extra notes:
+
+# a. Like luamin, local names are mapped by original name over the whole file, in order of first appearance,
+# so all the locals with the same name get the same short name. Short names are never keywords nor global names
+# used anywhere in the file, so renaming never changes which variable a name refers to.
+# "self" is never renamed.
+
+# b. Like luamin, statements are only separated by a newline when their tokens would otherwise merge
+# (e.g. "a=2" followed by "b=3"), while other tokens are separated by a space when required (e.g. "local a").
+
+# c. When minifying member names, all member names and table keys that don't start with "_" are renamed,
+# with the same mapping as locals, so a key always gets the same short name, whatever the table.
+# Keys defined or accessed with a string, e.g. ["key"], are preserved.
+
+# d. Unlike luamin, brackets in expressions are always preserved (luamin sometimes drops required brackets,
+# see https://github.com/mathiasbynens/luamin/issues/50), and statements starting with a bracket are separated
+# from the previous statement with ";" so they are not parsed as a call.
+
+# e. PICO-8 specific operators ("!=", "+=", "\", "^^", etc.) are supported, but not PICO-8 shorthands
+# like "if (cond) statement" or "?" (minify.py converts one-line ifs with clean_lua beforehand).
+
+
+# Increment this every time the output of minify_lua changes for the same input, so cached minified code is invalidated
+MINIFIER_VERSION = 1
+
+
+# Role of a name token in the source code, defining how it is renamed
+class NameRole(Enum):
+    LOCAL  = 1  # local variable or parameter: always renamed
+    GLOBAL = 2  # global variable: never renamed
+    MEMBER = 3  # member name after "." or ":", or table key in a constructor: renamed with minify_member_names
+    KEPT   = 4  # label or "self": never renamed
+
+
+# Marker placed between two statements of the same block in the parsed items
+class StatementBreak(Enum):
+    NORMAL  = 1  # before any other statement: newline if a separator is required
+    BRACKET = 2  # before a statement starting with a bracket
+
+
+class LuaMinifyError(Exception):
+    """
+    Raised when source code cannot be minified because of a syntax error
+
+    position  int  index of the character where the error was detected
+
+    """
+
+    def __init__(self, message, position):
+        super().__init__(f"{message} at index {position}")
+        self.position = position
+
+
+# Names that must never be generated, besides global names
+reserved_names = lua_tokenizer.keywords | {'self'}
+
+identifier_start_chars = string.ascii_lowercase + string.ascii_uppercase
+identifier_part_chars = identifier_start_chars + string.digits
+
+block_end_keywords = {'end', 'else', 'elseif', 'until'}
+unary_operators = {'not', '-', '#', '~', '@', '%', '$'}
+binary_operators = {
+    'or', 'and',
+    '<', '>', '<=', '>=', '~=', '!=', '==',
+    '|', '~', '&', '<<', '>>', '>>>', '<<>', '>><', '^^',
+    '..', '+', '-', '*', '/', '//', '\\', '%', '^',
+}
+compound_assignment_operators = {
+    '+=', '-=', '*=', '/=', '\\=', '%=', '^=', '..=', '|=', '&=', '^^=', '<<=', '>>=', '>>>=', '<<>=', '>><=', '//='
+}
+
+
+def minify_lua(source, minify_member_names=False):
+    """
+    Return the minified version of Lua source (string), ending with a newline.
+    Raise LuaMinifyError if source is not valid Lua.
+
+    >>> minify_lua('local my_var = 1 -- comment\\nprint(my_var)')
+    'local a=1\\nprint(a)\\n'
+
+    """
+    try:
+        tokens = [token for token in lua_tokenizer.tokenize(source) if not lua_tokenizer.is_blank_token(token)]
+    except lua_tokenizer.LuaTokenizeError as e:
+        raise LuaMinifyError(str(e).rsplit(' at index ', 1)[0], e.position)
+
+    parser = Parser(tokens, len(source))
+    parser.parse_chunk()
+
+    short_name_by_original_name = generate_short_names(parser.items, parser.global_names, minify_member_names)
+    return join_items(parser.items, short_name_by_original_name, minify_member_names)
+
+
+def generate_short_names(items, global_names, minify_member_names):
+    """
+    Return a dict mapping each renamed original name in items to its short name,
+    assigning short names in order of first appearance (see note a.)
+
+    """
+    excluded_names = reserved_names | global_names
+    identifiers = (identifier for identifier in generate_identifiers() if identifier not in excluded_names)
+
+    short_name_by_original_name = {}
+    for item in items:
+        if isinstance(item, ParsedName) and is_renamed(item, minify_member_names) and \
+                item.token.text not in short_name_by_original_name:
+            short_name_by_original_name[item.token.text] = next(identifiers)
+    return short_name_by_original_name
+
+
+def generate_identifiers():
+    """Generate all the valid identifiers made of letters and digits, shortest first: a, b, ..., Z, aa, ab, ..."""
+    for length in itertools.count(1):
+        for first_char in identifier_start_chars:
+            for other_chars in itertools.product(identifier_part_chars, repeat=length - 1):
+                yield first_char + "".join(other_chars)
+
+
+def is_renamed(parsed_name, minify_member_names):
+    """Return true iff parsed_name (ParsedName) must be renamed"""
+    if parsed_name.role is NameRole.LOCAL:
+        return True
+    if parsed_name.role is NameRole.MEMBER:
+        return minify_member_names and not parsed_name.token.text.startswith('_')
+    return False
+
+
+def join_items(items, short_name_by_original_name, minify_member_names):
+    """Return the minified code built from parsed items, renaming names with short_name_by_original_name"""
+    parts = []
+    previous_token = None
+    previous_text = None
+    statement_break = None
+
+    for item in items:
+        if isinstance(item, StatementBreak):
+            statement_break = item
+            continue
+
+        if isinstance(item, ParsedName):
+            token = item.token
+            text = short_name_by_original_name[token.text] if is_renamed(item, minify_member_names) else token.text
+        else:
+            token = item
+            text = token.text
+
+        if previous_token is not None:
+            if statement_break is StatementBreak.BRACKET:
+                parts.append(";")
+            elif is_separator_required(previous_token, previous_text, token, text):
+                parts.append("\n" if statement_break is StatementBreak.NORMAL else " ")
+
+        parts.append(text)
+        previous_token = token
+        previous_text = text
+        statement_break = None
+
+    parts.append("\n")
+    return "".join(parts)
+
+
+def is_separator_required(previous_token, previous_text, token, text):
+    """Return true iff a separator is required between previous_text and text so they are not read as one token"""
+    last_char = previous_text[-1]
+    first_char = text[0]
+
+    if (last_char.isalnum() or last_char == '_') and (first_char.isalnum() or first_char == '_'):
+        # e.g. "local" + "a", "2" + "and"
+        return True
+    if previous_token.token_type is TokenType.NUMBER and first_char == '.':
+        # e.g. "1" + ".."
+        return True
+    if last_char == '-' and first_char == '-':
+        # e.g. "-" + "-1", which would start a comment
+        return True
+    if last_char == '[' and (first_char == '[' or first_char == '='):
+        # e.g. "[" + "[[text]]", which would start a long string
+        return True
+    if previous_token.token_type is TokenType.OPERATOR and \
+            (token.token_type is TokenType.OPERATOR or token.token_type is TokenType.NUMBER):
+        # e.g. "=" + "=", "<" + "<=", ".." + ".5"
+        return next(lua_tokenizer.tokenize(previous_text + text)).text != previous_text
+    return False
+
+
+class ParsedName:
+    """
+    Name token with its role
+
+    token  Token     name token
+    role   NameRole  role of the name, defining how it is renamed
+
+    """
+
+    __slots__ = ('token', 'role')
+
+    def __init__(self, token, role):
+        self.token = token
+        self.role = role
+
+
+class Parser:
+    """
+    Recursive descent parser for Lua, only keeping track of what is needed to minify the code:
+    statement boundaries, and the role of each name (local, global or member), based on local scopes.
+
+    Parsing produces items, the list of significant tokens in order, where name tokens are wrapped in ParsedName,
+    and where StatementBreak markers are inserted between statements.
+
+    """
+
+    def __init__(self, tokens, source_length):
+        self.tokens = tokens
+        self.source_length = source_length
+        self.index = 0
+        self.items = []
+        # stack of sets of local names declared in each open scope, innermost last
+        self.scopes = [set()]
+        self.global_names = set()
+
+    # Token helpers
+
+    def peek_text(self, offset=0):
+        """Return the text of the token at offset from the current token, or None after the end"""
+        index = self.index + offset
+        return self.tokens[index].text if index < len(self.tokens) else None
+
+    def peek_type(self):
+        """Return the type of the current token, or None after the end"""
+        return self.tokens[self.index].token_type if self.index < len(self.tokens) else None
+
+    def is_at(self, text):
+        """Return true iff the current token is a keyword or operator with the given text"""
+        return self.index < len(self.tokens) and self.tokens[self.index].text == text and \
+            self.tokens[self.index].token_type in (TokenType.KEYWORD, TokenType.OPERATOR)
+
+    def error(self, message):
+        position = self.tokens[self.index].start if self.index < len(self.tokens) else self.source_length
+        found = repr(self.tokens[self.index].text) if self.index < len(self.tokens) else "end of source"
+        raise LuaMinifyError(f"{message}, found {found}", position)
+
+    def consume(self):
+        """Add the current token to items and move on to the next token"""
+        self.items.append(self.tokens[self.index])
+        self.index += 1
+
+    def accept(self, text):
+        """Consume the current token if it is a keyword or operator with the given text, and return true iff it was"""
+        if self.is_at(text):
+            self.consume()
+            return True
+        return False
+
+    def expect(self, text):
+        if not self.accept(text):
+            self.error(f"expected '{text}'")
+
+    def consume_name(self, role):
+        """Consume the current token as a name with the given role"""
+        if self.peek_type() is not TokenType.NAME:
+            self.error("expected name")
+        token = self.tokens[self.index]
+        if token.text == 'self':
+            role = NameRole.KEPT
+        self.items.append(ParsedName(token, role))
+        self.index += 1
+
+    def consume_variable_name(self):
+        """Consume the current token as a reference to a local or global variable"""
+        if self.peek_type() is not TokenType.NAME:
+            self.error("expected name")
+        name = self.tokens[self.index].text
+        if self.is_local(name):
+            self.consume_name(NameRole.LOCAL)
+        else:
+            self.global_names.add(name)
+            self.consume_name(NameRole.GLOBAL)
+
+    # Scope helpers
+
+    def is_local(self, name):
+        return any(name in scope for scope in self.scopes)
+
+    def open_scope(self):
+        self.scopes.append(set())
+
+    def close_scope(self):
+        self.scopes.pop()
+
+    def declare_local(self, name):
+        self.scopes[-1].add(name)
+
+    # Blocks and statements
+
+    def parse_chunk(self):
+        self.parse_block()
+        if self.index < len(self.tokens):
+            self.error("expected statement")
+
+    def parse_block(self):
+        """Parse statements until the end of the current block, without opening a scope"""
+        is_first_statement = True
+        while self.index < len(self.tokens) and not (self.peek_type() is TokenType.KEYWORD and self.peek_text() in block_end_keywords):
+            if self.accept_empty_statement():
+                continue
+
+            if not is_first_statement:
+                if self.is_at('('):
+                    self.items.append(StatementBreak.BRACKET)
+                else:
+                    self.items.append(StatementBreak.NORMAL)
+            is_first_statement = False
+
+            if self.is_at('return'):
+                self.parse_return_statement()
+                break
+
+            self.parse_statement()
+
+        if self.is_at('return'):
+            self.error("expected end of block after return statement")
+
+    def accept_empty_statement(self):
+        """Skip ';' without adding it to items, and return true iff there was one"""
+        if self.is_at(';'):
+            self.index += 1
+            return True
+        return False
+
+    def parse_return_statement(self):
+        self.expect('return')
+        if self.index < len(self.tokens) and not self.is_at(';') and \
+                not (self.peek_type() is TokenType.KEYWORD and self.peek_text() in block_end_keywords):
+            self.parse_expression_list()
+        self.accept_empty_statement()
+
+    def parse_statement(self):
+        text = self.peek_text()
+        token_type = self.peek_type()
+
+        if token_type is TokenType.KEYWORD:
+            if text == 'if':
+                self.parse_if_statement()
+            elif text == 'while':
+                self.consume()
+                self.parse_expression()
+                self.expect('do')
+                self.parse_scoped_block()
+                self.expect('end')
+            elif text == 'do':
+                self.consume()
+                self.parse_scoped_block()
+                self.expect('end')
+            elif text == 'for':
+                self.parse_for_statement()
+            elif text == 'repeat':
+                self.consume()
+                # the condition can use locals declared in the block
+                self.open_scope()
+                self.parse_block()
+                self.expect('until')
+                self.parse_expression()
+                self.close_scope()
+            elif text == 'function':
+                self.parse_function_statement()
+            elif text == 'local':
+                self.parse_local_statement()
+            elif text == 'break':
+                self.consume()
+            elif text == 'goto':
+                self.consume()
+                self.consume_name(NameRole.KEPT)
+            else:
+                self.error("expected statement")
+        elif self.is_at('::'):
+            self.consume()
+            self.consume_name(NameRole.KEPT)
+            self.expect('::')
+        else:
+            self.parse_expression_statement()
+
+    def parse_scoped_block(self):
+        self.open_scope()
+        self.parse_block()
+        self.close_scope()
+
+    def parse_if_statement(self):
+        self.expect('if')
+        self.parse_expression()
+        self.expect('then')
+        self.parse_scoped_block()
+        while self.accept('elseif'):
+            self.parse_expression()
+            self.expect('then')
+            self.parse_scoped_block()
+        if self.accept('else'):
+            self.parse_scoped_block()
+        self.expect('end')
+
+    def parse_for_statement(self):
+        self.expect('for')
+        if self.peek_text(1) == '=':
+            # numeric for: bounds are evaluated outside the loop scope
+            name = self.peek_text()
+            self.consume_name(NameRole.LOCAL)
+            self.expect('=')
+            self.parse_expression_list()
+            self.expect('do')
+            self.open_scope()
+            self.declare_local(name)
+        else:
+            # generic for
+            names = self.parse_local_name_list()
+            self.expect('in')
+            self.parse_expression_list()
+            self.expect('do')
+            self.open_scope()
+            for name in names:
+                self.declare_local(name)
+        self.parse_block()
+        self.close_scope()
+        self.expect('end')
+
+    def parse_function_statement(self):
+        self.expect('function')
+        self.consume_variable_name()
+        is_method = False
+        while self.is_at('.') or self.is_at(':'):
+            is_method = self.is_at(':')
+            self.consume()
+            self.consume_name(NameRole.MEMBER)
+            if is_method:
+                break
+        self.parse_function_body(is_method)
+
+    def parse_local_statement(self):
+        self.expect('local')
+        if self.accept('function'):
+            # the function can call itself recursively
+            name = self.peek_text()
+            self.consume_name(NameRole.LOCAL)
+            self.declare_local(name)
+            self.parse_function_body()
+            return
+
+        names = self.parse_local_name_list()
+        if self.accept('='):
+            # expressions are evaluated before the new locals are declared
+            self.parse_expression_list()
+        for name in names:
+            self.declare_local(name)
+
+    def parse_local_name_list(self):
+        """Parse a list of names of new locals, without declaring them yet, and return the list of names"""
+        names = [self.peek_text()]
+        self.consume_name(NameRole.LOCAL)
+        while self.accept(','):
+            names.append(self.peek_text())
+            self.consume_name(NameRole.LOCAL)
+        return names
+
+    def parse_expression_statement(self):
+        is_call = self.parse_suffixed_expression()
+        if self.is_at('=') or self.is_at(','):
+            while self.accept(','):
+                self.parse_suffixed_expression()
+            self.expect('=')
+            self.parse_expression_list()
+        elif self.peek_type() is TokenType.OPERATOR and self.peek_text() in compound_assignment_operators:
+            self.consume()
+            self.parse_expression()
+        elif not is_call:
+            self.error("expected assignment or call")
+
+    # Expressions
+
+    def parse_expression_list(self):
+        self.parse_expression()
+        while self.accept(','):
+            self.parse_expression()
+
+    def parse_expression(self):
+        self.parse_unary_expression()
+        while self.peek_type() in (TokenType.KEYWORD, TokenType.OPERATOR) and self.peek_text() in binary_operators:
+            self.consume()
+            self.parse_unary_expression()
+
+    def parse_unary_expression(self):
+        while self.peek_type() in (TokenType.KEYWORD, TokenType.OPERATOR) and self.peek_text() in unary_operators:
+            self.consume()
+        self.parse_simple_expression()
+
+    def parse_simple_expression(self):
+        token_type = self.peek_type()
+        text = self.peek_text()
+        if token_type is TokenType.NUMBER or token_type is TokenType.STRING or \
+                token_type is TokenType.KEYWORD and text in ('nil', 'true', 'false') or self.is_at('...'):
+            self.consume()
+        elif self.is_at('{'):
+            self.parse_table_constructor()
+        elif self.is_at('function'):
+            self.consume()
+            self.parse_function_body()
+        else:
+            self.parse_suffixed_expression()
+
+    def parse_suffixed_expression(self):
+        """Parse a variable, call or bracketed expression with all its suffixes, and return true iff it ends with a call"""
+        if self.peek_type() is TokenType.NAME:
+            self.consume_variable_name()
+        elif self.accept('('):
+            self.parse_expression()
+            self.expect(')')
+        else:
+            self.error("expected expression")
+
+        is_call = False
+        while True:
+            if self.is_at('.'):
+                self.consume()
+                self.consume_name(NameRole.MEMBER)
+                is_call = False
+            elif self.is_at('['):
+                self.consume()
+                self.parse_expression()
+                self.expect(']')
+                is_call = False
+            elif self.is_at(':'):
+                self.consume()
+                self.consume_name(NameRole.MEMBER)
+                self.parse_call_arguments()
+                is_call = True
+            elif self.is_at('(') or self.is_at('{') or self.peek_type() is TokenType.STRING:
+                self.parse_call_arguments()
+                is_call = True
+            else:
+                return is_call
+
+    def parse_call_arguments(self):
+        if self.accept('('):
+            if not self.is_at(')'):
+                self.parse_expression_list()
+            self.expect(')')
+        elif self.is_at('{'):
+            self.parse_table_constructor()
+        elif self.peek_type() is TokenType.STRING:
+            self.consume()
+        else:
+            self.error("expected call arguments")
+
+    def parse_table_constructor(self):
+        self.expect('{')
+        while not self.is_at('}'):
+            if self.is_at('['):
+                self.consume()
+                self.parse_expression()
+                self.expect(']')
+                self.expect('=')
+                self.parse_expression()
+            elif self.peek_type() is TokenType.NAME and self.peek_text(1) == '=':
+                self.consume_name(NameRole.MEMBER)
+                self.expect('=')
+                self.parse_expression()
+            else:
+                self.parse_expression()
+
+            if self.is_at(',') or self.is_at(';'):
+                # always use ',' and drop the trailing separator
+                self.index += 1
+                if not self.is_at('}'):
+                    self.items.append(self.tokens[self.index - 1]._replace(text=','))
+            elif not self.is_at('}'):
+                self.error("expected ',' or '}' in table constructor")
+        self.expect('}')
+
+    def parse_function_body(self, is_method=False):
+        self.expect('(')
+        self.open_scope()
+        if is_method:
+            self.declare_local('self')
+        if not self.is_at(')'):
+            while True:
+                if self.accept('...'):
+                    break
+                name = self.peek_text()
+                self.consume_name(NameRole.LOCAL)
+                self.declare_local(name)
+                if not self.accept(','):
+                    break
+        self.expect(')')
+        self.parse_block()
+        self.close_scope()
+        self.expect('end')
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3.6
+# -*- coding: utf-8 -*-
+import re
+from collections import namedtuple
+from enum import Enum
+
+
+# This module splits Lua source code into tokens. It is shared by the build scripts that need to understand
+# Lua code beyond simple line patterns (e.g. to find where a multi-line call ends).
+# It supports PICO-8 specific operators such as "!=", "+=", "\" or "^^", and accepts any unknown character
+# (e.g. PICO-8 glyphs) as a token of its own, so it never fails on valid PICO-8 code.
+# Tokenization is lossless: concatenating the text of all the tokens gives back the original source code.
+
+
+# Type of each token
+class TokenType(Enum):
+    WHITESPACE = 1  # blanks, including newlines
+    COMMENT    = 2  # short comment (without the final newline) or long comment
+    NAME       = 3  # identifier
+    KEYWORD    = 4  # reserved word
+    NUMBER     = 5  # numeric literal
+    STRING     = 6  # short or long string literal, including quotes/brackets
+    OPERATOR   = 7  # operator or punctuation
+    UNKNOWN    = 8  # any other character, e.g. PICO-8 glyphs
+
+
+# token_type  TokenType  type of the token
+# text        str        text of the token, as it appears in the source code
+# start       int        index of the first character of the token in the source code
+Token = namedtuple('Token', ['token_type', 'text', 'start'])
+
+
+class LuaTokenizeError(Exception):
+    """
+    Raised when source code cannot be tokenized
+
+    position      int   index of the character where the error was detected
+    is_unfinished bool  true iff the error is due to the source code ending inside a string or a long comment,
+                        which means it may be tokenized successfully once more code is appended
+
+    """
+
+    def __init__(self, message, position, is_unfinished):
+        super().__init__(f"{message} at index {position}")
+        self.position = position
+        self.is_unfinished = is_unfinished
+
+
+keywords = {
+    'and', 'break', 'do', 'else', 'elseif', 'end', 'false', 'for', 'function', 'goto', 'if', 'in',
+    'local', 'nil', 'not', 'or', 'repeat', 'return', 'then', 'true', 'until', 'while'
+}
+
+# Operators and punctuation, including PICO-8 specific ones. Longer operators must come first.
+operators = [
+    '>>>=', '<<>=', '>><=', '^^=',
+    '...', '..=', '>>>', '<<>', '>><', '<<=', '>>=', '//=',
+    '..', '==', '~=', '!=', '<=', '>=', '<<', '>>', '^^', '//', '::',
+    '+=', '-=', '*=', '/=', '\\=', '%=', '^=', '|=', '&=',
+    '+', '-', '*', '/', '\\', '%', '^', '#', '&', '~', '|', '<', '>', '=',
+    '(', ')', '{', '}', '[', ']', ';', ':', ',', '.', '@', '$', '?', '!',
+]
+
+# Regex patterns
+
+# Tokens that don't need special scanning. Numbers come before operators so ".5" is not parsed as "." + "5".
+simple_token_pattern = re.compile(
+    r"(?P<whitespace>\s+)"
+    r"|(?P<name>[A-Za-z_][A-Za-z0-9_]*)"
+    r"|(?P<number>0[xX][0-9a-fA-F]*(?:\.[0-9a-fA-F]*)?(?:[pP][+-]?[0-9]+)?"
+    r"|0[bB][01]*(?:\.[01]*)?"
+    r"|(?:[0-9]+(?:\.[0-9]*)?|\.[0-9]+)(?:[eE][+-]?[0-9]+)?)"
+    rf"|(?P<operator>{'|'.join(re.escape(operator) for operator in operators)})"
+)
+# Complete short string by quote, allowing escaped characters including escaped newlines
+short_string_patterns = {
+    quote: re.compile(rf"{quote}(?:[^{quote}\\\n]|\\[\s\S])*{quote}") for quote in ('"', "'")
+}
+# Start of short string by quote, until the first unescaped newline or the end of the source
+unfinished_short_string_patterns = {
+    quote: re.compile(rf"{quote}(?:[^{quote}\\\n]|\\[\s\S])*\\?") for quote in ('"', "'")
+}
+# Opening long bracket, e.g. "[[" or "[==[", capturing the equal signs
+long_bracket_start_pattern = re.compile(r"\[(=*)\[")
+
+
+def tokenize(source):
+    """
+    Generate all the tokens (Token) of source (string), in order, including whitespaces and comments.
+    Raise LuaTokenizeError if a string or long comment is not closed properly.
+
+    >>> list(tokenize('x = "a" -- b'))
+    [Token(NAME, 'x', 0), Token(WHITESPACE, ' ', 1), Token(OPERATOR, '=', 2), Token(WHITESPACE, ' ', 3),
+     Token(STRING, '"a"', 4), Token(WHITESPACE, ' ', 7), Token(COMMENT, '-- b', 8)]
+
+    """
+    position = 0
+    source_length = len(source)
+
+    while position < source_length:
+        char = source[position]
+
+        if char == '-' and source.startswith('--', position):
+            long_bracket_start_match = long_bracket_start_pattern.match(source, position + 2)
+            if long_bracket_start_match:
+                end = find_long_bracket_end(source, long_bracket_start_match, 'long comment')
+            else:
+                end = source.find('\n', position)
+                if end == -1:
+                    end = source_length
+            yield Token(TokenType.COMMENT, source[position:end], position)
+
+        elif char == '"' or char == "'":
+            end = find_short_string_end(source, position)
+            yield Token(TokenType.STRING, source[position:end], position)
+
+        elif char == '[' and long_bracket_start_pattern.match(source, position):
+            end = find_long_bracket_end(source, long_bracket_start_pattern.match(source, position), 'long string')
+            yield Token(TokenType.STRING, source[position:end], position)
+
+        else:
+            simple_token_match = simple_token_pattern.match(source, position)
+            if simple_token_match:
+                end = simple_token_match.end()
+                text = simple_token_match.group()
+                token_kind = simple_token_match.lastgroup
+                if token_kind == 'whitespace':
+                    token_type = TokenType.WHITESPACE
+                elif token_kind == 'name':
+                    token_type = TokenType.KEYWORD if text in keywords else TokenType.NAME
+                elif token_kind == 'number':
+                    token_type = TokenType.NUMBER
+                else:
+                    token_type = TokenType.OPERATOR
+                yield Token(token_type, text, position)
+            else:
+                end = position + 1
+                yield Token(TokenType.UNKNOWN, char, position)
+
+        position = end
+
+
+def find_long_bracket_end(source, long_bracket_start_match, construct_name):
+    """
+    Return the index just after the closing long bracket matching the opening long bracket matched by
+    long_bracket_start_match in source. Raise LuaTokenizeError if there is none.
+
+    """
+    closing_bracket = f"]{long_bracket_start_match.group(1)}]"
+    closing_bracket_start = source.find(closing_bracket, long_bracket_start_match.end())
+    if closing_bracket_start == -1:
+        raise LuaTokenizeError(f"unfinished {construct_name}", long_bracket_start_match.start(), True)
+    return closing_bracket_start + len(closing_bracket)
+
+
+def find_short_string_end(source, start):
+    """
+    Return the index just after the closing quote of the short string starting at index start in source.
+    Raise LuaTokenizeError if there is none.
+
+    """
+    short_string_match = short_string_patterns[source[start]].match(source, start)
+    if short_string_match:
+        return short_string_match.end()
+
+    # no closing quote: the string was either interrupted by an unescaped newline, or by the end of the source
+    unfinished_short_string_match = unfinished_short_string_patterns[source[start]].match(source, start)
+    is_unfinished = unfinished_short_string_match.end() == len(source)
+    raise LuaTokenizeError("unfinished string", start, is_unfinished)
+
+
+def is_blank_token(token):
+    """Return true iff token is a whitespace or a comment"""
+    return token.token_type is TokenType.WHITESPACE or token.token_type is TokenType.COMMENT
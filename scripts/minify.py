@@ -1,32 +1,81 @@
 #!/usr/bin/env python3.6
 # -*- coding: utf-8 -*-
 import argparse
+import hashlib
+import json
 import logging
 import os, sys
 import shutil, tempfile
 import re
-from enum import Enum
+import socket
+import stat
+import subprocess
+import time
 from subprocess import Popen, PIPE
 
-# Dependencies:
-#   - p8tool (from picotool repo) must be in PATH
+try:
+    from . import cartridge
+    from . import lua_minifier
+    from . import pico8_compression
+except ImportError:
+    # script run directly, not as part of the scripts package
+    import cartridge
+    import lua_minifier
+    import pico8_compression
+
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows, where the luamin worker is not used anyway
+    fcntl = None
+
+# Dependencies (luamin engine only, see below):
 #   - luamin must have been installed locally with `npm update` or `pico-boots/setup.sh`
+#   - node, to run luamin and the luamin worker
 
 # This script minifies the __lua__ section of a cartridge {game}.p8:
-# 1. It uses p8tool listlua A.p8 to quickly extract the __lua__ code into {game}.lua
-# 2. Convert remaining bits of pico8 lua (generated by p8tool) into clean lua
-# 3. It applies luamin to {game}.lua and outputs to {game}_min.lua
-# 4. It reads the header (before __lua__) of {game}.p8 and copies it into {game}_min.p8
-# 5. It appends {game}_min.lua's content to {game}_min.p8
-# 6. It finishes reading {game}.p8's remaining sections and appends them into {game}_min.p8
-# 7. It replaces {game}.p8 with {game}_min.p8
+# 1. It reads the sections of {game}.p8 (see cartridge.py) to extract the __lua__ code
+# 2. Convert remaining bits of pico8 lua (generated by p8tool, for cartridges not built with bundle.py) into clean lua
+# 3. It applies the minifier engine to the clean lua code (or reuses cached output for the same code, see below),
+#    and checks the character count and compressed size of the minified code against PICO-8 limits
+# 4. It replaces the __lua__ section with the minified code, keeping the header and other sections
+# 5. It writes the result to a temporary file next to {game}.p8, then moves it to {game}.p8
+
+# All the steps work on in-memory code, and {game}.p8 is only replaced at the end, so a failure at any step
+# leaves {game}.p8 untouched without intermediate files. The only exception is the luamin engine, which reads
+# the clean lua code from a temporary file in the system temporary directory (see run_luamin).
+
+# The minifier engine is either:
+# - 'luamin': our fork of luamin, run with node (default)
+# - 'python': the in-process minifier of lua_minifier.py, which doesn't need node nor npm, and produces
+#   output equivalent to luamin (see lua_minifier.py for differences)
+MINIFY_ENGINES = ['luamin', 'python']
+DEFAULT_MINIFY_ENGINE = 'luamin'
 
 MINIFY_SCRIPT_RELATIVE_PATH = "npm/node_modules/.bin/luamin"
+LUAMIN_WORKER_SCRIPT_RELATIVE_PATH = "npm/luamin_worker.js"
+LUAMIN_PACKAGE_RELATIVE_PATH = "npm/node_modules/luamin/package.json"
 
 script_dir_path = os.path.dirname(os.path.realpath(__file__))
 minify_script_path = os.path.join(script_dir_path, MINIFY_SCRIPT_RELATIVE_PATH)
+luamin_worker_script_path = os.path.join(script_dir_path, LUAMIN_WORKER_SCRIPT_RELATIVE_PATH)
+luamin_package_path = os.path.join(script_dir_path, LUAMIN_PACKAGE_RELATIVE_PATH)
+
+# The luamin worker is a Node process that keeps luamin loaded between builds (see npm/luamin_worker.js).
+# It is started on first use and exits after this duration without requests.
+LUAMIN_WORKER_IDLE_TIMEOUT = 600
+# Maximum duration to wait for a newly started worker to accept connections before falling back to the luamin CLI
+LUAMIN_WORKER_START_TIMEOUT = 5.0
+# Maximum duration of a single minification request
+LUAMIN_WORKER_REQUEST_TIMEOUT = 60.0
+
+# Minified code can be cached in a directory passed via --cache-dir, so the minifier is not run again when the clean lua
+# code is unchanged (e.g. when only __gfx__ or __sfx__ changed). Each cache entry is keyed by the hash of the clean lua
+# code, the luamin options and the minifier version (installed luamin version or lua_minifier.MINIFIER_VERSION). Reading an entry updates its modification time, and the least
+# recently used entries are removed when the total size of the cache exceeds the maximum size (see evict_minify_cache_entries).
+MINIFY_CACHE_ENTRY_EXTENSION = ".cache"
+DEFAULT_MINIFY_CACHE_MAX_SIZE = 16 * 1024 * 1024
 
-LUA_HEADER = b"__lua__\n"
 # Note that this pattern captures 1. condition 2. result of a "one-line if" if it is,
 # but that it also matches a normal if-then, requiring a check before using the pattern.
 # This pattern may not be exhaustive as the user may put extra brackets but still use if-then
@@ -36,91 +85,110 @@ LUA_HEADER = b"__lua__\n"
 PICO8_ONE_LINE_IF_PATTERN = re.compile(r"if \(([^)]*)\) (.*)")
 
 
-class Phase(Enum):
-    CARTRIDGE_HEADER = 1  # copying header, from "pico-8 cartridge..." to "__lua__"
-    LUA_SECTION      = 2  # found "__lua__", still copy the 2 author/version comment lines then appending minified lua all at once
-    LUA_CATCHUP      = 3  # skipping the unused unminified lua until we reach the other sections
-    OTHER_SECTIONS   = 4  # copying the last sections
+class MinifyError(Exception):
+    """Raised when the code cannot be minified, or the minified code exceeds PICO-8 limits"""
+    pass
 
 
-def minify_lua_in_p8(cartridge_filepath, use_aggressive_minification):
+def minify_lua_in_p8(cartridge_filepath, use_aggressive_minification, use_worker=True,
+        cache_dirpath=None, cache_max_size=DEFAULT_MINIFY_CACHE_MAX_SIZE, engine=DEFAULT_MINIFY_ENGINE,
+        max_compressed_size=None):
     """
-    Minifies the __lua__ section of a p8 cartridge, using luamin.
+    Minifies the __lua__ section of a p8 cartridge, using the minifier engine
+    (for luamin, via the luamin worker if use_worker is True).
+    If cache_dirpath is not None, reuse and store minified code in that directory (see minify_lua_code).
+    Raise MinifyError if the minified code exceeds max_compressed_size bytes once compressed by PICO-8
+    (see pico8_compression.py). If max_compressed_size is None, only warn if it exceeds the PICO-8 limit.
+    Raise MinifyError if minification fails, leaving the cartridge untouched.
 
     """
     logging.debug(f"Minifying lua in cartridge {cartridge_filepath}...")
 
-    root, ext = os.path.splitext(cartridge_filepath)
+    ext = os.path.splitext(cartridge_filepath)[1]
     if not ext.endswith(".p8"):
-        logging.error(f"Cartridge filepath '{cartridge_filepath}' does not end with '.p8'")
-        sys.exit(1)
+        raise MinifyError(f"Cartridge filepath '{cartridge_filepath}' does not end with '.p8'")
 
-    min_cartridge_filepath = f"{root}_min.p8"
-    lua_filepath = f"{root}.lua"
-    min_lua_filepath = f"{root}_min.lua"
-
-    # Step 1: extract lua code into separate file
-    with open(lua_filepath, 'w') as lua_file:
-        extract_lua(cartridge_filepath, lua_file)
-
-    # Step 2: clean lua code in this file in-place
-    with open(lua_filepath, 'r') as lua_file:
-        # create temporary file object (we still need to open it with mode to get file descriptor)
-        temp_file_object, temp_filepath = tempfile.mkstemp()
-        original_char_count = sum(len(line) for line in lua_file)
-        print(f"Original lua code has {original_char_count} characters")
-        lua_file.seek(0)
-        clean_lua(lua_file, os.fdopen(temp_file_object, 'w'))
-    # replace original lua code with clean code
-    os.remove(lua_filepath)
-    shutil.move(temp_filepath, lua_filepath)
-
-    # Step 3: apply luamin to generate minified code in a different file
-    with open(min_lua_filepath, 'w+') as min_lua_file:
-        minify_lua(lua_filepath, min_lua_file, use_aggressive_minification)
-        min_lua_file.seek(0)
-        min_char_count = sum(len(line) for line in min_lua_file)
-        print(f"Minified lua code to {min_char_count} characters")
-        if min_char_count > 65536:
-            logging.error(f"Maximum character count of 65536 has been exceeded, cartridge would be truncated in PICO-8, so exit with failure.")
-            sys.exit(1)
-
-    # Step 4-6: inject minified lua code into target cartridge
-    phase = Phase.CARTRIDGE_HEADER
-    with open(cartridge_filepath, 'r') as source_file,     \
-         open(min_cartridge_filepath, 'w') as target_file, \
-         open(min_lua_filepath, 'r') as min_lua_file:
-        inject_minified_lua_in_p8(source_file, target_file, min_lua_file)
-
-    # Step 7: replace original p8 with minified p8, clean up intermediate files
-    os.remove(cartridge_filepath)
-    os.remove(lua_filepath)
-    os.remove(min_lua_filepath)
-    shutil.move(min_cartridge_filepath, cartridge_filepath)
+    sections = cartridge.read_sections(cartridge_filepath)
+    sections = minify_lua_in_sections(sections, use_aggressive_minification, use_worker, cache_dirpath, cache_max_size,
+        engine, max_compressed_size, cartridge_filepath)
 
+    # Step 5: replace original p8 with minified p8
+    write_sections_atomically(cartridge_filepath, sections)
 
-def extract_lua(source_filepath, lua_file):
+
+def minify_lua_in_sections(sections, use_aggressive_minification, use_worker=True,
+        cache_dirpath=None, cache_max_size=DEFAULT_MINIFY_CACHE_MAX_SIZE, engine=DEFAULT_MINIFY_ENGINE,
+        max_compressed_size=None, cartridge_filepath=''):
     """
-    Extract lua from .p8 cartridge at source_filepath (string) to lua_file (file descriptor: write)
+    Return a copy of sections (see cartridge.split_sections) where the __lua__ section is minified
+    (steps 1 to 4 of minify_lua_in_p8, see its parameters). cartridge_filepath is only used for logging.
+    Raise MinifyError if minification fails.
 
     """
-    # p8tool listrawlua bug (https://github.com/dansanderson/picotool/issues/59)
-    #   was fixed, so we prefer it to listlua as it is almost instant compared to listlua
-    #   which takes ~1s to parse the game .p8
+    # Step 1: extract lua code
+    lua_lines = get_lua_lines(sections, cartridge_filepath)
+    original_char_count = sum(len(line) for line in lua_lines)
+    print(f"Original lua code has {original_char_count} characters")
+
+    # Step 2: clean lua code
+    clean_lua_code = "".join(generate_clean_lua_lines(lua_lines))
+
+    # Step 3: minify clean lua code
+    min_lua_code = minify_lua_code(clean_lua_code, use_aggressive_minification, use_worker, cache_dirpath, cache_max_size, engine)
+    min_char_count = len(min_lua_code)
+    print(f"Minified lua code to {min_char_count} characters")
+    if min_char_count > 65536:
+        raise MinifyError("Maximum character count of 65536 has been exceeded, cartridge would be truncated in PICO-8.")
+
+    compressed_size = pico8_compression.get_compressed_code_size(min_lua_code)
+    print(f"Minified lua code compresses to approximately {compressed_size}/{pico8_compression.PICO8_MAX_COMPRESSED_CODE_SIZE} bytes")
+    if max_compressed_size is not None:
+        if compressed_size > max_compressed_size:
+            raise MinifyError(f"Maximum compressed size of {max_compressed_size} bytes has been exceeded, "
+                "cartridge could not be exported to binary format by PICO-8.")
+    elif compressed_size > pico8_compression.PICO8_MAX_COMPRESSED_CODE_SIZE:
+        logging.warning(f"Maximum compressed size of {pico8_compression.PICO8_MAX_COMPRESSED_CODE_SIZE} bytes has been exceeded, "
+            "cartridge could not be exported to binary format by PICO-8.")
+
+    # Step 4: inject minified lua code into sections
+    return replace_lua_section(sections, min_lua_code, cartridge_filepath)
+
+
+def get_lua_lines(sections, cartridge_filepath):
+    """
+    Return the lines of the __lua__ section in sections (see cartridge.split_sections),
+    raising MinifyError if there is none. cartridge_filepath is only used for logging.
 
-    # However, note that it outputs an extra newline after *each* line, which will be stripped during minification most of the time
-    # but will stay in [[multi-line strings]]. So we *must* skip every other line (preserve odd lines) using e.g. awk
-    # https://superuser.com/questions/101756/show-only-odd-lines-with-cat
+    """
+    lua_lines = cartridge.get_section_lines(sections, cartridge.LUA_SECTION_NAME)
+    if lua_lines is None:
+        raise MinifyError(f"No __lua__ section found in cartridge {cartridge_filepath}")
+    return lua_lines
 
-    # Usually a check_call(stdout=min_lua_file) (and no stderr) is enough,
-    #  as it throws CalledProcessError on error by itself, but in this case, due to output stream sync issues
-    #  (luamin error shown before __main__ print at the bottom of this script),
-    #  we prefer Popen + PIPE + communicate() + check stderrdata
-    # For awk we just use a '|' in shell mode, a bit easier than calling Popen a second time with stdin = stdout of first process
-    (_stdoutdata, stderrdata) = Popen([f"p8tool listrawlua \"{source_filepath}\" | awk 'NR % 2 == 1'"], shell=True, stdout=lua_file, stderr=PIPE).communicate()
-    if stderrdata:
-        logging.error(f"p8tool listrawlua failed with:\n\n{stderrdata.decode()}")
-        sys.exit(1)
+
+def write_sections_atomically(cartridge_filepath, sections):
+    """
+    Write sections (see cartridge.split_sections) to cartridge_filepath via a temporary file in the same directory,
+    so the cartridge is either fully replaced or untouched
+
+    """
+    temp_file_descriptor, temp_filepath = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(cartridge_filepath)))
+    try:
+        with os.fdopen(temp_file_descriptor, 'w') as temp_file:
+            cartridge.write_sections(temp_file, sections)
+        shutil.copymode(cartridge_filepath, temp_filepath)
+        os.replace(temp_filepath, cartridge_filepath)
+    except BaseException:
+        os.remove(temp_filepath)
+        raise
+
+
+def extract_lua(source_filepath, lua_file):
+    """
+    Extract lua from .p8 cartridge at source_filepath (string) to lua_file (file descriptor: write)
+
+    """
+    lua_file.writelines(get_lua_lines(cartridge.read_sections(source_filepath), source_filepath))
 
 
 def clean_lua(lua_file, clean_lua_file):
@@ -129,23 +197,51 @@ def clean_lua(lua_file, clean_lua_file):
     to native Lua in clean_lua_file (file descriptor: write)
 
     """
-    for line in lua_file:
+    clean_lua_file.writelines(generate_clean_lua_lines(lua_file))
+
+
+def generate_clean_lua_lines(lua_lines):
+    """
+    Convert PICO-8 specific lines from iterable lua_lines to native Lua, yielding each line
+
+    """
+    for line in lua_lines:
         # we simplify things a lot thanks to our assumptions on the generated code
         # we know that the only pico8 one-line if will be generated for the require function
         #   and have the pattern "if (condition) [result]" without "then",
         #   and there are no edge cases like embedded conditions or continuing line with "\"
         if line.startswith("if (") and "then" not in line:
             # convert to "if [condition] then [result] end"
-            clean_lua_file.write(PICO8_ONE_LINE_IF_PATTERN.sub("if \\1 then \\2 end", line))
+            yield PICO8_ONE_LINE_IF_PATTERN.sub("if \\1 then \\2 end", line)
         else:
-            clean_lua_file.write(line)
+            yield line
+
 
+def minify_lua(clean_lua_filepath, min_lua_file, use_aggressive_minification=False, use_worker=True,
+        cache_dirpath=None, cache_max_size=DEFAULT_MINIFY_CACHE_MAX_SIZE, engine=DEFAULT_MINIFY_ENGINE):
+    """
+    Minify lua from clean_lua_filepath (string) and send output to min_lua_file (file descriptor: write)
+    See minify_lua_code for parameters.
+
+    """
+    with open(clean_lua_filepath, 'r') as clean_lua_file:
+        clean_lua_code = clean_lua_file.read()
+    min_lua_file.write(minify_lua_code(clean_lua_code, use_aggressive_minification, use_worker,
+        cache_dirpath, cache_max_size, engine))
 
 
-def minify_lua(clean_lua_filepath, min_lua_file, use_aggressive_minification=False):
+def minify_lua_code(clean_lua_code, use_aggressive_minification=False, use_worker=True,
+        cache_dirpath=None, cache_max_size=DEFAULT_MINIFY_CACHE_MAX_SIZE, engine=DEFAULT_MINIFY_ENGINE):
     """
-    Minify lua from clean_lua_filepath (string)
-    and send output to min_lua_file (file descriptor: write)
+    Return the minified code (string) of clean_lua_code (string), using the minifier engine (string, see MINIFY_ENGINES)
+
+    If engine is 'luamin' and use_worker is True, send the request to the luamin worker, starting it if needed,
+    and fall back to running luamin directly if the worker is not available.
+
+    If cache_dirpath is not None, look for code already minified from the same clean code, options and minifier version
+    in that directory and skip minification entirely if found, else store the minified code in a new cache entry,
+    evicting the least recently used entries so the cache doesn't exceed cache_max_size bytes.
+    The cache is not used when the minifier version cannot be determined.
 
     Use option:
       -f to pass filepath
@@ -155,16 +251,363 @@ def minify_lua(clean_lua_filepath, min_lua_file, use_aggressive_minification=Fal
       -mk to minify member names and table key strings (should be done together as some members will be defined
         directly inside table, others defined and accessed with dot syntax)
 
+    The python engine doesn't use options, but behaves as luamin with the same options.
+
     """
     options = "-fn"
     if use_aggressive_minification:
         options += "mk"
 
-    # see extract_lua for reason to use Popen
-    (_stdoutdata, stderrdata) = Popen([minify_script_path, options, clean_lua_filepath], stdout=min_lua_file, stderr=PIPE).communicate()
+    cache_key = None
+    if cache_dirpath is not None:
+        minifier_version = get_minifier_version(engine)
+        if minifier_version is not None:
+            cache_key = compute_minify_cache_key(clean_lua_code, options, minifier_version)
+            min_lua_code = read_minify_cache_entry(cache_dirpath, cache_key)
+            if min_lua_code is not None:
+                logging.debug("Using cached minified code")
+                return min_lua_code
+
+    if engine == 'python':
+        min_lua_code = run_python_minifier(clean_lua_code, use_aggressive_minification)
+    else:
+        min_lua_code = run_luamin(options, clean_lua_code, use_worker)
+
+    if cache_key is not None:
+        write_minify_cache_entry(cache_dirpath, cache_key, min_lua_code)
+        evict_minify_cache_entries(cache_dirpath, cache_max_size)
+
+    return min_lua_code
+
+
+def run_luamin(options, clean_lua_code, use_worker=True):
+    """
+    Run luamin with options (string) on clean_lua_code (string) and return the minified code (string)
+    If use_worker is True, use the luamin worker if available (see minify_lua_code).
+    Raise MinifyError if luamin reports an error.
+
+    """
+    # luamin reads its input from a file (-f), so we need a temporary file, removed as soon as luamin is done
+    # (passing the code as argument would exceed the maximum argument length for big cartridges)
+    with tempfile.NamedTemporaryFile('w', suffix='.lua') as clean_lua_file:
+        clean_lua_file.write(clean_lua_code)
+        clean_lua_file.flush()
+
+        worker_result = None
+        if use_worker:
+            worker_result = run_luamin_worker([options, clean_lua_file.name])
+
+        if worker_result is not None:
+            stdoutdata, stderrdata = worker_result
+        else:
+            # Usually a check_output() (and no stderr) is enough,
+            #  as it throws CalledProcessError on error by itself, but in this case, due to output stream sync issues
+            #  (luamin error shown before __main__ print at the bottom of this script),
+            #  we prefer Popen + PIPE + communicate() + check stderrdata
+            (stdoutdata, stderrdata) = Popen([minify_script_path, options, clean_lua_file.name], stdout=PIPE, stderr=PIPE).communicate()
+            stdoutdata = stdoutdata.decode()
+            stderrdata = stderrdata.decode()
+
     if stderrdata:
-        logging.error(f"Minify script failed with:\n\n{stderrdata.decode()}")
-        sys.exit(1)
+        raise MinifyError(f"Minify script failed with:\n\n{stderrdata}")
+
+    return stdoutdata
+
+
+def run_python_minifier(clean_lua_code, use_aggressive_minification=False):
+    """
+    Minify clean_lua_code (string) with lua_minifier and return the minified code (string)
+    Raise MinifyError if the code is not valid Lua.
+
+    """
+    try:
+        return lua_minifier.minify_lua(clean_lua_code, minify_member_names=use_aggressive_minification)
+    except lua_minifier.LuaMinifyError as e:
+        raise MinifyError(f"Python minifier failed with:\n\n{e}")
+
+
+def get_minifier_version(engine):
+    """
+    Return a string identifying the version of the minifier engine (string, see MINIFY_ENGINES),
+    or None if it cannot be determined
+
+    """
+    if engine == 'python':
+        return f"python {lua_minifier.MINIFIER_VERSION}"
+    return get_luamin_version()
+
+
+def get_luamin_version(luamin_package_path=luamin_package_path):
+    """
+    Return a string identifying the luamin installation whose package.json is at luamin_package_path,
+    or None if luamin is not installed there
+
+    luamin is installed from a git branch, so the resolved commit is added to the package version when npm stored it.
+
+    """
+    try:
+        with open(luamin_package_path, 'r') as luamin_package_file:
+            luamin_package = json.load(luamin_package_file)
+    except (OSError, ValueError):
+        return None
+
+    if not isinstance(luamin_package, dict) or 'version' not in luamin_package:
+        return None
+
+    revision = luamin_package.get('_resolved') or luamin_package.get('gitHead') or ''
+    return f"{luamin_package['version']} {revision}".rstrip()
+
+
+def compute_minify_cache_key(clean_lua_code, options, minifier_version):
+    """
+    Return the cache key (hex digest string) of the minified result of clean_lua_code (string),
+    for the given luamin options (string) and minifier_version (string)
+
+    """
+    hasher = hashlib.sha1()
+    hasher.update(f"{minifier_version}\n".encode())
+    hasher.update(f"{options}\n".encode())
+    hasher.update(clean_lua_code.encode())
+    return hasher.hexdigest()
+
+
+def read_minify_cache_entry(cache_dirpath, cache_key):
+    """
+    Return the content of the cache entry for cache_key in cache_dirpath, or None if there is no such entry
+    Reading an entry marks it as recently used.
+
+    """
+    cache_entry_filepath = os.path.join(cache_dirpath, cache_key + MINIFY_CACHE_ENTRY_EXTENSION)
+    try:
+        with open(cache_entry_filepath, 'r') as cache_entry_file:
+            min_lua_code = cache_entry_file.read()
+        os.utime(cache_entry_filepath)
+    except FileNotFoundError:
+        # also covers an entry evicted by a concurrent build in-between
+        return None
+    return min_lua_code
+
+
+def write_minify_cache_entry(cache_dirpath, cache_key, min_lua_code):
+    """Store min_lua_code (string) as the cache entry for cache_key in cache_dirpath"""
+    cache_entry_filepath = os.path.join(cache_dirpath, cache_key + MINIFY_CACHE_ENTRY_EXTENSION)
+
+    # write to a temporary file then move it, so an interrupted build never leaves a truncated entry
+    os.makedirs(cache_dirpath, exist_ok=True)
+    temp_file_descriptor, temp_filepath = tempfile.mkstemp(dir=cache_dirpath)
+    with os.fdopen(temp_file_descriptor, 'w') as temp_file:
+        temp_file.write(min_lua_code)
+    os.replace(temp_filepath, cache_entry_filepath)
+
+
+def evict_minify_cache_entries(cache_dirpath, cache_max_size):
+    """
+    Remove the least recently used cache entries in cache_dirpath until their total size is at most cache_max_size
+    (in bytes). Return the number of removed entries.
+
+    """
+    entries = []
+    total_size = 0
+    with os.scandir(cache_dirpath) as it:
+        for entry in it:
+            if entry.is_file() and entry.name.endswith(MINIFY_CACHE_ENTRY_EXTENSION):
+                stat_result = entry.stat()
+                entries.append((stat_result.st_mtime, stat_result.st_size, entry.path))
+                total_size += stat_result.st_size
+
+    removed_count = 0
+    for _mtime, size, entry_path in sorted(entries):
+        if total_size <= cache_max_size:
+            break
+        try:
+            os.remove(entry_path)
+        except FileNotFoundError:
+            pass
+        total_size -= size
+        removed_count += 1
+
+    return removed_count
+
+
+def get_luamin_worker_socket_path(luamin_script_path=minify_script_path):
+    """
+    Return the path of the socket used by the luamin worker running luamin_script_path,
+    or None if there is no private directory to put it in (see get_luamin_worker_dirpath)
+
+    There is one worker per user and luamin installation, so projects using different copies of pico-boots
+    don't share a worker.
+
+    """
+    dirpath = get_luamin_worker_dirpath()
+    if dirpath is None:
+        return None
+
+    install_hash = hashlib.sha1(os.path.realpath(luamin_script_path).encode()).hexdigest()[:12]
+    return os.path.join(dirpath, f"luamin-{install_hash}.sock")
+
+
+def get_luamin_worker_dirpath():
+    """
+    Return the path of the directory containing the luamin worker sockets, creating it if needed,
+    or None if it is not a directory that only the current user can access.
+
+    The directory is in $XDG_RUNTIME_DIR if set, else in the system temporary directory, so other users
+    cannot create a socket in it to impersonate the worker and receive or tamper with our code.
+
+    """
+    runtime_dirpath = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dirpath and os.path.isdir(runtime_dirpath):
+        dirpath = os.path.join(runtime_dirpath, "pico-boots")
+    else:
+        dirpath = os.path.join(tempfile.gettempdir(), f"pico-boots-{os.getuid()}")
+
+    try:
+        os.mkdir(dirpath, 0o700)
+    except FileExistsError:
+        pass
+    except OSError as e:
+        logging.debug(f"Could not create luamin worker directory {dirpath} ({e})")
+        return None
+
+    # lstat, so a symbolic link created by another user to a directory of ours is not accepted either
+    stat_result = os.lstat(dirpath)
+    if not stat.S_ISDIR(stat_result.st_mode) or stat_result.st_uid != os.getuid() or stat_result.st_mode & 0o077:
+        logging.warning(f"Luamin worker directory {dirpath} is not a directory accessible only by the current user, "
+            "the luamin worker will not be used")
+        return None
+
+    return dirpath
+
+
+def run_luamin_worker(args, luamin_script_path=minify_script_path, socket_path=None,
+        idle_timeout=LUAMIN_WORKER_IDLE_TIMEOUT):
+    """
+    Run luamin with command-line arguments args (list of strings) in the luamin worker, starting it if needed,
+    and return the pair (stdout, stderr) of luamin output as strings.
+    Return None if the worker could not be used, in which case the caller should run luamin directly.
+
+    """
+    if not hasattr(socket, 'AF_UNIX') or not os.path.isfile(luamin_script_path):
+        return None
+
+    if socket_path is None:
+        socket_path = get_luamin_worker_socket_path(luamin_script_path)
+        if socket_path is None:
+            return None
+
+    connection = connect_luamin_worker(socket_path, luamin_script_path, idle_timeout)
+    if connection is None:
+        return None
+
+    try:
+        with connection:
+            response = send_luamin_worker_request(connection, {'args': args})
+    except (OSError, ValueError) as e:
+        logging.debug(f"Luamin worker request failed ({e}), falling back to luamin command")
+        return None
+
+    return response.get('stdout', ''), response.get('stderr', '')
+
+
+def connect_luamin_worker(socket_path, luamin_script_path=minify_script_path, idle_timeout=LUAMIN_WORKER_IDLE_TIMEOUT):
+    """
+    Return a socket connected to the luamin worker listening on socket_path,
+    starting the worker for luamin_script_path if none is running.
+    Return None if the worker could not be started.
+
+    """
+    connection = try_connect_unix_socket(socket_path)
+    if connection is not None:
+        return connection
+
+    # Lock the worker startup, so concurrent builds don't start one worker each, the last one replacing the socket
+    # of the others which would then stay alive until their idle timeout
+    with open(f"{socket_path}.lock", 'w') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+        # another build may have started the worker while we were waiting for the lock
+        connection = try_connect_unix_socket(socket_path)
+        if connection is not None:
+            return connection
+
+        logging.debug(f"Starting luamin worker on {socket_path}...")
+        try:
+            subprocess.check_call(['node', luamin_worker_script_path, '--detach',
+                luamin_script_path, socket_path, str(idle_timeout)],
+                stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except (OSError, subprocess.CalledProcessError) as e:
+            logging.debug(f"Could not start luamin worker ({e}), falling back to luamin command")
+            return None
+
+        deadline = time.monotonic() + LUAMIN_WORKER_START_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(0.02)
+            connection = try_connect_unix_socket(socket_path)
+            if connection is not None:
+                return connection
+
+    logging.debug("Luamin worker did not start in time, falling back to luamin command")
+    return None
+
+
+def stop_luamin_worker(socket_path):
+    """Stop the luamin worker listening on socket_path, if any. Return True if there was a worker to stop"""
+    connection = try_connect_unix_socket(socket_path)
+    if connection is None:
+        return False
+
+    try:
+        with connection:
+            send_luamin_worker_request(connection, {'stop': True})
+    except (OSError, ValueError):
+        pass
+    return True
+
+
+def try_connect_unix_socket(socket_path):
+    """
+    Return a socket connected to the Unix socket at socket_path, or None if nothing is listening there
+    or if the socket is not owned by the current user.
+
+    """
+    try:
+        stat_result = os.lstat(socket_path)
+    except OSError:
+        return None
+    if not stat.S_ISSOCK(stat_result.st_mode) or stat_result.st_uid != os.getuid():
+        logging.warning(f"{socket_path} is not a socket owned by the current user, it will not be used")
+        return None
+
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(socket_path)
+    except OSError:
+        connection.close()
+        return None
+    connection.settimeout(LUAMIN_WORKER_REQUEST_TIMEOUT)
+    return connection
+
+
+def send_luamin_worker_request(connection, request):
+    """
+    Send request (dict) to the luamin worker via connection (socket) and return its response (dict).
+    Raise OSError if the connection fails, and ValueError if the response is invalid.
+
+    """
+    connection.sendall(json.dumps(request).encode() + b"\n")
+
+    response_data = bytearray()
+    while not response_data.endswith(b"\n"):
+        chunk = connection.recv(65536)
+        if not chunk:
+            raise ValueError("connection closed before end of response")
+        response_data += chunk
+
+    response = json.loads(response_data.decode())
+    if not isinstance(response, dict):
+        raise ValueError(f"invalid response: {response}")
+    return response
 
 
 def inject_minified_lua_in_p8(source_file, target_file, min_lua_file):
@@ -174,42 +617,51 @@ def inject_minified_lua_in_p8(source_file, target_file, min_lua_file):
     producing target_file (file descriptor: write)
 
     """
-    phase = Phase.CARTRIDGE_HEADER
-    for line in source_file:
-        if phase is Phase.CARTRIDGE_HEADER:
-            # Step 4: copy header (also copy the "__lua__" line just after)
-            target_file.write(line)
-            if line == "__lua__\n":
-                # enter lua section
-                phase = Phase.LUA_SECTION
+    sections = replace_lua_section(cartridge.split_sections(source_file), min_lua_file.read(),
+        getattr(source_file, 'name', ''))
+    cartridge.write_sections(target_file, sections)
+
 
-        elif phase is Phase.LUA_SECTION:
-            # Step 5: copy minified lua
-            target_file.writelines(min_lua_file.readlines())
-            target_file.write("\n")  # newline required before other sections
-            phase = Phase.LUA_CATCHUP
+def replace_lua_section(sections, min_lua_code, cartridge_filepath):
+    """
+    Return a copy of sections (see cartridge.split_sections) where the __lua__ section is replaced with min_lua_code
+    (string), raising MinifyError if there is no __lua__ section. cartridge_filepath is only used for logging.
 
-        elif phase is Phase.LUA_CATCHUP:
-            # skip all lines until __gfx__
-            if line == "__gfx__\n":
-                # copy the __gfx__ line itself
-                target_file.write(line)
-                phase = Phase.OTHER_SECTIONS
+    """
+    if not min_lua_code.endswith("\n"):
+        # newline required before other sections
+        min_lua_code += "\n"
 
-        else:  # phase is Phase.CARTRIDGE_HEADER
-            # Step 6: copy remaining sections
-            target_file.write(line)
+    try:
+        return cartridge.replace_section_lines(sections, cartridge.LUA_SECTION_NAME, [min_lua_code])
+    except ValueError:
+        raise MinifyError(f"No __lua__ section found in cartridge {cartridge_filepath}")
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Minify lua code in cartridge.')
     parser.add_argument('path', type=str, help='path containing cartridge file to minify')
     parser.add_argument('--aggressive-minify', action='store_true', help="use aggressive minification (minify member names and table key strings)")
+    parser.add_argument('--engine', type=str, choices=MINIFY_ENGINES, default=DEFAULT_MINIFY_ENGINE,
+        help=f"minifier engine: 'luamin' (requires node) or 'python' (in-process) (default: {DEFAULT_MINIFY_ENGINE})")
+    parser.add_argument('--no-worker', action='store_true', help="run luamin directly instead of using the persistent luamin worker")
+    parser.add_argument('--cache-dir', type=str, default=None, help="directory where minified code is cached between builds (no cache if not set)")
+    parser.add_argument('--max-compressed-size', type=int, nargs='?', const=pico8_compression.PICO8_MAX_COMPRESSED_CODE_SIZE,
+        help=f"fail if the minified code exceeds this size in bytes once compressed by PICO-8, {pico8_compression.PICO8_MAX_COMPRESSED_CODE_SIZE} if no size is passed "
+             "(default: only warn if it exceeds the PICO-8 limit)")
+    parser.add_argument('--cache-max-size', type=int, default=DEFAULT_MINIFY_CACHE_MAX_SIZE,
+        help=f"maximum total size of the cache in bytes, least recently used entries are removed beyond (default: {DEFAULT_MINIFY_CACHE_MAX_SIZE})")
     args = parser.parse_args()
 
     logging.basicConfig(level=logging.INFO)
-    logging.info(f"Minifying lua code in {args.path} with aggressive minification: {'ON' if args.aggressive_minify else 'OFF'}...")
-
-    minify_lua_in_p8(args.path, args.aggressive_minify)
+    logging.info(f"Minifying lua code in {args.path} with {args.engine} and aggressive minification: {'ON' if args.aggressive_minify else 'OFF'}...")
+
+    try:
+        minify_lua_in_p8(args.path, args.aggressive_minify, use_worker=not args.no_worker,
+            cache_dirpath=args.cache_dir, cache_max_size=args.cache_max_size, engine=args.engine,
+            max_compressed_size=args.max_compressed_size)
+    except MinifyError as e:
+        logging.error(e)
+        sys.exit(1)
 
     logging.info(f"Minified lua code in {args.path}")
@@ -0,0 +1,170 @@
+#!/usr/bin/env node
+'use strict';
+
+// Long-lived luamin worker used by minify.py, so repeated builds don't pay Node startup and luaparse loading
+// every time.
+//
+// Usage:
+//   node luamin_worker.js [--detach] LUAMIN_SCRIPT_PATH SOCKET_PATH IDLE_TIMEOUT_SECONDS
+//
+// The worker listens on the Unix socket at SOCKET_PATH and exits after IDLE_TIMEOUT_SECONDS without requests.
+// With --detach, it spawns itself as a detached process and returns immediately.
+//
+// Protocol: each request is a single line of JSON, answered with a single line of JSON on the same connection.
+//   {"args": ["-fn", "/path/to/clean.lua"]} -> {"stdout": "...", "stderr": "..."}
+//   {"stop": true}                          -> {} then the worker exits
+//
+// To stay compatible with any version of luamin, the worker doesn't call the luamin API directly: it compiles
+// the luamin command-line script once, then runs it in-process for each request with the request arguments,
+// capturing what it would have printed. Modules required by the script (luamin, luaparse) are only loaded once.
+// This assumes the script works synchronously when passed a file (-f), which is the case of luamin.
+
+const child_process = require('child_process');
+const fs = require('fs');
+const net = require('net');
+const path = require('path');
+const util = require('util');
+const vm = require('vm');
+const { createRequire } = require('module');
+
+// thrown by the fake process.exit to interrupt the luamin script
+class ExitSignal {
+  constructor(code) {
+    this.code = code;
+  }
+}
+
+function compileScript(scriptPath) {
+  // replace shebang with an empty line to preserve line numbers in error messages
+  const source = fs.readFileSync(scriptPath, 'utf8').replace(/^#!.*/, '');
+  const wrapper = '(function (exports, require, module, __filename, __dirname, process, console) {' +
+    source + '\n})';
+  return new vm.Script(wrapper, { filename: scriptPath }).runInThisContext();
+}
+
+function runScript(scriptFunction, scriptPath, args) {
+  let stdout = '';
+  let stderr = '';
+
+  const fakeProcess = Object.create(process, {
+    argv: { value: [process.argv[0], scriptPath].concat(args) },
+    exit: { value: (code) => { throw new ExitSignal(code); } },
+    stdout: { value: { write: (chunk) => { stdout += chunk; return true; }, isTTY: false } },
+    stderr: { value: { write: (chunk) => { stderr += chunk; return true; }, isTTY: false } },
+  });
+  const fakeConsole = {
+    log: (...values) => { stdout += util.format(...values) + '\n'; },
+    info: (...values) => { stdout += util.format(...values) + '\n'; },
+    warn: (...values) => { stderr += util.format(...values) + '\n'; },
+    error: (...values) => { stderr += util.format(...values) + '\n'; },
+  };
+  const scriptModule = { exports: {} };
+
+  try {
+    scriptFunction(scriptModule.exports, createRequire(scriptPath), scriptModule, scriptPath,
+      path.dirname(scriptPath), fakeProcess, fakeConsole);
+  } catch (error) {
+    if (!(error instanceof ExitSignal)) {
+      // same output as an uncaught exception in the command-line script
+      stderr += (error && error.stack ? error.stack : String(error)) + '\n';
+    }
+  }
+
+  return { stdout: stdout, stderr: stderr };
+}
+
+function detach(args) {
+  const child = child_process.spawn(process.execPath, [__filename].concat(args), {
+    detached: true,
+    stdio: 'ignore',
+  });
+  child.unref();
+}
+
+function serve(scriptPath, socketPath, idleTimeoutSeconds) {
+  const scriptFunction = compileScript(scriptPath);
+
+  let idleTimer = null;
+  const server = net.createServer((connection) => {
+    resetIdleTimer();
+
+    let buffer = '';
+    connection.setEncoding('utf8');
+    connection.on('data', (data) => {
+      buffer += data;
+      let newlineIndex;
+      while ((newlineIndex = buffer.indexOf('\n')) >= 0) {
+        const line = buffer.slice(0, newlineIndex);
+        buffer = buffer.slice(newlineIndex + 1);
+
+        let request;
+        try {
+          request = JSON.parse(line);
+        } catch (error) {
+          connection.end(JSON.stringify({ stderr: `luamin worker: invalid request: ${error.message}\n` }) + '\n');
+          return;
+        }
+
+        if (request.stop) {
+          // stop listening before answering, so the client knows the worker is gone once it receives the answer
+          closeServer();
+          connection.end('{}\n', () => process.exit(0));
+          return;
+        }
+
+        connection.write(JSON.stringify(runScript(scriptFunction, scriptPath, request.args || [])) + '\n');
+        resetIdleTimer();
+      }
+    });
+    connection.on('error', () => {});
+  });
+
+  function resetIdleTimer() {
+    if (idleTimer !== null) {
+      clearTimeout(idleTimer);
+    }
+    idleTimer = setTimeout(stop, idleTimeoutSeconds * 1000);
+  }
+
+  function closeServer() {
+    server.close();
+    try {
+      fs.unlinkSync(socketPath);
+    } catch (error) {
+      // socket already removed (e.g. replaced by another worker)
+    }
+  }
+
+  function stop() {
+    closeServer();
+    process.exit(0);
+  }
+
+  process.on('SIGINT', stop);
+  process.on('SIGTERM', stop);
+
+  // remove socket left by a worker that didn't exit properly
+  try {
+    fs.unlinkSync(socketPath);
+  } catch (error) {
+    // no socket to remove
+  }
+  server.listen(socketPath, resetIdleTimer);
+}
+
+function main() {
+  let args = process.argv.slice(2);
+  if (args[0] === '--detach') {
+    detach(args.slice(1));
+    return;
+  }
+
+  if (args.length !== 3) {
+    console.error('Usage: node luamin_worker.js [--detach] LUAMIN_SCRIPT_PATH SOCKET_PATH IDLE_TIMEOUT_SECONDS');
+    process.exit(1);
+  }
+
+  serve(fs.realpathSync(args[0]), args[1], parseFloat(args[2]));
+}
+
+main();
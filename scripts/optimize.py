@@ -0,0 +1,512 @@
+#!/usr/bin/env python3.6
+# -*- coding: utf-8 -*-
+import argparse
+import logging
+import os
+import re
+
+try:
+    from . import lua_tokenizer
+    from .lua_tokenizer import TokenType
+except ImportError:
+    # script run directly, not as part of the scripts package
+    import lua_tokenizer
+    from lua_tokenizer import TokenType
+
+
+# This script applies dead-branch elimination to preprocessed source code, in-place:
+# 1. branches of if statements whose condition is constant and false are removed
+# 2. a branch whose condition is constant and true becomes the last branch (as the else branch),
+#    and if it is the first remaining branch, the whole if statement is replaced with its body
+# 3. an if statement without any remaining branch is removed
+
+# It is meant to be run after preprocess.py, so conditions using defines (see preprocess.py) have been replaced
+# with literals, e.g. "if debug_flag then" -> "if false then".
+
+# Extra notes:
+
+# a. A condition is constant if it is only made of literals (true, false, nil, numbers and strings),
+# brackets, "not", "and", "or", unary minus and comparisons. Other conditions, even as operands of "and" / "or",
+# are considered unknown, so we never remove code with side effects (e.g. in "f() and false", f() must be called).
+# The only exception is short-circuit evaluation: the right operand of "false and ..." or "true or ..." is never
+# evaluated, so it doesn't matter what it is (as long as it only contains names and literals).
+
+# b. When an if statement is replaced with a branch body, the body is surrounded with "do ... end" if it declares
+# locals or labels (to preserve their scope), contains a return, break or goto at its top level (as Lua requires
+# return and break to be the last statement of a block), or starts with a bracket (which could be parsed as
+# a call on the previous statement).
+
+# c. PICO-8 shorthand if statements ("if (cond) statement" on a single line, without "then" nor "end") are not optimized.
+
+# d. Files are only written if they changed, and their modification time is preserved, so preprocess.py still
+# considers them up to date on the next build.
+
+
+# Keywords opening a block closed by "end" (or "until" for "repeat"). "while" and "for" blocks are opened by "do".
+block_opening_keywords = {'function', 'do', 'repeat'}
+block_closing_keywords = {'end', 'until'}
+# Tokens at the top level of a block that prevent inlining it into the enclosing block (see note b.)
+scoped_block_tokens = {'local', 'return', 'break', 'goto', '::'}
+
+# Quick check to skip files without any if statement that could have a constant condition
+# (a condition starting with a literal, "not" or a bracket)
+constant_condition_candidate_pattern = re.compile(r"""\b(?:if|elseif)[\s(]+(?:true|false|nil|not|[0-9."'\-]|\[=*\[)""")
+
+
+class Unknown:
+    """Value of an expression that cannot be evaluated at compile time"""
+
+    def __repr__(self):
+        return "UNKNOWN"
+
+
+UNKNOWN = Unknown()
+
+
+class ConstantExpressionError(Exception):
+    """Raised when an expression is not supported by the constant evaluator"""
+    pass
+
+
+def optimize_dir(dirpath):
+    """
+    Apply dead-branch elimination to all .lua files in dirpath, in-place.
+    Return the number of files changed.
+
+    """
+    changed_file_count = 0
+    for root, dirs, files in os.walk(dirpath):
+        # sort for deterministic order of logs
+        dirs.sort()
+        for file in sorted(files):
+            if file.endswith(".lua"):
+                if optimize_file(os.path.join(root, file)):
+                    changed_file_count += 1
+    return changed_file_count
+
+
+def optimize_file(filepath):
+    """
+    Apply dead-branch elimination to the file at filepath, in-place, preserving its modification time.
+    Return true iff the file changed.
+
+    """
+    with open(filepath, 'r') as f:
+        source = f.read()
+
+    # quick check to avoid tokenizing files that cannot be optimized
+    if not constant_condition_candidate_pattern.search(source):
+        return False
+
+    try:
+        optimized_source = optimize_source(source)
+    except lua_tokenizer.LuaTokenizeError as e:
+        logging.warning(f"{filepath}: could not tokenize file ({e}), it will not be optimized")
+        return False
+
+    if optimized_source == source:
+        return False
+
+    file_stat = os.stat(filepath)
+    with open(filepath, 'w') as f:
+        f.write(optimized_source)
+    os.utime(filepath, ns=(file_stat.st_atime_ns, file_stat.st_mtime_ns))
+    return True
+
+
+def optimize_source(source):
+    """
+    Return source code with dead branches eliminated.
+    Raise LuaTokenizeError if source cannot be tokenized.
+
+    >>> optimize_source('if false then\\n  a()\\nelseif true then\\n  b()\\nelse\\n  c()\\nend\\n')
+    '\\n  b()\\n\\n'
+
+    """
+    tokens = list(lua_tokenizer.tokenize(source))
+    return optimize_tokens(tokens, 0, len(tokens))
+
+
+def optimize_tokens(tokens, start, end):
+    """Return the source code of tokens[start:end] with dead branches eliminated"""
+    texts = []
+    index = start
+    while index < end:
+        token = tokens[index]
+        if token.token_type is TokenType.KEYWORD and token.text == 'if':
+            if is_shorthand_if(tokens, index):
+                # copy the whole shorthand if as is, so its "else" (if any) is not taken for the else of another if
+                line_end = find_line_end(tokens, index)
+                texts.append(get_tokens_text(tokens, index, line_end))
+                index = line_end
+                continue
+
+            if_statement = parse_if_statement(tokens, index)
+            if if_statement is not None:
+                texts.append(rewrite_if_statement(tokens, *if_statement))
+                index = if_statement[2] + 1
+                continue
+
+        texts.append(token.text)
+        index += 1
+    return "".join(texts)
+
+
+def parse_if_statement(tokens, if_index):
+    """
+    Parse the if statement starting at tokens[if_index] and return a tuple (branches, else_body, end_index), where:
+    - branches is a list of tuples (condition_start, condition_end, body_start, body_end) of token index ranges
+      for the if and elseif branches
+    - else_body is a pair (body_start, body_end) for the else branch, or None
+    - end_index is the index of the final "end" token
+    Return None if the statement is malformed.
+
+    """
+    branches = []
+    keyword_index = if_index
+
+    while True:
+        then_index = find_block_keyword(tokens, keyword_index + 1, {'then'})
+        if then_index is None:
+            return None
+        body_end = find_block_keyword(tokens, then_index + 1, {'elseif', 'else', 'end'})
+        if body_end is None:
+            return None
+        branches.append((keyword_index + 1, then_index, then_index + 1, body_end))
+
+        branch_end_keyword = tokens[body_end].text
+        if branch_end_keyword == 'elseif':
+            keyword_index = body_end
+        elif branch_end_keyword == 'else':
+            end_index = find_block_keyword(tokens, body_end + 1, {'end'})
+            if end_index is None:
+                return None
+            return branches, (body_end + 1, end_index), end_index
+        else:
+            return branches, None, body_end
+
+
+def rewrite_if_statement(tokens, branches, else_body, end_index):
+    """Return the source code of a parsed if statement (see parse_if_statement), with dead branches eliminated"""
+    # list of (condition_start, condition_end, body_start, body_end) for branches with unknown condition
+    kept_branches = []
+    for condition_start, condition_end, body_start, body_end in branches:
+        condition_value = evaluate_constant_expression(get_significant_tokens(tokens, condition_start, condition_end))
+        if condition_value is UNKNOWN:
+            kept_branches.append((condition_start, condition_end, body_start, body_end))
+        elif is_truthy(condition_value):
+            # this branch is always taken when reached, so it becomes the else branch and next branches are unreachable
+            else_body = (body_start, body_end)
+            break
+        # else, the branch is never taken, drop it
+
+    if not kept_branches:
+        if else_body is None:
+            return ""
+        body_start, body_end = else_body
+        body_text = optimize_tokens(tokens, body_start, body_end)
+        if is_scoped_block(tokens, body_start, body_end):
+            return f"do{body_text}end"
+        return body_text
+
+    texts = []
+    for branch_index, (condition_start, condition_end, body_start, body_end) in enumerate(kept_branches):
+        texts.append('if' if branch_index == 0 else 'elseif')
+        texts.append(optimize_tokens(tokens, condition_start, condition_end))
+        texts.append('then')
+        texts.append(optimize_tokens(tokens, body_start, body_end))
+    if else_body is not None:
+        texts.append('else')
+        texts.append(optimize_tokens(tokens, *else_body))
+    texts.append('end')
+    return "".join(texts)
+
+
+def find_block_keyword(tokens, start, keywords):
+    """
+    Return the index of the first keyword token in keywords found from tokens[start] at the same block level,
+    or None if the current block ends before, or there are no more tokens.
+
+    """
+    depth = 0
+    index = start
+    token_count = len(tokens)
+    while index < token_count:
+        token = tokens[index]
+        if token.token_type is TokenType.KEYWORD:
+            text = token.text
+            if depth == 0 and text in keywords:
+                return index
+            if text == 'if':
+                if is_shorthand_if(tokens, index):
+                    index = find_line_end(tokens, index)
+                    continue
+                depth += 1
+            elif text in block_opening_keywords:
+                depth += 1
+            elif text in block_closing_keywords:
+                if depth == 0:
+                    return None
+                depth -= 1
+        index += 1
+    return None
+
+
+def is_shorthand_if(tokens, if_index):
+    """
+    Return true iff the if keyword at tokens[if_index] starts a PICO-8 shorthand if statement "if (cond) statement",
+    i.e. it is followed by a condition in brackets closed on the same line, then by a statement and no "then"
+    on the rest of the line
+
+    """
+    next_index = find_next_significant_token_index(tokens, if_index + 1)
+    if next_index is None or tokens[next_index].text != '(':
+        return False
+
+    # find the closing bracket of the condition, which must be on the same line
+    depth = 0
+    index = next_index
+    token_count = len(tokens)
+    while index < token_count:
+        token = tokens[index]
+        if '\n' in token.text and token.token_type is not TokenType.STRING:
+            return False
+        if token.text == '(':
+            depth += 1
+        elif token.text == ')':
+            depth -= 1
+            if depth == 0:
+                break
+        index += 1
+    else:
+        return False
+
+    has_statement = False
+    index += 1
+    while index < token_count:
+        token = tokens[index]
+        if token.token_type is TokenType.KEYWORD and token.text == 'then':
+            return False
+        if '\n' in token.text and token.token_type is not TokenType.STRING:
+            break
+        if not lua_tokenizer.is_blank_token(token):
+            has_statement = True
+        index += 1
+    return has_statement
+
+
+def find_line_end(tokens, start):
+    """Return the index of the first token from tokens[start] containing a newline (outside strings), or the number of tokens"""
+    index = start
+    token_count = len(tokens)
+    while index < token_count:
+        token = tokens[index]
+        if '\n' in token.text and token.token_type is not TokenType.STRING:
+            return index
+        index += 1
+    return token_count
+
+
+def is_scoped_block(tokens, start, end):
+    """
+    Return true iff the block made of tokens[start:end] must remain surrounded by "do ... end"
+    when inlined in the enclosing block (see note b.)
+
+    """
+    first_index = find_next_significant_token_index(tokens, start)
+    if first_index is not None and first_index < end and tokens[first_index].text == '(':
+        return True
+
+    depth = 0
+    for token in tokens[start:end]:
+        if token.token_type is TokenType.KEYWORD:
+            if depth == 0 and token.text in scoped_block_tokens:
+                return True
+            if token.text == 'if' or token.text in block_opening_keywords:
+                depth += 1
+            elif token.text in block_closing_keywords:
+                depth -= 1
+        elif depth == 0 and token.text == '::':
+            return True
+    return False
+
+
+def find_next_significant_token_index(tokens, start):
+    """Return the index of the first token from tokens[start] that is neither a whitespace nor a comment, or None"""
+    for index in range(start, len(tokens)):
+        if not lua_tokenizer.is_blank_token(tokens[index]):
+            return index
+    return None
+
+
+def get_significant_tokens(tokens, start, end):
+    """Return the list of tokens in tokens[start:end] that are neither whitespaces nor comments"""
+    return [token for token in tokens[start:end] if not lua_tokenizer.is_blank_token(token)]
+
+
+def get_tokens_text(tokens, start, end):
+    """Return the source code of tokens[start:end]"""
+    return "".join(token.text for token in tokens[start:end])
+
+
+def is_truthy(value):
+    """Return true iff the known Lua value is considered true in a condition (only nil and false are not)"""
+    return value is not None and value is not False
+
+
+def evaluate_constant_expression(tokens):
+    """
+    Return the value of the expression made of significant tokens (see note a.), as a Python value
+    (None for nil, bool, float for numbers, str for strings), or UNKNOWN if it cannot be evaluated at compile time.
+
+    Ex: the tokens of 'not (1 < 2) or nil' give None, the tokens of 'x == 1' give UNKNOWN
+
+    """
+    try:
+        value, index = parse_or_expression(tokens, 0)
+    except ConstantExpressionError:
+        return UNKNOWN
+    if index != len(tokens):
+        # unsupported operator
+        return UNKNOWN
+    return value
+
+
+def parse_or_expression(tokens, index):
+    """Parse an "or" expression from tokens[index] and return (value, next index)"""
+    value, index = parse_and_expression(tokens, index)
+    while index < len(tokens) and tokens[index].text == 'or':
+        right_value, index = parse_and_expression(tokens, index + 1)
+        if value is UNKNOWN:
+            # the left operand may have side effects, so we cannot simplify
+            value = UNKNOWN
+        elif not is_truthy(value):
+            value = right_value
+        # else, short-circuit: the right operand is not evaluated
+    return value, index
+
+
+def parse_and_expression(tokens, index):
+    """Parse an "and" expression from tokens[index] and return (value, next index)"""
+    value, index = parse_comparison_expression(tokens, index)
+    while index < len(tokens) and tokens[index].text == 'and':
+        right_value, index = parse_comparison_expression(tokens, index + 1)
+        if value is UNKNOWN:
+            value = UNKNOWN
+        elif is_truthy(value):
+            value = right_value
+        # else, short-circuit: the right operand is not evaluated
+    return value, index
+
+
+def parse_comparison_expression(tokens, index):
+    """Parse a comparison expression from tokens[index] and return (value, next index)"""
+    value, index = parse_unary_expression(tokens, index)
+    while index < len(tokens) and tokens[index].text in ('==', '~=', '!=', '<', '<=', '>', '>='):
+        operator = tokens[index].text
+        right_value, index = parse_unary_expression(tokens, index + 1)
+        value = compare_constant_values(operator, value, right_value)
+    return value, index
+
+
+def parse_unary_expression(tokens, index):
+    """Parse a unary expression from tokens[index] and return (value, next index)"""
+    if index >= len(tokens):
+        raise ConstantExpressionError("expression ended unexpectedly")
+
+    token = tokens[index]
+    if token.text == 'not':
+        value, index = parse_unary_expression(tokens, index + 1)
+        return (UNKNOWN if value is UNKNOWN else not is_truthy(value)), index
+    if token.text == '-':
+        value, index = parse_unary_expression(tokens, index + 1)
+        return (-value if isinstance(value, float) else UNKNOWN), index
+    return parse_primary_expression(tokens, index)
+
+
+def parse_primary_expression(tokens, index):
+    """Parse a literal, name or bracketed expression from tokens[index] and return (value, next index)"""
+    token = tokens[index]
+    if token.text == '(':
+        value, index = parse_or_expression(tokens, index + 1)
+        if index >= len(tokens) or tokens[index].text != ')':
+            raise ConstantExpressionError("expected closing bracket")
+        return value, index + 1
+    if token.token_type is TokenType.KEYWORD:
+        if token.text == 'true':
+            return True, index + 1
+        if token.text == 'false':
+            return False, index + 1
+        if token.text == 'nil':
+            return None, index + 1
+        raise ConstantExpressionError(f"unsupported keyword {token.text}")
+    if token.token_type is TokenType.NUMBER:
+        return parse_number_literal(token.text), index + 1
+    if token.token_type is TokenType.STRING:
+        string_value = parse_simple_string_literal(token.text)
+        return (string_value if string_value is not None else UNKNOWN), index + 1
+    if token.token_type is TokenType.NAME:
+        # variable read, its value is unknown but it has no side effects
+        return UNKNOWN, index + 1
+    raise ConstantExpressionError(f"unsupported token {token.text}")
+
+
+def compare_constant_values(operator, left_value, right_value):
+    """Return the result of the comparison operator applied to left and right values, or UNKNOWN"""
+    if left_value is UNKNOWN or right_value is UNKNOWN:
+        return UNKNOWN
+
+    if operator in ('==', '~=', '!='):
+        # in Lua, values of different types are never equal (bool is a subclass of int in Python, so check types)
+        are_equal = type(left_value) is type(right_value) and left_value == right_value
+        return are_equal if operator == '==' else not are_equal
+
+    # ordering comparison is only evaluated for numbers (string order depends on locale)
+    if not isinstance(left_value, float) or not isinstance(right_value, float):
+        return UNKNOWN
+    if operator == '<':
+        return left_value < right_value
+    if operator == '<=':
+        return left_value <= right_value
+    if operator == '>':
+        return left_value > right_value
+    return left_value >= right_value
+
+
+def parse_number_literal(text):
+    """
+    Return the value of a Lua/PICO-8 number literal, rounded to PICO-8 16:16 fixed-point precision
+
+    >>> parse_number_literal('0x0000.0444')
+    0.01666259765625
+
+    """
+    lower_text = text.lower()
+    if lower_text.startswith('0x'):
+        value = float.fromhex(lower_text)
+    elif lower_text.startswith('0b'):
+        integer_part, _, fractional_part = lower_text[2:].partition('.')
+        value = float(int(integer_part or '0', 2))
+        if fractional_part:
+            value += int(fractional_part, 2) / (1 << len(fractional_part))
+    else:
+        value = float(lower_text)
+    return round(value * 65536) / 65536
+
+
+def parse_simple_string_literal(text):
+    """Return the content of a short string literal without escape sequences, or None if it has some or is a long string"""
+    if text[0] in ('"', "'") and '\\' not in text:
+        return text[1:-1]
+    return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Eliminate dead branches of if statements with constant conditions, in-place.')
+    parser.add_argument('path', type=str, nargs='+', help="path of directories containing source files to optimize")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    for dirpath in args.path:
+        changed_file_count = optimize_dir(dirpath)
+        print(f"Optimized {changed_file_count} file(s) in {dirpath}.")
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3.6
+# -*- coding: utf-8 -*-
+import argparse
+import logging
+import sys
+
+
+# This module compresses code the way PICO-8 does when storing a cartridge in binary form (.p8.png, .bin, web export),
+# so we can check the compressed code size limit (PICO8_MAX_COMPRESSED_CODE_SIZE) without opening PICO-8.
+# It implements the "PXA" format used since PICO-8 0.2.0:
+# - an 8-byte header: "\0pxa", then the decompressed size and the compressed size (header included)
+#   as 16-bit big-endian integers
+# - a stream of bits, filled from the lowest bit of each byte, made of:
+#   a. literals: bit 1, then the index of the character in a move-to-front list of all the 256 characters,
+#      written as a unary prefix (one bit 1 per extra bit, then bit 0) followed by the index on 4 + extra bits,
+#      after subtracting the range of indices covered by shorter prefixes (so indices 0-15 take 4 bits,
+#      16-47 take 5 bits, etc.). The character is then moved to the front of the list.
+#   b. back-references: bit 0, then the offset - 1 on 5 bits (prefix 11), 10 bits (prefix 10) or 15 bits (prefix 0),
+#      then the length - 3 in chunks of 3 bits, where 7 means that another chunk follows.
+
+# Notes:
+
+# a. The size computed is an estimate: PICO-8 uses its own heuristics to choose between literals and back-references,
+# so its compressed size may differ by a few bytes. We use the longest match at each position (see MAX_MATCH_CANDIDATES),
+# and prefer literals when they take fewer bits, which is usually on par with PICO-8.
+
+# b. Code is converted to PICO-8 characters (one byte each) before compression. ASCII characters are kept as is,
+# and other characters (PICO-8 glyphs in .p8 files) are given byte values from 128 in order of appearance,
+# which doesn't match PICO-8 exactly, but is equivalent for size estimation.
+
+
+# Maximum size of the compressed code in bytes, header included
+PICO8_MAX_COMPRESSED_CODE_SIZE = 15616
+
+PXA_HEADER = b"\0pxa"
+PXA_HEADER_SIZE = 8
+
+MIN_MATCH_LENGTH = 3
+MAX_MATCH_OFFSET = 1 << 15
+# Maximum number of previous positions with the same first characters to check for each match,
+# most recent first (a higher value gives slightly better compression, but is slower)
+MAX_MATCH_CANDIDATES = 64
+
+
+class BitWriter:
+    """Writes bits into a bytearray, filling each byte from its lowest bit"""
+
+    def __init__(self):
+        self.data = bytearray()
+        self.bit_count = 0
+
+    def write_bit(self, bit):
+        if self.bit_count % 8 == 0:
+            self.data.append(0)
+        if bit:
+            self.data[-1] |= 1 << (self.bit_count % 8)
+        self.bit_count += 1
+
+    def write_bits(self, bit_count, value):
+        """Write the bit_count lowest bits of value, lowest first"""
+        for i in range(bit_count):
+            self.write_bit((value >> i) & 1)
+
+
+class BitReader:
+    """Reads bits from bytes, starting from the lowest bit of each byte"""
+
+    def __init__(self, data):
+        self.data = data
+        self.bit_index = 0
+
+    def read_bit(self):
+        byte_index = self.bit_index // 8
+        if byte_index >= len(self.data):
+            raise ValueError("unexpected end of compressed data")
+        bit = (self.data[byte_index] >> (self.bit_index % 8)) & 1
+        self.bit_index += 1
+        return bit
+
+    def read_bits(self, bit_count):
+        value = 0
+        for i in range(bit_count):
+            value |= self.read_bit() << i
+        return value
+
+
+def encode_pico8_chars(code):
+    """Return code (string) converted to bytes with one byte per character (see note b.)"""
+    byte_by_char = {}
+    data = bytearray()
+    for char in code:
+        char_code = ord(char)
+        if char_code < 128:
+            data.append(char_code)
+        else:
+            if char not in byte_by_char:
+                # out of byte values is impossible in practice, as PICO-8 only has 128 extra characters
+                byte_by_char[char] = min(128 + len(byte_by_char), 255)
+            data.append(byte_by_char[char])
+    return bytes(data)
+
+
+def get_literal_bit_count(move_to_front_index):
+    """Return the number of bits taken by a literal at move_to_front_index in the move-to-front list"""
+    # flag + unary prefix (including final 0) + index bits
+    bit_count = 4
+    while move_to_front_index >= (1 << bit_count):
+        move_to_front_index -= 1 << bit_count
+        bit_count += 1
+    return 1 + (bit_count - 3) + bit_count
+
+
+def get_offset_bit_count(offset):
+    """Return the number of bits taken by the offset of a back-reference, including its prefix"""
+    if offset <= 32:
+        return 2 + 5
+    if offset <= 1024:
+        return 2 + 10
+    return 1 + 15
+
+
+def get_back_reference_bit_count(offset, length):
+    """Return the number of bits taken by a back-reference"""
+    return 1 + get_offset_bit_count(offset) + 3 * ((length - MIN_MATCH_LENGTH) // 7 + 1)
+
+
+def write_literal(bit_writer, move_to_front, byte):
+    index = move_to_front.index(byte)
+    bit_writer.write_bit(1)
+    bit_count = 4
+    remaining_index = index
+    while remaining_index >= (1 << bit_count):
+        bit_writer.write_bit(1)
+        remaining_index -= 1 << bit_count
+        bit_count += 1
+    bit_writer.write_bit(0)
+    bit_writer.write_bits(bit_count, remaining_index)
+    del move_to_front[index]
+    move_to_front.insert(0, byte)
+
+
+def write_back_reference(bit_writer, offset, length):
+    bit_writer.write_bit(0)
+    if offset <= 32:
+        bit_writer.write_bits(2, 0b11)
+        bit_writer.write_bits(5, offset - 1)
+    elif offset <= 1024:
+        bit_writer.write_bits(2, 0b01)
+        bit_writer.write_bits(10, offset - 1)
+    else:
+        bit_writer.write_bit(0)
+        bit_writer.write_bits(15, offset - 1)
+
+    remaining_length = length - MIN_MATCH_LENGTH
+    while remaining_length >= 7:
+        bit_writer.write_bits(3, 7)
+        remaining_length -= 7
+    bit_writer.write_bits(3, remaining_length)
+
+
+def find_longest_match(data, position, previous_positions):
+    """
+    Return (offset, length) of the longest match for data at position among previous_positions (list of positions
+    starting with the same MIN_MATCH_LENGTH bytes, oldest first), or (0, 0) if there is none within MAX_MATCH_OFFSET
+
+    """
+    best_offset = 0
+    best_length = 0
+    data_length = len(data)
+
+    for candidate_count, previous_position in enumerate(reversed(previous_positions)):
+        offset = position - previous_position
+        if offset > MAX_MATCH_OFFSET or candidate_count >= MAX_MATCH_CANDIDATES:
+            break
+
+        # the first bytes are already known to match
+        length = MIN_MATCH_LENGTH
+        while position + length < data_length and data[previous_position + length] == data[position + length]:
+            length += 1
+
+        # a shorter offset with the same length is never more expensive, and we check the most recent first
+        if length > best_length:
+            best_offset = offset
+            best_length = length
+
+    return best_offset, best_length
+
+
+def compress_code(code):
+    """
+    Return code (string) compressed in PICO-8 PXA format (bytes), header included.
+    Raise ValueError if code is too long to be stored in the format.
+
+    """
+    data = encode_pico8_chars(code)
+    if len(data) >= 1 << 16:
+        raise ValueError(f"code has {len(data)} characters, it cannot be compressed in PXA format")
+
+    bit_writer = BitWriter()
+    move_to_front = list(range(256))
+    # list of positions by first MIN_MATCH_LENGTH bytes (hash chains)
+    positions_by_prefix = {}
+
+    position = 0
+    data_length = len(data)
+    while position < data_length:
+        prefix = data[position:position + MIN_MATCH_LENGTH]
+        previous_positions = positions_by_prefix.get(prefix) if len(prefix) == MIN_MATCH_LENGTH else None
+
+        offset, length = find_longest_match(data, position, previous_positions) if previous_positions else (0, 0)
+        if length > 0:
+            # short matches far away may be more expensive than literals (estimated with the current move-to-front)
+            literal_bit_count = sum(get_literal_bit_count(move_to_front.index(byte)) for byte in data[position:position + length])
+            if literal_bit_count <= get_back_reference_bit_count(offset, length):
+                length = 0
+
+        if length > 0:
+            write_back_reference(bit_writer, offset, length)
+            step = length
+        else:
+            write_literal(bit_writer, move_to_front, data[position])
+            step = 1
+
+        for indexed_position in range(position, min(position + step, data_length - MIN_MATCH_LENGTH + 1)):
+            positions_by_prefix.setdefault(data[indexed_position:indexed_position + MIN_MATCH_LENGTH], []).append(indexed_position)
+        position += step
+
+    compressed_size = PXA_HEADER_SIZE + len(bit_writer.data)
+    return PXA_HEADER + data_length.to_bytes(2, 'big') + compressed_size.to_bytes(2, 'big') + bytes(bit_writer.data)
+
+
+def decompress_code(compressed_data):
+    """
+    Return the code (bytes, one byte per PICO-8 character) decompressed from compressed_data (bytes) in PXA format.
+    Raise ValueError if compressed_data is not valid.
+
+    """
+    if compressed_data[:len(PXA_HEADER)] != PXA_HEADER or len(compressed_data) < PXA_HEADER_SIZE:
+        raise ValueError("missing PXA header")
+
+    decompressed_size = int.from_bytes(compressed_data[4:6], 'big')
+    bit_reader = BitReader(compressed_data[PXA_HEADER_SIZE:])
+    move_to_front = list(range(256))
+    data = bytearray()
+
+    while len(data) < decompressed_size:
+        if bit_reader.read_bit():
+            bit_count = 4
+            index_base = 0
+            while bit_reader.read_bit():
+                index_base += 1 << bit_count
+                bit_count += 1
+            index = index_base + bit_reader.read_bits(bit_count)
+            byte = move_to_front.pop(index)
+            move_to_front.insert(0, byte)
+            data.append(byte)
+        else:
+            if bit_reader.read_bit():
+                offset_bit_count = 5 if bit_reader.read_bit() else 10
+            else:
+                offset_bit_count = 15
+            offset = bit_reader.read_bits(offset_bit_count) + 1
+            if offset_bit_count == 10 and offset == 1:
+                # uncompressed bytes until 0 (never written by compress_code)
+                while True:
+                    byte = bit_reader.read_bits(8)
+                    if byte == 0:
+                        break
+                    data.append(byte)
+                continue
+
+            length = MIN_MATCH_LENGTH
+            while True:
+                length_chunk = bit_reader.read_bits(3)
+                length += length_chunk
+                if length_chunk != 7:
+                    break
+            if offset > len(data):
+                raise ValueError(f"back-reference offset {offset} before start of data")
+            for _ in range(length):
+                data.append(data[-offset])
+
+    return bytes(data[:decompressed_size])
+
+
+def get_compressed_code_size(code):
+    """Return the size in bytes of code (string) once compressed by PICO-8, header included (see note a.)"""
+    return len(compress_code(code))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Print the compressed size of a Lua file, as in a PICO-8 binary cartridge.')
+    parser.add_argument('path', type=str, help='path of the lua file')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    with open(args.path, 'r') as lua_file:
+        compressed_size = get_compressed_code_size(lua_file.read())
+    print(f"Compressed code size: {compressed_size}/{PICO8_MAX_COMPRESSED_CODE_SIZE} bytes")
+    if compressed_size > PICO8_MAX_COMPRESSED_CODE_SIZE:
+        sys.exit(1)
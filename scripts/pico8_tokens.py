@@ -0,0 +1,100 @@
+#!/usr/bin/env python3.6
+# -*- coding: utf-8 -*-
+import argparse
+import logging
+import sys
+
+try:
+    from . import cartridge
+    from . import lua_tokenizer
+    from .lua_tokenizer import TokenType
+except ImportError:
+    # script run directly, not as part of the scripts package
+    import cartridge
+    import lua_tokenizer
+    from lua_tokenizer import TokenType
+
+
+# This module counts tokens in Lua code with the same rules as PICO-8, without running PICO-8 nor picotool
+# (picotool follows older rules and counts more tokens than PICO-8).
+# According to the PICO-8 manual, each word (name, keyword, literal) or operator counts as 1 token, except:
+# 1. comments and whitespace
+# 2. ",", ".", ":", ";" and "::"
+# 3. closing brackets ")", "]" and "}" (so a pair of brackets counts as 1 token)
+# 4. the keywords "end" and "local"
+# 5. a unary "-" or "~" directly followed by a number literal, as the negative literal counts as 1 token
+
+# It can be run as a script on a .lua file or a .p8 cartridge (only counting the __lua__ section)
+# to check the token count against PICO8_MAX_TOKEN_COUNT.
+
+
+PICO8_MAX_TOKEN_COUNT = 8192
+
+uncounted_token_texts = {',', '.', ':', ';', '::', ')', ']', '}', 'end', 'local'}
+negative_literal_operators = {'-', '~'}
+# Texts of keyword and operator tokens that can end an expression, so a "-" after them is a binary operator
+value_ending_texts = {')', ']', '}', 'end', 'nil', 'true', 'false', '...'}
+value_ending_token_types = {TokenType.NAME, TokenType.NUMBER, TokenType.STRING}
+
+
+def count_tokens(code):
+    """
+    Return the number of tokens in Lua code (string), as counted by PICO-8.
+    Raise lua_tokenizer.LuaTokenizeError if code cannot be tokenized.
+
+    >>> count_tokens('local a = -1 -- comment')
+    3
+
+    """
+    tokens = [token for token in lua_tokenizer.tokenize(code) if not lua_tokenizer.is_blank_token(token)]
+
+    token_count = 0
+    for index, token in enumerate(tokens):
+        if token.text in uncounted_token_texts:
+            continue
+
+        if token.token_type is TokenType.UNKNOWN and index > 0 and tokens[index - 1].token_type is TokenType.UNKNOWN and \
+                tokens[index - 1].start + len(tokens[index - 1].text) == token.start:
+            # a PICO-8 glyph may be made of several unicode characters (e.g. "⬅️"), count it once
+            continue
+
+        if token.text in negative_literal_operators and token.token_type is TokenType.OPERATOR and \
+                index + 1 < len(tokens) and tokens[index + 1].token_type is TokenType.NUMBER and \
+                not (index > 0 and is_value_ending_token(tokens[index - 1])):
+            continue
+
+        token_count += 1
+
+    return token_count
+
+
+def is_value_ending_token(token):
+    """Return true iff token can end an expression"""
+    return token.token_type in value_ending_token_types or token.text in value_ending_texts
+
+
+def count_tokens_in_file(filepath):
+    """Return the number of tokens in the .lua file or the __lua__ section of the .p8 cartridge at filepath"""
+    if filepath.endswith(".p8"):
+        lua_lines = cartridge.get_section_lines(cartridge.read_sections(filepath), cartridge.LUA_SECTION_NAME)
+        code = "".join(lua_lines) if lua_lines is not None else ""
+    else:
+        with open(filepath, 'r') as lua_file:
+            code = lua_file.read()
+    return count_tokens(code)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Count PICO-8 tokens in a .lua file or .p8 cartridge.')
+    parser.add_argument('path', type=str, help='path of the .lua file or .p8 cartridge')
+    parser.add_argument('--max-tokens', type=int, default=PICO8_MAX_TOKEN_COUNT,
+        help=f"fail if the token count exceeds this value (default: {PICO8_MAX_TOKEN_COUNT})")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    token_count = count_tokens_in_file(args.path)
+    print(f"Token count: {token_count}/{PICO8_MAX_TOKEN_COUNT}")
+    if token_count > args.max_tokens:
+        logging.error(f"Maximum token count of {args.max_tokens} has been exceeded in {args.path}.")
+        sys.exit(1)
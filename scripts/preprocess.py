@@ -1,35 +1,77 @@
 #!/usr/bin/env python3.6
 # -*- coding: utf-8 -*-
 import argparse
+import hashlib
 import logging
 import os
 import re
+import shutil
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from enum import Enum
+from functools import partial
+
+try:
+    from . import lua_tokenizer
+except ImportError:
+    # script run directly, not as part of the scripts package
+    import lua_tokenizer
 
 
 # This script applies preprocessing and code enabling to the intermediate source code meant to be built for PICO-8:
 # 1. strip all code between full lines "--#if [symbol]" and "--#endif" if `symbol` is not defined (passed from external config).
 # 2. strip all code between full lines "--#ifn [symbol]" and "--#endif" if `symbol` is defined.
 # 3. enable all code between full lines "--[[#pico8" and "--#pico8]]" (unless stripped by 1.).
-# 4. strip one-line debug function calls like log() and assert() if the corresponding symbols are not defined
+# 4. strip debug function calls like log() and assert() if the corresponding symbols are not defined
+# 5. replace identifiers defined with "--#define [name] [value]" (or passed from external config) with their value
 
 
 # Extra notes on 4:
 
-# a. One-line function stripping avoids having to surround e.g. "log()" with "--#if log" and "--#endif" every time.
-# Our Regex doesn't support multi-line calls or deep bracket detection, therefore, when using multi-line logs/asserts:
-# - make sure that you never end the first line with a closing bracket, such as:
-#     log(sum(1, 2)
-#     .."!")
-#   as it will detect a full statement and strip the first line but keeping the others trailing in the void.
-# - surround all the lines with --#if [symbol] and --#endif with the matching symbol.
+# a. Function call stripping avoids having to surround e.g. "log()" with "--#if log" and "--#endif" every time.
+# A call is detected when a line starts with the function name immediately followed by an opening bracket.
+# Brackets, strings and comments are then scanned (see scan_call) to find the end of the call, even several lines below,
+# and the whole call is stripped. This only works if the call is the only statement on its last line (a trailing comment is OK),
+# so the following call would not be stripped (with a warning):
+#     log("a") print("b")
 
 # b. In addition, make sure you never insert gameplay code inside a log or assert (such as assert(coresume(coroutine)))
 # and always split gameplay/debug code in 2 lines
 
 # c. log, warn and err behave the same way, they all use the "log" symbol.
+# In addition, when "log" is defined with one or more "log_[category]" symbols (e.g. "log_physics"),
+# only log, warn and err calls for those categories are preserved, so you only pay for the logging you are investigating.
+# The category is the 2nd argument of the call, and a call without category uses the category "default".
+# Only calls with a literal string category (or no category) can be stripped this way, other calls are always preserved.
+
+# d. When "assert" is defined, one-line asserts with a non-constant message, such as:
+#     assert(x > 0, "x is not positive: "..x)
+# are rewritten so the message is only built on failure (Lua evaluates all arguments before calling assert):
+#     if not (x > 0) then assert(false, "x is not positive: "..x) end
+# The rewriting preserves indentation and trailing comments, so line numbers in error messages are unchanged.
+
+# e. Lines inside a multi-line long string or long comment (e.g. "[[" on a previous line, not closed yet) are not code,
+# so they are never stripped nor treated as directives.
+
+# f. If stripping fails somewhat, your release build with error with "attempt to call bil value 'log'" or something similar.
+
 
-# d. If stripping fails somewhat, your release build with error with "attempt to call bil value 'log'" or something similar.
+# Extra notes on 5:
+
+# a. Defines are compile-time constants, typically used to replace global constants in hot loops
+# with literals, saving a global lookup each time (and tokens). They can be passed as "name=value" symbols,
+# loaded from a file of Lua assignments such as "name = value" (see read_defines_file), or defined in a source
+# file with "--#define name value", in which case they apply to the next lines of that file only.
+# A define also counts as a defined symbol for "--#if".
+
+# b. Substitution is done token by token, so names inside strings and comments are preserved, as well as names
+# after ".", ":", "local", "function" and "goto", and assigned names (e.g. "name = value" to set a global or a table key,
+# or "name, other = 1, 2"). So the original global definition remains valid, but you should not shadow a define
+# with a local variable, a loop variable or a parameter, as its uses would be replaced: a warning is logged when
+# a define name is declared after "local", "local function" or "for", or in a parameter list (the name itself is kept).
+
+# c. A value made of multiple tokens (e.g. "-1" or "1/60") is surrounded with brackets to preserve operator precedence.
 
 
 # Note that when run with busted for unit tests, the source code remains untouched.
@@ -39,13 +81,33 @@ from enum import Enum
 # - Place busted-specific code inside "--#if busted". Since the symbol 'busted' is never defined, it will never be run by PICO-8.
 
 
+# Preprocessed files can be cached in a directory passed via --cache-dir, so unchanged files are not parsed again
+# on the next build. Each cache entry is keyed by the hash of the source content, the sorted defined symbols and
+# PREPROCESSOR_VERSION. Increment PREPROCESSOR_VERSION every time you change the preprocessing rules,
+# so existing cache entries are invalidated.
+# Note that preprocessing warnings are only shown when a file is actually parsed, not when it is served from cache.
+PREPROCESSOR_VERSION = 6
+CACHE_ENTRY_EXTENSION = ".cache"
+
+# When preprocessing out-of-place (see preprocess_dir_multi), each output file gets the modification time of its source,
+# and a stamp file storing PREPROCESSOR_VERSION and the defined symbols is written in each output directory.
+# On the next build, an output file is considered up to date, and skipped, if the stamp is unchanged and both
+# modification times are still equal (like rsync's quick check). Any later modification of the output file
+# (e.g. by add_require.py) therefore triggers preprocessing again.
+OUTPUT_STAMP_FILENAME = ".preprocess_stamp"
+
+
 # Candidate functions to strip, as they are typically bound to a defined symbol
 strippable_functions = ['assert', 'log', 'warn', 'err']
 preserved_functions_list_by_symbol = {
     'assert': ['assert'],
     'log':    ['log', 'warn', 'err']
 }
-cached_stripped_function_call_patterns_by_defined_symbols_list = {}
+# Functions whose calls can be stripped by category (see get_preserved_log_categories)
+log_category_functions = preserved_functions_list_by_symbol['log']
+log_category_symbol_prefix = 'log_'
+# Category used by the logger when a log function is called without category (see logging.lua)
+default_log_category = 'default'
 
 
 def get_stripped_functions(defined_symbols):
@@ -62,47 +124,19 @@ def get_stripped_functions(defined_symbols):
     return stripped_functions
 
 
-def generate_stripped_function_call_pattern(stripped_functions):
+def get_preserved_log_categories(defined_symbols):
     """
-    Return a Regex pattern that detects any one-line call of any function whose name is in stripped_functions
-    If there are no functions to strip, return None.
+    Return the set of log categories whose log function calls should be preserved, given a list of defined symbols,
+    or None if all log function calls should be handled normally via get_stripped_functions (no "log_[category]" symbol,
+    or "log" is not defined so they are all stripped anyway)
 
     """
-    # if there is nothing to strip, return None now to avoid creating a regex with just "(?:)\(\)" that would match a line starting with brackets
-    if not stripped_functions:
+    if 'log' not in defined_symbols:
         return None
 
-    # Many good regex exist to match open and closing brackets, unfortunately they use PCRE features like ?> unsupported in Python re,
-    #   so we use a very simple regex only capable of detecting the final closing bracket, without being certain that this is the last one.
-    # Because of this, you should never end the first line of a multi-line call with a bracket as it would be interpreted as a one-line call.
-    # Comments after call are supported.
-
-    # For better regex with PCRE to detect surrounding brackets and quotes, see:
-    # https://stackoverflow.com/questions/2148587/finding-quoted-strings-with-escaped-quotes-in-c-sharp-using-a-regular-expression
-    # https://stackoverflow.com/questions/4568410/match-comments-with-regex-but-not-inside-a-quote adapted to lua comments
-    # https://stackoverflow.com/questions/546433/regular-expression-to-match-outer-brackets#546457
-    # https://stackoverflow.com/questions/18906514/regex-for-matching-functions-and-capturing-their-arguments#18908330
-
-    # ex: '(?:log|warn|err)'
-    function_names_alternative_pattern = f"(?:{'|'.join(stripped_functions)})"
-    # ex: '^\s*(?:log|warn|err)\(.*\)\s*(?:--.*)?$'
-    stripped_function_call_pattern = re.compile(rf'^\s*{function_names_alternative_pattern}\(.*\)\s*(?:--.*)?$')
-    return stripped_function_call_pattern
-
-
-def get_or_generate_stripped_function_call_pattern_from_defined_symbols(defined_symbols_tuple):
-    """
-    get_stripped_functions + generate_stripped_function_call_pattern with memoization
-    defined_symbols_tuple is a tuple as it must be hashable to be a key
-
-    """
-    if defined_symbols_tuple in cached_stripped_function_call_patterns_by_defined_symbols_list:
-        return cached_stripped_function_call_patterns_by_defined_symbols_list[defined_symbols_tuple]
-
-    stripped_functions = get_stripped_functions(defined_symbols_tuple)
-    stripped_function_call_pattern = generate_stripped_function_call_pattern(stripped_functions)
-    cached_stripped_function_call_patterns_by_defined_symbols_list[defined_symbols_tuple] = stripped_function_call_pattern
-    return stripped_function_call_pattern
+    preserved_log_categories = {symbol[len(log_category_symbol_prefix):] for symbol in defined_symbols
+        if symbol.startswith(log_category_symbol_prefix) and len(symbol) > len(log_category_symbol_prefix)}
+    return preserved_log_categories or None
 
 
 # Parsing mode of each individual #if block
@@ -118,6 +152,36 @@ class ParsingMode(Enum):
     IGNORING = 2  # we are ignoring all content in the current if block
 
 
+# Result of scan_call
+class CallScanResult(Enum):
+    STANDALONE     = 1  # the call is complete and only followed by blanks and comments
+    NOT_STANDALONE = 2  # the call is complete but followed by other code, or its code could not be parsed
+    UNFINISHED     = 3  # the call is not complete yet, more lines are needed
+
+
+# Type of each node of a directive tree (see parse_lines)
+class DirectiveNodeType(Enum):
+    LINE            = 1  # line of code, always kept in an active block                   (node: (LINE, line))
+    STRIPPABLE_CALL = 2  # call of a strippable function, possibly on multiple lines      (node: (STRIPPABLE_CALL, function_name, lines, call_scan_result))
+    IF_BLOCK        = 3  # block between --#if/--#ifn and --#endif                        (node: (IF_BLOCK, symbol, negative_if, child_nodes))
+    PICO8_START     = 4  # --[[#pico8 tag                                                  (node: (PICO8_START,))
+    PICO8_END       = 5  # --#pico8]] tag                                                  (node: (PICO8_END,))
+    DEFINE          = 6  # --#define [name] [value]                                        (node: (DEFINE, name, value))
+    ENDIF           = 7  # end of an IF_BLOCK, only in flat node sequences                  (node: (ENDIF,))
+
+
+# Type of a line of source code, as returned by classify_line
+class LineType(Enum):
+    CODE            = 1  # any line that is neither a directive nor a strippable call
+    IF              = 2  # --#if [symbol]
+    IFN             = 3  # --#ifn [symbol]
+    ENDIF           = 4  # --#endif
+    PICO8_START     = 5  # --[[#pico8
+    PICO8_END       = 6  # --#pico8]]
+    STRIPPABLE_CALL = 7  # start of a call of a strippable function
+    DEFINE          = 8  # --#define [name] [value]
+
+
 # Regex patterns
 
 # Tag to enter a pico8-only block (it's a comment block so that busted never runs it but preprocess reactivates it)
@@ -130,19 +194,291 @@ pico8_end_pattern = re.compile(r"\s*--#pico8]=*]")
 if_pattern = re.compile(r"\s*--#if (\w+)")    # ! ignore anything after 1st symbol
 ifn_pattern = re.compile(r"\s*--#ifn (\w+)")  # ! ignore anything after 1st symbol
 endif_pattern = re.compile(r"\s*--#endif")
+define_pattern = re.compile(r"\s*--#define\s+([A-Za-z_]\w*)(?:[ \t]+(\S.*?))?\s*$")  # value is optional to warn if missing
+
+# Assignment of a global to a literal in a defines file, capturing the name and value
+define_assignment_pattern = re.compile(r"\s*([A-Za-z_]\w*)\s*=\s*(.*?)\s*$")
+
+# Characters that matter when looking for the end of a call: brackets, and starts of strings and comments
+# (which may contain brackets that must be ignored)
+call_scan_pattern = re.compile(r"""--|\[(=*)\[|["'()]""")
+
+# Starts of strings and comments, to find long strings and long comments left open at the end of a line
+long_bracket_scan_pattern = re.compile(r"""--|\[(=*)\[|["']""")
 
+# Standalone one-line call whose arguments contain at most one level of nested brackets and only simple strings,
+# which covers most debug calls. It allows scan_call to skip the full scan in the common case.
+# Runs of plain characters are matched at once inside a lookahead, then consumed with a backreference, which emulates
+# an atomic group to avoid catastrophic backtracking on lines that don't match.
+def generate_simple_call_argument_atom_pattern(run_group_name):
+    return rf"""(?=(?P<{run_group_name}>[^()"'\[\-\n]+))(?P={run_group_name})|-(?!-)|"[^"\\\n]*"|'[^'\\\n]*'"""
 
-def preprocess_dir(dirpath, defined_symbols):
-    """Apply preprocessor directives to all the source files inside the given directory, for the given defined_symbols"""
+simple_standalone_call_pattern = re.compile(
+    rf"[ \t]*[A-Za-z_]\w*\((?:{generate_simple_call_argument_atom_pattern('run')}"
+    rf"|\((?:{generate_simple_call_argument_atom_pattern('nested_run')})*\))*\)"
+    r"[ \t]*(?:--(?!\[=*\[)[^\n]*)?\n?\Z"
+)
+
+# Operators delimiting call arguments
+opening_brackets = {'(', '[', '{'}
+closing_brackets = {')', ']', '}'}
+argument_delimiters = opening_brackets | closing_brackets | {','}
+
+# Tokens after which a name is not an expression (field, method, new local or function name, label),
+# and operators after which a name is being assigned, so define names are not substituted there
+define_name_forbidden_prefixes = {'.', ':', '::', 'local', 'function', 'goto'}
+assignment_operators = {operator for operator in lua_tokenizer.operators
+    if operator.endswith('=') and operator not in ('==', '~=', '!=', '<=', '>=')}
+
+# Literal short string without escape sequences, capturing the quote and the content
+simple_string_literal_pattern = re.compile(r"""(["'])([^"'\\\n]*)\1\Z""")
+
+# Prefixes of the strippable function calls, to detect the start of such calls
+strippable_function_call_prefixes = tuple(f"{function_name}(" for function_name in strippable_functions)
+# Prefixes of all the lines that are not plain code (after stripping leading blanks). Any line that doesn't start
+# with one of them is plain code, which lets us skip classify_line entirely for most lines.
+special_line_prefixes = ('--#', '--[') + strippable_function_call_prefixes
+
+
+def preprocess_dir(dirpath, defined_symbols, cache_dirpath=None, jobs=1):
+    """
+    Apply preprocessor directives to all the source files inside the given directory, for the given defined_symbols
+    If cache_dirpath is not None, reuse and store preprocessed content in that directory (see preprocess_file)
+    If jobs > 1, files are processed in parallel on a pool of that many processes (see run_file_jobs)
+
+    """
+    filepaths = find_lua_filepaths(dirpath)
+    run_file_jobs(partial(preprocess_file, defined_symbols=defined_symbols, cache_dirpath=cache_dirpath), filepaths, jobs)
+
+
+def preprocess_dir_multi(dirpath, defined_symbols_by_output_dirpath, cache_dirpath=None, jobs=1):
+    """
+    Apply preprocessor directives to all the source files inside the given directory, for multiple configs at once,
+    writing the result to a separate output directory for each config (source files are left untouched).
+    defined_symbols_by_output_dirpath is a dict {output_dirpath: defined_symbols}.
+    Each file is parsed only once into a directive tree, then evaluated for each list of defined symbols.
+    Output files that are already up to date since a previous call (see OUTPUT_STAMP_FILENAME) are skipped,
+    and .lua files in output directories that have no source counterpart anymore are removed,
+    so this can be used instead of copying the source to the output directories first.
+    If cache_dirpath is not None, reuse and store preprocessed content in that directory (see preprocess_file),
+    and only parse files that miss the cache for at least one config.
+    If jobs > 1, files are processed in parallel on a pool of that many processes (see run_file_jobs)
+
+    """
+    filepaths = find_lua_filepaths(dirpath)
+
+    # only trust modification times of output directories last preprocessed with the same version and symbols,
+    # and remove the stamp of the others now so an interrupted build cannot leave a stamp that doesn't match the files
+    stamped_output_dirpaths = set()
+    for output_dirpath, defined_symbols in defined_symbols_by_output_dirpath.items():
+        if read_output_stamp(output_dirpath) == generate_output_stamp(defined_symbols):
+            stamped_output_dirpaths.add(output_dirpath)
+        else:
+            remove_output_stamp(output_dirpath)
+
+    # check which files are up to date here, so a build where nothing changed doesn't start any process
+    stale_filepaths = [filepath for filepath in filepaths if get_stale_output_filepath_by_defined_symbols(
+        filepath, dirpath, defined_symbols_by_output_dirpath, stamped_output_dirpaths)]
+    run_file_jobs(partial(preprocess_file_in_output_dirs, dirpath=dirpath,
+        defined_symbols_by_output_dirpath=defined_symbols_by_output_dirpath, cache_dirpath=cache_dirpath,
+        stamped_output_dirpaths=stamped_output_dirpaths), stale_filepaths, jobs)
+
+    relative_filepaths = {os.path.relpath(filepath, dirpath) for filepath in filepaths}
+    for output_dirpath, defined_symbols in defined_symbols_by_output_dirpath.items():
+        remove_stale_output_files(output_dirpath, relative_filepaths)
+        write_output_stamp(output_dirpath, defined_symbols)
+
+
+def find_lua_filepaths(dirpath):
+    """Return the sorted list of paths of all the .lua files found recursively under dirpath"""
+    lua_filepaths = []
     for root, dirs, files in os.walk(dirpath):
         for file in files:
             if file.endswith(".lua"):
-                preprocess_file(os.path.join(root, file), defined_symbols)
+                lua_filepaths.append(os.path.join(root, file))
+    return sorted(lua_filepaths)
+
+
+class LogMessageCollector(logging.Handler):
+    """Logging handler that stores (level, message) pairs instead of emitting them, so they can be logged later"""
+
+    def __init__(self):
+        super().__init__()
+        self.log_messages = []
+
+    def emit(self, record):
+        self.log_messages.append((record.levelno, record.getMessage()))
+
+
+def run_file_job(file_function, filepath):
+    """
+    Call file_function(filepath) and return the list of (level, message) logged during the call,
+    instead of emitting them immediately
+
+    """
+    root_logger = logging.getLogger()
+    original_handlers = root_logger.handlers
+    log_message_collector = LogMessageCollector()
+    root_logger.handlers = [log_message_collector]
+    try:
+        file_function(filepath)
+    finally:
+        root_logger.handlers = original_handlers
+    return log_message_collector.log_messages
+
+
+def run_file_jobs(file_function, filepaths, jobs=1):
+    """
+    Call file_function(filepath) for each path in filepaths.
+    If jobs > 1 and there are several filepaths, calls are distributed on a pool of that many processes
+    (at most one per file).
+    In all cases, messages logged during each call are logged again, prefixed with the file path, in filepaths order,
+    so the output is deterministic.
+
+    """
+    if jobs > 1 and len(filepaths) > 1:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(filepaths))) as executor:
+            # map preserves order, so we log messages for each file in the original order
+            for filepath, log_messages in zip(filepaths, executor.map(partial(run_file_job, file_function), filepaths)):
+                log_file_messages(filepath, log_messages)
+    else:
+        for filepath in filepaths:
+            log_file_messages(filepath, run_file_job(file_function, filepath))
+
+
+def log_file_messages(filepath, log_messages):
+    """Log each (level, message) in log_messages, prefixed with filepath"""
+    for level, message in log_messages:
+        logging.log(level, f"{filepath}: {message}")
+
+
+def preprocess_file_in_output_dirs(filepath, dirpath, defined_symbols_by_output_dirpath, cache_dirpath=None,
+        stamped_output_dirpaths=()):
+    """
+    Apply preprocessor directives to a single file under dirpath for multiple configs at once,
+    writing the result to the same relative path under each output directory of defined_symbols_by_output_dirpath
+    (see preprocess_file_multi).
+    Output files under stamped_output_dirpaths that are up to date with the source file are skipped
+    (see OUTPUT_STAMP_FILENAME).
+
+    """
+    output_filepath_by_defined_symbols = get_stale_output_filepath_by_defined_symbols(filepath, dirpath,
+        defined_symbols_by_output_dirpath, stamped_output_dirpaths)
+    if output_filepath_by_defined_symbols:
+        preprocess_file_multi(filepath, output_filepath_by_defined_symbols, cache_dirpath)
+
+
+def get_stale_output_filepath_by_defined_symbols(filepath, dirpath, defined_symbols_by_output_dirpath,
+        stamped_output_dirpaths=()):
+    """
+    Return the list of pairs (output_filepath, defined_symbols) for the output files of the file at filepath under dirpath
+    that are not up to date (see preprocess_file_in_output_dirs), in the order of defined_symbols_by_output_dirpath
+
+    """
+    relative_filepath = os.path.relpath(filepath, dirpath)
+    source_mtime_ns = os.stat(filepath).st_mtime_ns
+    output_filepath_by_defined_symbols = []
+    for output_dirpath, defined_symbols in defined_symbols_by_output_dirpath.items():
+        output_filepath = os.path.join(output_dirpath, relative_filepath)
+        if output_dirpath in stamped_output_dirpaths and is_output_file_up_to_date(output_filepath, source_mtime_ns):
+            logging.debug(f"Skipping up-to-date file {output_filepath}")
+        else:
+            output_filepath_by_defined_symbols.append((output_filepath, defined_symbols))
+    return output_filepath_by_defined_symbols
 
 
-def preprocess_file(filepath, defined_symbols):
+def is_output_file_up_to_date(output_filepath, source_mtime_ns):
+    """Return True iff output_filepath exists and has the same modification time as its source"""
+    try:
+        return os.stat(output_filepath).st_mtime_ns == source_mtime_ns
+    except FileNotFoundError:
+        return False
+
+
+def generate_output_stamp(defined_symbols):
+    """Return the content of the stamp file of an output directory preprocessed with the given defined symbols"""
+    return f"{PREPROCESSOR_VERSION}\n{','.join(sorted(set(defined_symbols)))}\n"
+
+
+def read_output_stamp(output_dirpath):
+    """Return the content of the stamp file of output_dirpath, or None if there is no stamp"""
+    try:
+        with open(os.path.join(output_dirpath, OUTPUT_STAMP_FILENAME), 'r') as stamp_file:
+            return stamp_file.read()
+    except FileNotFoundError:
+        return None
+
+
+def write_output_stamp(output_dirpath, defined_symbols):
+    """Write the stamp file of output_dirpath, preprocessed with the given defined symbols"""
+    os.makedirs(output_dirpath, exist_ok=True)
+    with open(os.path.join(output_dirpath, OUTPUT_STAMP_FILENAME), 'w') as stamp_file:
+        stamp_file.write(generate_output_stamp(defined_symbols))
+
+
+def remove_output_stamp(output_dirpath):
+    """Remove the stamp file of output_dirpath, if any"""
+    try:
+        os.remove(os.path.join(output_dirpath, OUTPUT_STAMP_FILENAME))
+    except FileNotFoundError:
+        pass
+
+
+def remove_stale_output_files(output_dirpath, relative_filepaths):
+    """
+    Remove all .lua files under output_dirpath whose path relative to output_dirpath is not in relative_filepaths,
+    then remove the directories left empty
+
+    """
+    for root, dirs, files in os.walk(output_dirpath, topdown=False):
+        for file in files:
+            output_filepath = os.path.join(root, file)
+            if file.endswith(".lua") and os.path.relpath(output_filepath, output_dirpath) not in relative_filepaths:
+                logging.debug(f"Removing stale file {output_filepath}")
+                os.remove(output_filepath)
+        if root != output_dirpath and not os.listdir(root):
+            os.rmdir(root)
+
+
+def preprocess_file_multi(filepath, output_filepath_by_defined_symbols, cache_dirpath=None):
+    """
+    Apply preprocessor directives to a single file for multiple configs at once, writing the result for each config
+    to a separate output file. output_filepath_by_defined_symbols is a sequence of pairs (output_filepath, defined_symbols).
+    Each output file gets the modification time of the source file (see OUTPUT_STAMP_FILENAME).
+    The file is parsed at most once. If cache_dirpath is not None, configs whose result is already cached
+    are served from cache, and new results are stored in the cache.
+
+    """
+    with open(filepath, 'r') as f:
+        content = f.read()
+    source_stat = os.stat(filepath)
+
+    directive_tree = None
+    for output_filepath, defined_symbols in output_filepath_by_defined_symbols:
+        preprocessed_content = None
+        if cache_dirpath is not None:
+            cache_key = compute_cache_key(content, defined_symbols)
+            preprocessed_content = read_cache_entry(cache_dirpath, cache_key)
+
+        if preprocessed_content is None:
+            if directive_tree is None:
+                logging.debug(f"Parsing file {filepath}...")
+                directive_tree = parse_lines(content.splitlines(keepends=True))
+            preprocessed_content = "".join(evaluate_directive_tree(directive_tree, defined_symbols))
+            if cache_dirpath is not None:
+                write_cache_entry(cache_dirpath, cache_key, preprocessed_content)
+
+        os.makedirs(os.path.dirname(output_filepath), exist_ok=True)
+        with open(output_filepath, 'w') as output_file:
+            output_file.write(preprocessed_content)
+        os.utime(output_filepath, ns=(source_stat.st_atime_ns, source_stat.st_mtime_ns))
+
+
+def preprocess_file(filepath, defined_symbols, cache_dirpath=None):
     """
     Apply preprocessor directives to a single file, for the given defined_symbols
+    If cache_dirpath is not None, look for content already preprocessed from the same source content and symbols
+    in that directory, and store the result there if not found
 
     test.lua:
         print("always")
@@ -170,21 +506,111 @@ def preprocess_file(filepath, defined_symbols):
             print("hello")
 
     """
-    with open(filepath, 'r+') as f:
-        logging.debug(f"Preprocessing file {filepath}...")
-        preprocessed_lines = preprocess_lines(f, defined_symbols)
-        # replace file content (truncate as the new content may be shorter)
-        f.seek(0)
-        f.truncate()
-        f.writelines(preprocessed_lines)
+    with open(filepath, 'r') as f:
+        # stream preprocessed lines to a temporary file next to the source, then replace the source with it,
+        # so we never need to hold the whole file in memory (except to compute the cache key)
+        temp_file_descriptor, temp_filepath = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filepath)))
+        try:
+            with os.fdopen(temp_file_descriptor, 'w') as temp_file:
+                if cache_dirpath is None:
+                    logging.debug(f"Preprocessing file {filepath}...")
+                    temp_file.writelines(generate_preprocessed_lines(f, defined_symbols))
+                else:
+                    temp_file.write(get_or_preprocess_cached_content(f.read(), defined_symbols, cache_dirpath, filepath))
+            shutil.copymode(filepath, temp_filepath)
+            os.replace(temp_filepath, filepath)
+        except BaseException:
+            os.remove(temp_filepath)
+            raise
+
+
+def compute_cache_key(content, defined_symbols):
+    """
+    Return the cache key (hex digest string) of the preprocessed result of content (string),
+    for the given defined_symbols, with the current PREPROCESSOR_VERSION
+
+    """
+    hasher = hashlib.sha1()
+    hasher.update(f"{PREPROCESSOR_VERSION}\n".encode())
+    hasher.update(f"{','.join(sorted(set(defined_symbols)))}\n".encode())
+    hasher.update(content.encode())
+    return hasher.hexdigest()
+
+
+def get_or_preprocess_cached_content(content, defined_symbols, cache_dirpath, filepath="<unknown>"):
+    """
+    Return the preprocessed content (string) of content (string), for the given defined_symbols.
+    If an entry for the same content and symbols exists in cache_dirpath, return it directly,
+    else preprocess content and store the result in a new cache entry.
+    filepath is only used for logging.
+
+    """
+    cache_key = compute_cache_key(content, defined_symbols)
+    preprocessed_content = read_cache_entry(cache_dirpath, cache_key)
+
+    if preprocessed_content is not None:
+        logging.debug(f"Using cached preprocessed content for file {filepath}")
+        return preprocessed_content
+
+    logging.debug(f"Preprocessing file {filepath}...")
+    preprocessed_content = "".join(preprocess_lines(content.splitlines(keepends=True), defined_symbols))
+    write_cache_entry(cache_dirpath, cache_key, preprocessed_content)
+    return preprocessed_content
+
+
+def read_cache_entry(cache_dirpath, cache_key):
+    """Return the content of the cache entry for cache_key in cache_dirpath, or None if there is no such entry"""
+    cache_entry_filepath = os.path.join(cache_dirpath, cache_key + CACHE_ENTRY_EXTENSION)
+    if not os.path.isfile(cache_entry_filepath):
+        return None
+
+    with open(cache_entry_filepath, 'r') as cache_entry_file:
+        return cache_entry_file.read()
+
+
+def write_cache_entry(cache_dirpath, cache_key, preprocessed_content):
+    """Store preprocessed_content (string) as the cache entry for cache_key in cache_dirpath"""
+    cache_entry_filepath = os.path.join(cache_dirpath, cache_key + CACHE_ENTRY_EXTENSION)
+
+    # write to a temporary file then move it, so an interrupted build never leaves a truncated entry
+    os.makedirs(cache_dirpath, exist_ok=True)
+    temp_file_descriptor, temp_filepath = tempfile.mkstemp(dir=cache_dirpath)
+    with os.fdopen(temp_file_descriptor, 'w') as temp_file:
+        temp_file.write(preprocessed_content)
+    os.replace(temp_filepath, cache_entry_filepath)
+
 
 def preprocess_lines(lines, defined_symbols):
     """
-    Apply stripping and preprocessor directives to iterable lines of source code, for the given defined_symbols
+    Apply stripping and preprocessor directives to iterable lines of source code, for the given defined_symbols,
+    and return the list of preprocessed lines
     It is possible to pass a file as lines iterator
 
     """
-    preprocessed_lines = []
+    return list(generate_preprocessed_lines(lines, defined_symbols))
+
+
+def generate_preprocessed_lines(lines, defined_symbols):
+    """
+    Apply stripping, preprocessor directives and define substitution to iterable lines of source code,
+    for the given defined_symbols (which may contain defines "name=value"), yielding each preprocessed line
+    as soon as it is accepted
+    It is possible to pass a file (including sys.stdin) as lines iterator
+
+    """
+    defined_symbols, defines = split_symbols_and_defines(defined_symbols)
+    # --#define directives met while selecting lines are added to defines, which are applied to the next lines
+    return generate_substituted_lines(generate_evaluated_lines(generate_directive_nodes(lines), defined_symbols, defines), defines)
+
+
+def generate_evaluated_lines(nodes, defined_symbols, defines):
+    """
+    Yield the lines accepted in iterable nodes, a flat sequence of directive nodes (see generate_directive_nodes),
+    for the given defined_symbols, adding defines met in active blocks to defines (dict)
+
+    """
+    stripped_functions = get_stripped_functions(defined_symbols)
+    preserved_log_categories = get_preserved_log_categories(defined_symbols)
 
     inside_pico8_block = False
 
@@ -192,25 +618,22 @@ def preprocess_lines(lines, defined_symbols):
     if_block_modes_stack = []  # can only be filled with [IfBlockMode.ACCEPTED*, IfBlockMode.REFUSED?, IfBlockMode.IGNORED* (only if 1 REFUSED)]
     current_mode = ParsingMode.ACTIVE  # it is ParsingMode.ACTIVE iff if_block_modes_stack is empty or if_block_modes_stack[-1] == IfBlockMode.ACCEPTED
 
-    for line in lines:
-        # 3. preprocess directives
-        opt_match = None      # if or ifn match depending on which one succeeds, None if both fail
-        negative_if = False   # True if we have #ifn, False else
+    # enum member lookups are slow compared to local variables, and this loop runs once per line
+    line_node_type = DirectiveNodeType.LINE
+    active_mode = ParsingMode.ACTIVE
 
-        if_boundary_match = if_pattern.match(line)
-        if not if_boundary_match:
-            if_boundary_match = ifn_pattern.match(line)
-            if if_boundary_match:
-                negative_if = True
-
-        if if_boundary_match:
+    for node in nodes:
+        node_type = node[0]
+        if node_type is line_node_type:
+            if current_mode is active_mode:
+                yield node[1]
+        elif node_type is DirectiveNodeType.IF_BLOCK:
             if current_mode is ParsingMode.ACTIVE:
-                symbol = if_boundary_match.group(1)
+                _, symbol, negative_if, _ = node
                 # for #if, you need to have symbol defined, for #ifn, you need to have it undefined
                 if (symbol in defined_symbols) ^ negative_if:
                     # symbol is defined, so remain active and add that to the stack
                     if_block_modes_stack.append(IfBlockMode.ACCEPTED)
-                    # still strip the preprocessor directives themselves (don't add it to accepted lines)
                 else:
                     # symbol is not defined, enter ignoring mode and add that to the stack
                     if_block_modes_stack.append(IfBlockMode.REFUSED)
@@ -219,22 +642,20 @@ def preprocess_lines(lines, defined_symbols):
                 # we are already in an unprocessed block so we don't care whether that subblock verifies the condition or not
                 # continue ignoring lines but push to the stack so we can wait for #endif
                 if_block_modes_stack.append(IfBlockMode.IGNORED)
-        elif endif_pattern.match(line):
-            if current_mode is ParsingMode.ACTIVE:
-                # check that we had some #if in the stack
-                if if_block_modes_stack:
-                    # go one level up, remain active
-                    if_block_modes_stack.pop()
-                else:
-                    logging.warning('an --#endif was encountered outside an --#if block. Make sure the block starts with an --#if directive')
-            else:
-                last_mode = if_block_modes_stack.pop()
-                # if we left the refusing block, then the new last mode is ACCEPTED and we should be active again
-                # otherwise, we have simply left an IGNORED mode and we remain IGNORING
-                if last_mode is IfBlockMode.REFUSED:
-                    current_mode = ParsingMode.ACTIVE
+        elif node_type is DirectiveNodeType.ENDIF:
+            # ENDIF nodes always match an IF_BLOCK node (see generate_directive_nodes)
+            last_mode = if_block_modes_stack.pop()
+            # if we left the refusing block, then the new last mode is ACCEPTED and we should be active again
+            # otherwise, we have simply left an IGNORED or ACCEPTED mode and we remain in the same mode
+            if last_mode is IfBlockMode.REFUSED:
+                current_mode = ParsingMode.ACTIVE
         elif current_mode is ParsingMode.ACTIVE:
-            if pico8_start_pattern.match(line):
+            if node_type is DirectiveNodeType.STRIPPABLE_CALL:
+                _, function_name, call_lines, call_scan_result = node
+                yield from get_kept_call_lines(function_name, call_lines, call_scan_result, stripped_functions, preserved_log_categories)
+            elif node_type is DirectiveNodeType.DEFINE:
+                add_define(defines, node[1], node[2])
+            elif node_type is DirectiveNodeType.PICO8_START:
                 # we detected a pico8 block and should continue appending the lines normally (since we are building for pico8)
                 # the bool flag is only here to check that 1 end pattern will match 1 start pattern
                 # since we don't really need embedded pico8 blocks, we assume only 1 level and don't use a stack here
@@ -242,39 +663,692 @@ def preprocess_lines(lines, defined_symbols):
                     inside_pico8_block = True
                 else:
                     logging.warning('a pico8 block start was encountered inside a pico8 block. It will be ignored')
-            elif pico8_end_pattern.match(line):
+            else:  # node_type is DirectiveNodeType.PICO8_END
                 if inside_pico8_block:
                     inside_pico8_block = False
                 else:
                     logging.warning('a pico8 block end was encountered outside a pico8 block. It will be ignored')
-            elif not match_stripped_function_call(line, defined_symbols):
-                preprocessed_lines.append(line)
 
-    if if_block_modes_stack:
-        logging.warning('file ended inside an --#if block. Make sure the block is closed by an --#endif directive')
     if inside_pico8_block:
         logging.warning('file ended inside a --[[#pico8 block. Make sure the block is closed by a --#pico8]] directive')
 
-    return preprocessed_lines
 
+def classify_line(line):
+    """
+    Return a pair (line_type: LineType, argument) describing the line of source code, where argument is:
+    - the symbol for LineType.IF and LineType.IFN
+    - the function name for LineType.STRIPPABLE_CALL
+    - a pair (name, value) for LineType.DEFINE, where value is None if missing
+    - None for other line types
+
+    Since most lines are plain code, we dispatch on the first non-blank characters before trying any regex,
+    so plain code lines are classified with a single check in most cases. Hot loops check special_line_prefixes
+    themselves before calling this function, to also avoid the call overhead on plain code lines.
+
+    """
+    stripped_line = line.lstrip()
+    if stripped_line.startswith('--'):
+        # directives are all comments
+        if stripped_line.startswith('--#'):
+            if_match = if_pattern.match(stripped_line)
+            if if_match:
+                return LineType.IF, if_match.group(1)
+            ifn_match = ifn_pattern.match(stripped_line)
+            if ifn_match:
+                return LineType.IFN, ifn_match.group(1)
+            if endif_pattern.match(stripped_line):
+                return LineType.ENDIF, None
+            if pico8_end_pattern.match(stripped_line):
+                return LineType.PICO8_END, None
+            define_match = define_pattern.match(stripped_line)
+            if define_match:
+                return LineType.DEFINE, define_match.groups()
+        elif pico8_start_pattern.match(stripped_line):
+            return LineType.PICO8_START, None
+    elif stripped_line.startswith(strippable_function_call_prefixes):
+        return LineType.STRIPPABLE_CALL, stripped_line[:stripped_line.index('(')]
+
+    return LineType.CODE, None
+
+
+def find_unclosed_long_bracket(source, position=0):
+    """
+    Return the closing bracket (e.g. ']]' or ']=]') of the long string or long comment left open at the end of
+    source code, scanning from position (which must not be inside a string or comment), or None if there is none
+
+    >>> find_unclosed_long_bracket('local text = [==[first line\n')
+    ']==]'
+
+    """
+    while True:
+        long_bracket_scan_match = long_bracket_scan_pattern.search(source, position)
+        if not long_bracket_scan_match:
+            return None
+
+        matched_text = long_bracket_scan_match.group()
+        if matched_text == '--':
+            long_bracket_start_match = lua_tokenizer.long_bracket_start_pattern.match(source, long_bracket_scan_match.end())
+            if not long_bracket_start_match:
+                # short comment until the end of the line
+                position = source.find('\n', long_bracket_scan_match.end())
+                if position == -1:
+                    return None
+                continue
+        elif matched_text[0] == '[':
+            long_bracket_start_match = long_bracket_scan_match
+        else:  # quote
+            try:
+                position = lua_tokenizer.find_short_string_end(source, long_bracket_scan_match.start())
+            except lua_tokenizer.LuaTokenizeError:
+                # unfinished short string, it cannot continue on the next line
+                return None
+            continue
+
+        closing_long_bracket = f"]{long_bracket_start_match.group(1)}]"
+        closing_long_bracket_start = source.find(closing_long_bracket, long_bracket_start_match.end())
+        if closing_long_bracket_start == -1:
+            return closing_long_bracket
+        position = closing_long_bracket_start + len(closing_long_bracket)
+
+
+def find_long_bracket_closing_in_line(line, closing_long_bracket):
+    """
+    Return the closing bracket of the long string or long comment left open at the end of line, which starts inside
+    a long string or long comment closed by closing_long_bracket, or None if there is none (see find_unclosed_long_bracket)
+
+    """
+    closing_long_bracket_start = line.find(closing_long_bracket)
+    if closing_long_bracket_start == -1:
+        return closing_long_bracket
+    return find_unclosed_long_bracket(line, closing_long_bracket_start + len(closing_long_bracket))
+
+
+def scan_call(source):
+    """
+    Return a CallScanResult describing the function call starting source code (after optional blanks),
+    which may span multiple lines. Brackets inside strings and comments are ignored.
+
+    >>> scan_call('log("a(")  -- comment\n')
+    CallScanResult.STANDALONE
+
+    >>> scan_call('log("a"..\n')
+    CallScanResult.UNFINISHED
+
+    >>> scan_call('log("a") print("b")\n')
+    CallScanResult.NOT_STANDALONE
+
+    """
+    if simple_standalone_call_pattern.match(source):
+        return CallScanResult.STANDALONE
+
+    bracket_depth = 0
+    position = 0
+
+    try:
+        while True:
+            call_scan_match = call_scan_pattern.search(source, position)
+            if not call_scan_match:
+                return CallScanResult.UNFINISHED
+
+            matched_text = call_scan_match.group()
+            position = call_scan_match.end()
+            if matched_text == '(':
+                bracket_depth += 1
+            elif matched_text == ')':
+                bracket_depth -= 1
+                if bracket_depth == 0:
+                    break
+            elif matched_text == '--':
+                long_bracket_start_match = lua_tokenizer.long_bracket_start_pattern.match(source, position)
+                if long_bracket_start_match:
+                    position = lua_tokenizer.find_long_bracket_end(source, long_bracket_start_match, 'long comment')
+                else:
+                    position = source.find('\n', position)
+                    if position == -1:
+                        return CallScanResult.UNFINISHED
+            elif matched_text[0] == '[':
+                position = lua_tokenizer.find_long_bracket_end(source, call_scan_match, 'long string')
+            else:  # quote
+                position = lua_tokenizer.find_short_string_end(source, call_scan_match.start())
+    except lua_tokenizer.LuaTokenizeError as e:
+        return CallScanResult.UNFINISHED if e.is_unfinished else CallScanResult.NOT_STANDALONE
+
+    # the call is complete, check that it is not followed by anything else than blanks and comments
+    remaining_source = source[position:]
+    if not remaining_source.strip():
+        return CallScanResult.STANDALONE
+    try:
+        if all(lua_tokenizer.is_blank_token(token) for token in lua_tokenizer.tokenize(remaining_source)):
+            return CallScanResult.STANDALONE
+    except lua_tokenizer.LuaTokenizeError:
+        # unfinished long comment after the call: we cannot strip the line without breaking the comment
+        pass
+    return CallScanResult.NOT_STANDALONE
+
+
+def split_call_arguments(call_source):
+    """
+    Return the list of argument source strings (stripped of surrounding blanks and comments) of the function call
+    starting call_source, or None if the arguments cannot be found (e.g. the call is not finished)
+
+    >>> split_call_arguments('log("a, b" .. f(1, 2), "flow")  -- comment')
+    ['"a, b" .. f(1, 2)', '"flow"']
+
+    """
+    parsed_call = parse_call(call_source)
+    return parsed_call[0] if parsed_call is not None else None
+
+
+def parse_call(call_source):
+    """
+    Return a tuple (arguments, call_end) for the function call starting call_source, where arguments is the list
+    of argument source strings as in split_call_arguments, and call_end the index just after the closing bracket,
+    or None if the arguments cannot be found (e.g. the call is not finished)
+
+    """
+    arguments = []
+    argument_tokens = []
+    bracket_depth = 0
+
+    try:
+        for token in lua_tokenizer.tokenize(call_source):
+            if token.token_type is lua_tokenizer.TokenType.OPERATOR and token.text in argument_delimiters:
+                if token.text in opening_brackets:
+                    bracket_depth += 1
+                    if bracket_depth == 1:
+                        # opening bracket of the call
+                        continue
+                elif token.text in closing_brackets:
+                    bracket_depth -= 1
+                    if bracket_depth == 0:
+                        # closing bracket of the call
+                        if argument_tokens or arguments:
+                            arguments.append(join_argument_tokens(argument_tokens))
+                        return arguments, token.start + 1
+                elif bracket_depth == 1:  # top-level comma
+                    arguments.append(join_argument_tokens(argument_tokens))
+                    argument_tokens = []
+                    continue
+            if bracket_depth >= 1:
+                argument_tokens.append(token)
+    except lua_tokenizer.LuaTokenizeError:
+        pass
+
+    return None
+
+
+def join_argument_tokens(argument_tokens):
+    """Return the source of an argument from its tokens, stripped of surrounding blanks and comments"""
+    non_blank_indices = [i for i, token in enumerate(argument_tokens) if not lua_tokenizer.is_blank_token(token)]
+    if not non_blank_indices:
+        return ""
+    return "".join(token.text for token in argument_tokens[non_blank_indices[0]:non_blank_indices[-1] + 1])
+
+
+def get_log_call_category(call_source):
+    """
+    Return the category of the log function call starting call_source, default_log_category if it has none,
+    or None if it is not a literal string (or the call cannot be parsed)
+
+    """
+    arguments = split_call_arguments(call_source)
+    if arguments is None:
+        return None
+    if len(arguments) < 2 or arguments[1] == 'nil':
+        return default_log_category
+
+    category_literal_match = simple_string_literal_pattern.match(arguments[1])
+    if category_literal_match:
+        return category_literal_match.group(2)
+
+    return None
+
+
+def rewrite_lazy_assert(line):
+    """
+    Return line, a standalone one-line assert call, rewritten so that its message is only evaluated on failure.
+    If the message is missing or is a single token (literal or variable), return line unchanged as there is nothing to gain.
+
+    >>> rewrite_lazy_assert('  assert(x > 0, "bad x: "..x)  -- comment\n')
+    '  if not (x > 0) then assert(false, "bad x: "..x) end  -- comment\n'
+
+    """
+    parsed_call = parse_call(line)
+    if parsed_call is None:
+        return line
+
+    arguments, call_end = parsed_call
+    if len(arguments) != 2 or is_single_token_expression(arguments[1]):
+        return line
+
+    condition, message = arguments
+    indentation = line[:len(line) - len(line.lstrip())]
+    return f"{indentation}if not ({condition}) then assert(false, {message}) end{line[call_end:]}"
+
+
+def is_single_token_expression(expression):
+    """Return true iff expression source contains a single non-blank token"""
+    return sum(1 for token in lua_tokenizer.tokenize(expression) if not lua_tokenizer.is_blank_token(token)) == 1
+
+
+def get_kept_call_lines(function_name, call_lines, call_scan_result, stripped_functions, preserved_log_categories=None):
+    """
+    Return the list of lines to keep from call_lines, the lines of a call to function_name with the given
+    call_scan_result, given the list of stripped_functions and the set of preserved_log_categories
+    (None to preserve all categories, see get_preserved_log_categories).
+    The call is stripped entirely if the function is stripped, or if it is a log function and its category
+    is not preserved, and the call is standalone. A preserved one-line assert is rewritten with rewrite_lazy_assert.
+    If the call should be stripped but cannot be stripped safely, warn and keep all the lines.
+
+    """
+    if function_name not in stripped_functions:
+        if function_name == 'assert':
+            if call_scan_result is CallScanResult.STANDALONE and len(call_lines) == 1:
+                return [rewrite_lazy_assert(call_lines[0])]
+            return call_lines
+        if preserved_log_categories is None or function_name not in log_category_functions:
+            return call_lines
+        if call_scan_result is not CallScanResult.STANDALONE:
+            # we don't even know the category, so preserve the call silently
+            return call_lines
+        category = get_log_call_category("".join(call_lines))
+        if category is None or category in preserved_log_categories:
+            return call_lines
+
+    if call_scan_result is CallScanResult.STANDALONE:
+        return []
+
+    if call_scan_result is CallScanResult.NOT_STANDALONE:
+        logging.warning(f"a call to stripped function '{function_name}' is followed by other code or could not be parsed, so it was not stripped: {call_lines[0].strip()}")
+    else:
+        logging.warning(f"file ended inside a call to stripped function '{function_name}', so it was not stripped: {call_lines[0].strip()}")
+    return call_lines
+
+
+def parse_lines(lines):
+    """
+    Parse iterable lines of source code into a directive tree, independent of defined symbols,
+    so it can be evaluated for multiple lists of defined symbols with evaluate_directive_tree.
+    The tree is a list of nodes, each node being a tuple starting with a DirectiveNodeType (see its definition).
+    It is possible to pass a file as lines iterator.
+
+    """
+    root_nodes = []
+
+    # stack of node lists containing the #if blocks we are currently inside, from top to bottom
+    parent_nodes_stack = []
+    current_nodes = root_nodes
+
+    for node in generate_directive_nodes(lines):
+        if node[0] is DirectiveNodeType.ENDIF:
+            current_nodes = parent_nodes_stack.pop()
+        else:
+            current_nodes.append(node)
+            if node[0] is DirectiveNodeType.IF_BLOCK:
+                parent_nodes_stack.append(current_nodes)
+                current_nodes = node[3]
+
+    return root_nodes
+
+
+def generate_directive_nodes(lines):
+    """
+    Parse iterable lines of source code, independent of defined symbols, yielding a flat sequence of directive nodes
+    (see DirectiveNodeType) as soon as they are complete: each IF_BLOCK node, with an empty list of child nodes,
+    is followed by the nodes of its block, then by an ENDIF node.
+    An --#endif outside any --#if block is ignored with a warning, and so is an --#if block left open at the end.
+    This is the only parser of the preprocessor: parse_lines builds a directive tree from its nodes,
+    and generate_preprocessed_lines evaluates them directly.
+
+    """
+    # number of #if blocks we are currently inside
+    if_block_depth = 0
+
+    # lines of the strippable function call being scanned, when it spans multiple lines
+    call_lines = []
+    call_function_name = None
+
+    # closing bracket of the long string or long comment we are inside, if any (see find_unclosed_long_bracket)
+    closing_long_bracket = None
+
+    # enum member lookups are slow compared to local variables, and this loop runs once per line
+    line_node_type = DirectiveNodeType.LINE
+
+    for line in lines:
+        if call_lines:
+            # we are inside a multi-line call, continue until it is finished
+            call_lines.append(line)
+            call_scan_result = scan_call("".join(call_lines))
+            if call_scan_result is not CallScanResult.UNFINISHED:
+                yield DirectiveNodeType.STRIPPABLE_CALL, call_function_name, call_lines, call_scan_result
+                if call_scan_result is CallScanResult.NOT_STANDALONE:
+                    closing_long_bracket = find_unclosed_long_bracket("".join(call_lines))
+                call_lines = []
+            continue
+
+        if closing_long_bracket is not None:
+            # we are inside a multi-line long string or comment, so the line is not code
+            closing_long_bracket = find_long_bracket_closing_in_line(line, closing_long_bracket)
+            yield line_node_type, line
+            continue
+
+        # fast path for plain code lines, which are the vast majority
+        if not line.lstrip().startswith(special_line_prefixes):
+            yield line_node_type, line
+            if '[[' in line or '[=' in line:
+                closing_long_bracket = find_unclosed_long_bracket(line)
+            continue
+
+        line_type, argument = classify_line(line)
+
+        if line_type is LineType.CODE:
+            yield DirectiveNodeType.LINE, line
+            closing_long_bracket = find_unclosed_long_bracket(line)
+        elif line_type is LineType.IF or line_type is LineType.IFN:
+            if_block_depth += 1
+            yield DirectiveNodeType.IF_BLOCK, argument, line_type is LineType.IFN, []
+        elif line_type is LineType.ENDIF:
+            if if_block_depth > 0:
+                if_block_depth -= 1
+                yield DirectiveNodeType.ENDIF,
+            else:
+                logging.warning('an --#endif was encountered outside an --#if block. Make sure the block starts with an --#if directive')
+        elif line_type is LineType.PICO8_START:
+            yield DirectiveNodeType.PICO8_START,
+        elif line_type is LineType.PICO8_END:
+            yield DirectiveNodeType.PICO8_END,
+        elif line_type is LineType.DEFINE:
+            yield (DirectiveNodeType.DEFINE, *argument)
+        else:  # line_type is LineType.STRIPPABLE_CALL
+            call_scan_result = scan_call(line)
+            if call_scan_result is CallScanResult.UNFINISHED:
+                # multi-line call, accumulate lines until the end of the call
+                call_lines = [line]
+                call_function_name = argument
+            else:
+                yield DirectiveNodeType.STRIPPABLE_CALL, argument, [line], call_scan_result
+                if call_scan_result is CallScanResult.NOT_STANDALONE:
+                    closing_long_bracket = find_unclosed_long_bracket(line)
+
+    if call_lines:
+        yield DirectiveNodeType.STRIPPABLE_CALL, call_function_name, call_lines, CallScanResult.UNFINISHED
+    if if_block_depth > 0:
+        logging.warning('file ended inside an --#if block. Make sure the block is closed by an --#endif directive')
+
+
+def evaluate_directive_tree(directive_tree, defined_symbols):
+    """
+    Return the list of preprocessed lines from a directive tree generated by parse_lines, for the given defined_symbols
+    (which may contain defines "name=value").
+    The result is the same as preprocess_lines on the parsed lines.
+
+    """
+    defined_symbols, defines = split_symbols_and_defines(defined_symbols)
+    flattened_nodes = generate_flattened_nodes(directive_tree)
+    return list(generate_substituted_lines(generate_evaluated_lines(flattened_nodes, defined_symbols, defines), defines))
+
+
+def generate_flattened_nodes(nodes):
+    """
+    Yield the nodes of a directive tree generated by parse_lines as a flat sequence of directive nodes,
+    as generated by generate_directive_nodes
+
+    """
+    for node in nodes:
+        yield node
+        if node[0] is DirectiveNodeType.IF_BLOCK:
+            yield from generate_flattened_nodes(node[3])
+            yield DirectiveNodeType.ENDIF,
+
+
+def split_symbols_and_defines(defined_symbols):
+    """
+    Return a pair (symbols, defines) from defined_symbols, a list of symbols and defines "name=value",
+    where symbols is the list of all symbol names, including define names, and defines a dict of values by name
+
+    >>> split_symbols_and_defines(['debug', 'screen_width=128'])
+    (['debug', 'screen_width'], {'screen_width': '128'})
+
+    """
+    symbols = []
+    defines = {}
+    for defined_symbol in defined_symbols:
+        name, separator, value = defined_symbol.partition('=')
+        symbols.append(name)
+        if separator:
+            defines[name] = value
+    return symbols, defines
+
+
+def add_define(defines, name, value):
+    """Add define with name and value (str) to defines (dict), or warn if value is None"""
+    if value is None:
+        logging.warning(f"--#define {name} has no value. It will be ignored")
+        return
+    defines[name] = value
+
+
+def read_defines_file(filepath):
+    """
+    Return the list of defines "name=value" from the file at filepath, made of Lua global assignments of literals
+    (e.g. "screen_width = 128 -- comment"), ignoring blank lines and comments.
+    Warn about lines that are not such assignments and ignore them.
+
+    """
+    defines = []
+    with open(filepath, 'r') as f:
+        for line_index, line in enumerate(f):
+            tokens = [token for token in lua_tokenizer.tokenize(line) if not lua_tokenizer.is_blank_token(token)]
+            if not tokens:
+                continue
+            define_assignment_match = define_assignment_pattern.match("".join(token.text for token in tokens))
+            if not define_assignment_match or not is_literal_expression(define_assignment_match.group(2)):
+                logging.warning(f"{filepath}:{line_index + 1}: line is not an assignment of a literal, it will be ignored: {line.strip()}")
+                continue
+            defines.append(f"{define_assignment_match.group(1)}={define_assignment_match.group(2)}")
+    return defines
+
+
+def is_literal_expression(expression):
+    """Return true iff expression source is a literal number, string, boolean or nil, optionally negated"""
+    tokens = [token for token in lua_tokenizer.tokenize(expression) if not lua_tokenizer.is_blank_token(token)]
+    if tokens and tokens[0].text == '-':
+        tokens = tokens[1:]
+    return len(tokens) == 1 and (tokens[0].token_type in (lua_tokenizer.TokenType.NUMBER, lua_tokenizer.TokenType.STRING)
+        or tokens[0].text in ('true', 'false', 'nil'))
+
+
+def generate_substituted_lines(lines, defines):
+    """
+    Yield iterable lines of source code with define names replaced with their values (see notes on 5.).
+    defines (dict) may be filled while iterating, each define being applied to the lines yielded after.
+    Lines opening a long string or comment are buffered until it is closed, so names inside are preserved.
+
+    """
+    # lines of the long string or comment being scanned, when one spans multiple lines
+    pending_lines = []
+    define_name_pattern = None
+    define_name_pattern_defines_count = 0
+
+    for line in lines:
+        # defines are never removed, so there cannot be pending lines without defines
+        if not defines:
+            yield line
+            continue
+
+        if define_name_pattern is None or define_name_pattern_defines_count != len(defines):
+            define_name_pattern = re.compile(rf"\b(?:{'|'.join(re.escape(name) for name in defines)})\b")
+            define_name_pattern_defines_count = len(defines)
+
+        if not pending_lines and not define_name_pattern.search(line) and not lua_tokenizer.long_bracket_start_pattern.search(line):
+            # fast path: no names to replace and no long brackets to track
+            yield line
+            continue
+
+        pending_lines.append(line)
+        try:
+            substituted_source = substitute_defines("".join(pending_lines), defines)
+        except lua_tokenizer.LuaTokenizeError as e:
+            if e.is_unfinished:
+                # long string or comment not closed yet, wait for more lines
+                continue
+            # malformed code, leave it as is
+            substituted_source = "".join(pending_lines)
+        pending_lines = []
+        yield from substituted_source.splitlines(keepends=True)
+
+    # file ended inside a long string or comment, leave it as is
+    yield from pending_lines
+
+
+def substitute_defines(source, defines):
+    """
+    Return source with define names replaced with their values (see notes on 5.).
+    Raise LuaTokenizeError if source cannot be tokenized.
+
+    >>> substitute_defines('x = screen_width / 2  -- screen_width', {'screen_width': '128'})
+    'x = 128 / 2  -- screen_width'
+
+    """
+    tokens = list(lua_tokenizer.tokenize(source))
+    significant_tokens = [token for token in tokens if not lua_tokenizer.is_blank_token(token)]
+    substituted_texts = []
+    # index of the next significant token in significant_tokens
+    significant_index = 0
+    previous_significant_token = None
+    # part of a local, for or function declaration being scanned, where names are new variables
+    declaration_state = None
+
+    for token in tokens:
+        text = token.text
+        if token.token_type is lua_tokenizer.TokenType.NAME and text in defines:
+            if declaration_state in ('local', 'local_function_name', 'for', 'parameters'):
+                # new variable shadowing the define: keep it, but its uses in scope are replaced
+                logging.warning(f"define '{text}' is shadowed by a local variable, loop variable or parameter, "
+                    f"so its uses in scope will be replaced with its value: {get_source_line_at(source, token.start).strip()}")
+            elif not (previous_significant_token is not None and previous_significant_token.text in define_name_forbidden_prefixes) and \
+                    not is_assignment_target(significant_tokens, significant_index):
+                value = defines[text]
+                text = value if is_single_token_expression(value) else f"({value})"
+        substituted_texts.append(text)
+        if not lua_tokenizer.is_blank_token(token):
+            declaration_state = get_next_declaration_state(declaration_state, token)
+            previous_significant_token = token
+            significant_index += 1
+
+    return "".join(substituted_texts)
+
+
+def is_assignment_target(significant_tokens, name_index):
+    """
+    Return true iff the name at significant_tokens[name_index] is assigned, i.e. it is followed by an assignment
+    operator, directly or after other comma-separated targets (e.g. "name, t.field, t[key] = ...").
+
+    """
+    index = name_index + 1
+    token_count = len(significant_tokens)
+    while index < token_count:
+        text = significant_tokens[index].text
+        if text in assignment_operators:
+            return True
+        if text != ',':
+            return False
+
+        # skip the next target: a name followed by any number of fields and indexes
+        index += 1
+        if index >= token_count or significant_tokens[index].token_type is not lua_tokenizer.TokenType.NAME:
+            return False
+        index += 1
+        while index < token_count and significant_tokens[index].text in ('.', '['):
+            if significant_tokens[index].text == '.':
+                index += 2
+            else:
+                depth = 0
+                while index < token_count:
+                    bracket = significant_tokens[index].text
+                    depth += 1 if bracket == '[' else -1 if bracket == ']' else 0
+                    index += 1
+                    if depth == 0:
+                        break
+    return False
+
+
+def get_next_declaration_state(declaration_state, token):
+    """
+    Return the declaration state after significant token, given the state before it:
+    'local' where a name is expected after "local" or a comma, 'local_name' right after such a name,
+    'local_function_name' right after "local function",
+    'for' where a name is expected after "for" or a comma, 'for_name' right after such a name,
+    'function_name' in the name of a function, 'parameters' in its parameter list, None elsewhere.
+
+    """
+    if token.token_type is lua_tokenizer.TokenType.KEYWORD:
+        if token.text == 'local':
+            return 'local'
+        if token.text == 'for':
+            return 'for'
+        if token.text == 'function':
+            return 'local_function_name' if declaration_state == 'local' else 'function_name'
+        return None
+    if declaration_state in ('local', 'for'):
+        return f"{declaration_state}_name" if token.token_type is lua_tokenizer.TokenType.NAME else None
+    if declaration_state in ('local_name', 'for_name'):
+        # "=" or "in" ends the list of declared names
+        return declaration_state[:-len('_name')] if token.text == ',' else None
+    if declaration_state in ('local_function_name', 'function_name'):
+        if token.text == '(':
+            return 'parameters'
+        return 'function_name' if token.token_type is lua_tokenizer.TokenType.NAME or token.text in ('.', ':') else None
+    if declaration_state == 'parameters':
+        return None if token.text == ')' else 'parameters'
+    return None
 
-def match_stripped_function_call(line, defined_symbols):
-    """Return true iff the line contains a function call (and optionally a comment) that should be stripped in the passed config"""
-    stripped_function_call_pattern = get_or_generate_stripped_function_call_pattern_from_defined_symbols(tuple(defined_symbols))
-    if stripped_function_call_pattern is None:
-        return False
 
-    return bool(stripped_function_call_pattern.match(line))
+def get_source_line_at(source, position):
+    """Return the line of source containing the character at position, without the final newline"""
+    line_start = source.rfind('\n', 0, position) + 1
+    line_end = source.find('\n', position)
+    return source[line_start:line_end if line_end >= 0 else len(source)]
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Apply preprocessor directives.')
-    parser.add_argument('path', type=str, help='path containing source files to preprocess')
-    parser.add_argument('--symbols', nargs='*', type=str, help="symbols to define, e.g. 'debug'")
+    parser.add_argument('path', type=str, help="path containing source files to preprocess, or '-' to preprocess stdin to stdout")
+    parser.add_argument('--symbols', nargs='*', type=str, help="symbols to define, e.g. 'debug', or defines 'name=value'")
+    parser.add_argument('--defines-file', type=str,
+        help="path of a file of Lua global assignments of literals (e.g. 'screen_width = 128') to use as defines " +
+             "in all configs (optional)")
+    parser.add_argument('-o', '--output-path', type=str,
+        help="preprocess files in path into OUTPUT_PATH with --symbols, without modifying them, " +
+             "skipping files already up to date (optional, files are preprocessed in-place if not set)")
+    parser.add_argument('--cache-dir', type=str, help="path of the directory where to cache preprocessed files (optional, no caching if not set)")
+    parser.add_argument('--config-output', nargs=2, action='append', metavar=('OUTPUT_PATH', 'SYMBOLS_STRING'),
+        help="preprocess files in path for one more config, without modifying them, into OUTPUT_PATH, with symbols " +
+             "separated by ',' in SYMBOLS_STRING (pass '' for no symbols). Can be repeated to preprocess multiple configs " +
+             "in a single pass.")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+        help="number of processes used to preprocess files in parallel (default: number of CPU cores)")
     args = parser.parse_args()
     if args.symbols is None:
         args.symbols = []
 
     logging.basicConfig(level=logging.INFO)
-    preprocess_dir(args.path, args.symbols)
-    print(f"Preprocessed all files in {args.path} with symbols {args.symbols}.")
+    file_defines = read_defines_file(args.defines_file) if args.defines_file else []
+    args.symbols += file_defines
+    if args.path == '-':
+        # streaming mode, useful as part of a pipeline: only preprocessed code must be output to stdout
+        # (logging outputs to stderr)
+        sys.stdout.writelines(generate_preprocessed_lines(sys.stdin, args.symbols))
+    elif args.output_path or args.config_output:
+        defined_symbols_by_output_dirpath = {}
+        if args.output_path:
+            defined_symbols_by_output_dirpath[args.output_path] = args.symbols
+        if args.config_output:
+            for output_dirpath, symbols_string in args.config_output:
+                defined_symbols_by_output_dirpath[output_dirpath] = [symbol for symbol in symbols_string.split(',') if symbol] + file_defines
+        preprocess_dir_multi(args.path, defined_symbols_by_output_dirpath, args.cache_dir, args.jobs)
+        for output_dirpath, defined_symbols in defined_symbols_by_output_dirpath.items():
+            print(f"Preprocessed all files in {args.path} to {output_dirpath} with symbols {defined_symbols}.")
+    else:
+        preprocess_dir(args.path, args.symbols, args.cache_dir, args.jobs)
+        print(f"Preprocessed all files in {args.path} with symbols {args.symbols}.")
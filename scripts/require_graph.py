@@ -0,0 +1,341 @@
+#!/usr/bin/env python3.6
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import logging
+import os
+import sys
+from collections import namedtuple
+
+try:
+    from . import lua_tokenizer
+    from . import optimize
+    from . import pico8_tokens
+    from .lua_tokenizer import TokenType
+except ImportError:
+    # script run directly, not as part of the scripts package
+    import lua_tokenizer
+    import optimize
+    import pico8_tokens
+    from lua_tokenizer import TokenType
+
+
+# This script builds the graph of modules required from an entry script, following `require("module")` calls
+# across several require roots (typically the game source root and the pico-boots src root, as in the lua path
+# passed to picotool), and reports for each module:
+# - its own cost: tokens (as counted by PICO-8, see pico8_tokens.py) and characters of its own code
+# - its transitive cost: cost of the module and all the modules it requires directly or indirectly, each counted once,
+#   as picotool only includes each module once in the cartridge
+# It also reports:
+# - empty modules: modules that are required, but contain no code once preprocessed (e.g. debug modules in release),
+#   so their require calls can be removed
+# - require edges (requiring module -> required module) with the cost that would be removed from the cartridge
+#   if the edge was cut, i.e. the cost of the modules that would not be reachable from the entry anymore.
+#   Edges with a removed cost of 0 are redundant, as the required module is reachable through other requires anyway.
+
+# Requires are only found in code: requires inside comments, including code blocks only enabled in PICO-8 with
+# `--[[#pico8` (see preprocess.py), are ignored. So apply this script to the intermediate directories *after*
+# building for the config you want to analyze (e.g. intermediate/release/src and intermediate/release/pico-boots),
+# as this will give the most meaningful results (pre-processing already applied).
+# Requires whose module name is not a simple string literal, or that cannot be found in any root (e.g. busted modules),
+# are reported as unresolved and otherwise ignored.
+
+# Usage:
+# require_graph.py entry --roots root1 [root2 ...] [--format text|json]
+# entry:        path of the entry script (e.g. game_src/main.lua), or its module name relative to a root (e.g. main)
+# roots:        paths of the directories from which required modules are resolved, in order of priority
+
+
+OUTPUT_FORMATS = ['text', 'json']
+
+# module     str        module name, as in require (e.g. 'engine/core/class')
+# filepath   str        path of the module script
+# requires   [str]      names of the modules required by this module, in order of first require, without duplicates
+# tokens     int        number of tokens in the module code
+# chars      int        number of characters in the module code
+ModuleNode = namedtuple('ModuleNode', ['module', 'filepath', 'requires', 'tokens', 'chars'])
+
+
+class RequireGraph:
+    """
+    Graph of modules reachable through requires from an entry module
+
+    entry_module        str                     module name of the entry script
+    nodes               {str: ModuleNode}       nodes by module name, in order of discovery (breadth-first from entry)
+    unresolved_requires [(str, str)]            list of (requiring module, required module name or expression)
+                                                for requires that could not be followed
+
+    """
+
+    def __init__(self, entry_module):
+        self.entry_module = entry_module
+        self.nodes = {}
+        self.unresolved_requires = []
+
+    def get_edges(self):
+        """Return the list of (requiring module, required module) edges between nodes"""
+        return [(node.module, required_module) for node in self.nodes.values()
+                for required_module in node.requires if required_module in self.nodes]
+
+    def get_reachable_modules(self, start_module, excluded_edge=None):
+        """
+        Return the set of modules reachable from start_module, including itself,
+        optionally ignoring excluded_edge (requiring module, required module)
+
+        """
+        reachable_modules = {start_module}
+        modules_to_visit = [start_module]
+        while modules_to_visit:
+            module = modules_to_visit.pop()
+            for required_module in self.nodes[module].requires:
+                if required_module in self.nodes and required_module not in reachable_modules and \
+                        (module, required_module) != excluded_edge:
+                    reachable_modules.add(required_module)
+                    modules_to_visit.append(required_module)
+        return reachable_modules
+
+    def get_cost(self, modules):
+        """Return (tokens, chars) of all modules in the passed iterable"""
+        return sum(self.nodes[module].tokens for module in modules), sum(self.nodes[module].chars for module in modules)
+
+    def get_transitive_cost(self, module):
+        """Return (tokens, chars) of module and all the modules it requires directly or indirectly, counted once"""
+        return self.get_cost(self.get_reachable_modules(module))
+
+    def get_edge_removed_cost(self, edge):
+        """
+        Return (tokens, chars) of the modules that would not be reachable from the entry module anymore
+        if edge (requiring module, required module) was removed
+
+        """
+        all_reachable_modules = self.get_reachable_modules(self.entry_module)
+        return self.get_cost(all_reachable_modules - self.get_reachable_modules(self.entry_module, edge))
+
+    def get_empty_modules(self):
+        """Return the list of required modules without any token, in order of discovery"""
+        return [node.module for node in self.nodes.values() if node.tokens == 0 and node.module != self.entry_module]
+
+
+def find_requires(code, top_level_only=False):
+    """
+    Return the list of module names required in code, in order of appearance.
+    Requires whose argument is not a simple string literal are returned as None.
+    If top_level_only is True, only return requires outside any block (function body, if, loop...),
+    i.e. the ones always run when the code is run.
+
+    >>> find_requires('require("engine/core/class")\\nlocal input = require "engine/input/input"')
+    ['engine/core/class', 'engine/input/input']
+
+    """
+    tokens = []
+    # block depth of each token of tokens
+    depths = []
+    depth = 0
+    # index of the end of the line of the last shorthand if, whose statement is conditional like a block
+    shorthand_if_line_end = -1
+    all_tokens = list(lua_tokenizer.tokenize(code))
+    for index, token in enumerate(all_tokens):
+        if lua_tokenizer.is_blank_token(token):
+            continue
+        tokens.append(token)
+        depths.append(depth + 1 if index < shorthand_if_line_end else depth)
+        if token.token_type is TokenType.KEYWORD:
+            if token.text == 'if':
+                if optimize.is_shorthand_if(all_tokens, index):
+                    shorthand_if_line_end = optimize.find_line_end(all_tokens, index)
+                else:
+                    depth += 1
+            elif token.text in optimize.block_opening_keywords:
+                depth += 1
+            elif token.text in optimize.block_closing_keywords:
+                depth -= 1
+
+    required_modules = []
+    for index, token in enumerate(tokens):
+        if token.token_type is not TokenType.NAME or token.text != 'require':
+            continue
+        if top_level_only and depths[index] > 0:
+            continue
+        # skip member calls like obj.require() or obj:require()
+        if index > 0 and tokens[index - 1].text in ('.', ':'):
+            continue
+
+        # support both require("module") and require "module"
+        argument_index = index + 2 if index + 1 < len(tokens) and tokens[index + 1].text == '(' else index + 1
+        if argument_index >= len(tokens):
+            continue
+        argument_token = tokens[argument_index]
+        is_single_argument = argument_index == index + 1 or \
+            (argument_index + 1 < len(tokens) and tokens[argument_index + 1].text == ')')
+
+        if argument_token.token_type is TokenType.STRING and is_single_argument:
+            required_modules.append(optimize.parse_simple_string_literal(argument_token.text))
+        elif argument_index == index + 2:
+            # require(expression), module cannot be known statically
+            required_modules.append(None)
+        # else, require is not called here (e.g. passed as value), ignore it
+
+    return required_modules
+
+
+def resolve_module(module, roots):
+    """Return the path of the script for module in the first root that has it, or None if none has it"""
+    for root in roots:
+        filepath = os.path.join(root, f"{module}.lua")
+        if os.path.isfile(filepath):
+            return filepath
+    return None
+
+
+def get_module_name(filepath, roots):
+    """Return the module name of the script at filepath, relative to the first root containing it, or None"""
+    absolute_filepath = os.path.abspath(filepath)
+    for root in roots:
+        relative_filepath = os.path.relpath(absolute_filepath, os.path.abspath(root))
+        if not relative_filepath.startswith(os.pardir + os.sep):
+            return os.path.splitext(relative_filepath)[0].replace(os.sep, '/')
+    return None
+
+
+def build_require_graph(entry, roots):
+    """
+    Return the RequireGraph of modules reachable from entry, the path of the entry script or its module name,
+    resolving required modules in roots (list of directory paths, in order of priority).
+    Raise ValueError if the entry script cannot be found.
+
+    """
+    if os.path.isfile(entry):
+        entry_filepath = entry
+        # entry may be outside the roots, in which case we can only name it after its path
+        entry_module = get_module_name(entry, roots) or os.path.splitext(entry)[0]
+    else:
+        entry_module = entry[:-len(".lua")] if entry.endswith(".lua") else entry
+        entry_filepath = resolve_module(entry_module, roots)
+        if entry_filepath is None:
+            raise ValueError(f"entry '{entry}' is neither a file nor a module found in roots {roots}")
+
+    graph = RequireGraph(entry_module)
+    modules_to_visit = [(entry_module, entry_filepath)]
+    visit_index = 0
+    while visit_index < len(modules_to_visit):
+        module, filepath = modules_to_visit[visit_index]
+        visit_index += 1
+
+        with open(filepath, 'r') as lua_file:
+            code = lua_file.read()
+
+        requires = []
+        for required_module in find_requires(code):
+            if required_module is None:
+                graph.unresolved_requires.append((module, "<expression>"))
+            elif required_module not in requires:
+                requires.append(required_module)
+
+        graph.nodes[module] = ModuleNode(module, filepath, requires, pico8_tokens.count_tokens(code), len(code))
+
+        for required_module in requires:
+            if required_module in graph.nodes or any(required_module == queued_module for queued_module, _ in modules_to_visit):
+                continue
+            required_filepath = resolve_module(required_module, roots)
+            if required_filepath is None:
+                graph.unresolved_requires.append((module, required_module))
+            else:
+                modules_to_visit.append((required_module, required_filepath))
+
+    return graph
+
+
+def get_report(graph):
+    """
+    Return a dict with the module costs, empty modules, edge costs and unresolved requires of graph,
+    modules being sorted by transitive tokens and edges by removed tokens, largest first
+
+    """
+    required_by_count = {module: 0 for module in graph.nodes}
+    for _, required_module in graph.get_edges():
+        required_by_count[required_module] += 1
+
+    modules = []
+    for node in graph.nodes.values():
+        transitive_tokens, transitive_chars = graph.get_transitive_cost(node.module)
+        modules.append({
+            'module': node.module,
+            'tokens': node.tokens,
+            'chars': node.chars,
+            'transitive_tokens': transitive_tokens,
+            'transitive_chars': transitive_chars,
+            'required_by': required_by_count[node.module],
+            'requires': node.requires,
+        })
+    modules.sort(key=lambda module_info: (-module_info['transitive_tokens'], -module_info['tokens'], module_info['module']))
+
+    edges = []
+    for edge in graph.get_edges():
+        removed_tokens, removed_chars = graph.get_edge_removed_cost(edge)
+        edges.append({'module': edge[0], 'required_module': edge[1], 'removed_tokens': removed_tokens, 'removed_chars': removed_chars})
+    edges.sort(key=lambda edge_info: (-edge_info['removed_tokens'], edge_info['module'], edge_info['required_module']))
+
+    return {
+        'entry': graph.entry_module,
+        'total_tokens': graph.get_transitive_cost(graph.entry_module)[0],
+        'total_chars': graph.get_transitive_cost(graph.entry_module)[1],
+        'modules': modules,
+        'empty_modules': graph.get_empty_modules(),
+        'edges': edges,
+        'unresolved_requires': [{'module': module, 'required_module': required_module}
+                                for module, required_module in graph.unresolved_requires],
+    }
+
+
+def write_report(report, output_format, output_stream):
+    """Write report (see get_report) to output_stream in output_format (see OUTPUT_FORMATS)"""
+    if output_format == 'json':
+        json.dump(report, output_stream, indent=2)
+        output_stream.write("\n")
+        return
+    if output_format != 'text':
+        raise ValueError(f"unknown output format '{output_format}', expected one of {OUTPUT_FORMATS}")
+
+    output_stream.write(f"Require graph from {report['entry']}: {len(report['modules'])} modules, "
+        f"{report['total_tokens']} tokens, {report['total_chars']} chars\n\n")
+
+    output_stream.write("Modules (own tokens, own chars, transitive tokens, transitive chars, required by):\n")
+    for module_info in report['modules']:
+        output_stream.write(f"{module_info['tokens']:6d} {module_info['chars']:7d} {module_info['transitive_tokens']:6d} "
+            f"{module_info['transitive_chars']:7d} {module_info['required_by']:4d}  {module_info['module']}\n")
+
+    output_stream.write("\nRequire edges (tokens, chars removed from the build if cut):\n")
+    for edge_info in report['edges']:
+        redundant_note = "  (redundant)" if edge_info['removed_tokens'] == 0 and edge_info['removed_chars'] == 0 else ""
+        output_stream.write(f"{edge_info['removed_tokens']:6d} {edge_info['removed_chars']:7d}  "
+            f"{edge_info['module']} -> {edge_info['required_module']}{redundant_note}\n")
+
+    if report['empty_modules']:
+        output_stream.write("\nEmpty modules (required, but without code):\n")
+        for module in report['empty_modules']:
+            output_stream.write(f"{module}\n")
+
+    if report['unresolved_requires']:
+        output_stream.write("\nUnresolved requires:\n")
+        for unresolved_require in report['unresolved_requires']:
+            output_stream.write(f"{unresolved_require['module']} -> {unresolved_require['required_module']}\n")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Report the token and character cost of modules required from an entry script.')
+    parser.add_argument('entry', type=str, help='path of the entry script, or its module name relative to a root')
+    parser.add_argument('-r', '--roots', type=str, nargs='+', required=True,
+        help='paths of the directories from which required modules are resolved, in order of priority')
+    parser.add_argument('-f', '--format', type=str, choices=OUTPUT_FORMATS, default='text',
+        help="output format: human-readable text, or json for other tools (default: text)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    try:
+        graph = build_require_graph(args.entry, args.roots)
+    except ValueError as e:
+        logging.error(e)
+        sys.exit(1)
+
+    write_report(get_report(graph), args.format, sys.stdout)
@@ -31,10 +31,14 @@ class TestAddRequireFromDir(unittest.TestCase):
         shutil.rmtree(self.test_dir)
 
     def test_add_require_from_dir(self):
-        add_require.add_require_from_dir('test_filepath', 'dummy root', 'dummy dirname')
+        test_filepath = path.join(self.test_dir, 'test.lua')
+        with open(test_filepath, 'w') as f:
+            f.write('--[[add_require]]\n')
+
+        add_require.add_require_from_dir(test_filepath, 'dummy root', 'dummy dirname')
 
         self.add_require_from_module_paths_mock.assert_called_once()
-        self.add_require_from_module_paths_mock.assert_called_with('test_filepath', ["helper/print_helper", "helper/sub/other_helper"])
+        self.add_require_from_module_paths_mock.assert_called_with(test_filepath, ["helper/print_helper", "helper/sub/other_helper"])
 
 
 class TestAddRequireHelpers(unittest.TestCase):
@@ -89,6 +93,68 @@ class TestAddRequireHelpers(unittest.TestCase):
 
         self.assertEqual(add_require.find_relative_module_paths(self.test_dir, 'helper'), ['helper/dummy_module1', 'helper/subdir/dummy_module2'])
 
+    def test_find_relative_module_paths_include_exclude(self):
+        for module in ['helper/a', 'helper/b', 'helper/sub/c', 'helper/sub/d']:
+            self.write_module(module, '')
+
+        self.assertEqual(add_require.find_relative_module_paths(self.test_dir, 'helper', ['helper/sub/*']),
+            ['helper/sub/c', 'helper/sub/d'])
+        self.assertEqual(add_require.find_relative_module_paths(self.test_dir, 'helper', [], ['*/b', 'helper/sub/d']),
+            ['helper/a', 'helper/sub/c'])
+        self.assertEqual(add_require.find_relative_module_paths(self.test_dir, 'helper', ['helper/sub/*'], ['*/d']),
+            ['helper/sub/c'])
+
+    def test_get_ordered_module_paths_dependencies_first(self):
+        self.write_module('itests/a', 'require("helper/common")\n')
+        self.write_module('itests/b', 'require("engine/core/class")\n')
+        self.write_module('helper/common', 'require("helper/log")\n')
+        self.write_module('helper/log', '')
+
+        self.assertEqual(add_require.get_ordered_module_paths(self.test_dir, ['helper/log', 'itests/a', 'itests/b']),
+            ['itests/a', 'itests/b'])
+
+    def test_get_ordered_module_paths_requiring_module_first(self):
+        self.write_module('itests/a', 'require("itests/c")\n')
+        self.write_module('itests/b', '')
+        self.write_module('itests/c', '')
+        self.write_module('itests/d', 'require("itests/a")\n')
+
+        self.assertEqual(add_require.get_ordered_module_paths(self.test_dir, ['itests/a', 'itests/b', 'itests/c', 'itests/d']),
+            ['itests/b', 'itests/d'])
+
+    def test_get_ordered_module_paths_skips_modules_required_by_requiring_code(self):
+        self.write_module('itests/a', 'require("itests/b")\n')
+        self.write_module('itests/b', '')
+        self.write_module('itests/c', '')
+
+        self.assertEqual(add_require.get_ordered_module_paths(self.test_dir, ['itests/a', 'itests/b', 'itests/c'],
+            'require("itests/a")\n--[[add_require]]\n'), ['itests/c'])
+
+    def test_get_ordered_module_paths_ignores_requires_in_function_body(self):
+        self.write_module('itests/a', 'function setup()\n  require("itests/b")\nend\n')
+        self.write_module('itests/b', '')
+
+        self.assertEqual(add_require.get_ordered_module_paths(self.test_dir, ['itests/a', 'itests/b'],
+            'function _init()\n  require("itests/a")\nend\n--[[add_require]]\n'), ['itests/a', 'itests/b'])
+
+    def test_get_ordered_module_paths_circular_requires(self):
+        self.write_module('itests/a', 'require("itests/b")\n')
+        self.write_module('itests/b', 'require("itests/a")\n')
+
+        self.assertEqual(add_require.get_ordered_module_paths(self.test_dir, ['itests/a', 'itests/b']), ['itests/a'])
+
+    def test_get_ordered_module_paths_invalid_module(self):
+        self.write_module('itests/a', 'x = "unfinished\n')
+        self.write_module('itests/b', '')
+
+        self.assertEqual(add_require.get_ordered_module_paths(self.test_dir, ['itests/a', 'itests/b']), ['itests/a', 'itests/b'])
+
+    def write_module(self, module, code):
+        filepath = path.join(self.test_dir, f"{module}.lua")
+        os.makedirs(path.dirname(filepath), exist_ok=True)
+        with open(filepath, 'w') as f:
+            f.write(code)
+
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.CRITICAL)
@@ -1,7 +1,11 @@
 import unittest
+from unittest import mock
 from . import analyze
 
+import io
+import json
 import logging
+import os
 from os import path
 import shutil, tempfile
 
@@ -19,13 +23,11 @@ class TestAnalyzeScript(unittest.TestCase):
     def test_analyze_script(self):
         source_text = """local a = 5
 """
-        expected_stats_text = """source.lua (source.p8)
-by analyze_script
-- version: 16
-- lines: 3
-- chars: 47
+        expected_stats_text = """source.lua
+- lines: 1
+- chars: 12
 - tokens: 3
-- compressed chars: 48
+- compressed bytes: 21
 
 """
 
@@ -43,78 +45,177 @@ by analyze_script
             self.assertEqual(s.read(), expected_stats_text)
 
 
-class TestCartridgify(unittest.TestCase):
+class TestAnalyzeScriptsInDir(unittest.TestCase):
 
     def setUp(self):
         # Create a temporary directory
         self.test_dir = tempfile.mkdtemp()
+        os.makedirs(path.join(self.test_dir, 'engine'))
+        for relative_filepath, code in [('main.lua', "local a = 5\n"),
+                                        ('engine/helper.lua', "print(1)\n"),
+                                        ('engine/helper_utest.lua', "print(2)\n"),
+                                        ('bustedhelper.lua', "print(3)\n"),
+                                        ('data.txt', "print(4)\n")]:
+            with open(path.join(self.test_dir, relative_filepath), 'w') as f:
+                f.write(code)
 
     def tearDown(self):
         # Remove the directory after the test
         shutil.rmtree(self.test_dir)
 
-    def test_cartridgify(self):
-        source_text = """local a = 5
-"""
-        expected_target_text = """pico-8 cartridge // http://www.pico-8.com
-version 16
-__lua__
--- source.lua
--- by analyze_script
-local a = 5
-"""
+    def analyze_scripts_in_dir(self, output_format, jobs=1):
+        output_stream = io.StringIO()
+        analyze.analyze_scripts_in_dir(self.test_dir, output_format, output_stream, jobs)
+        return output_stream.getvalue()
 
-        source_relative_filepath = 'source.lua'
-        source_filepath = path.join(self.test_dir, source_relative_filepath)
-        target_filepath = path.join(self.test_dir, 'target.p8')
+    def test_find_lua_scripts(self):
+        self.assertEqual(analyze.find_lua_scripts(self.test_dir), [path.join('engine', 'helper.lua'), 'main.lua'])
 
-        with open(source_filepath, 'w') as s:
-            s.write(source_text)
+    def test_get_scripts_stats_in_dir(self):
+        self.assertEqual(analyze.get_scripts_stats_in_dir(self.test_dir), [
+            analyze.ScriptStats('engine/helper', 1, 9, 3, analyze.pico8_compression.get_compressed_code_size("print(1)\n")),
+            analyze.ScriptStats('main', 1, 12, 3, 21),
+        ])
 
-        analyze.cartridgify(self.test_dir, source_relative_filepath, target_filepath)
+    def test_get_scripts_stats_in_dir_parallel(self):
+        self.assertEqual(analyze.get_scripts_stats_in_dir(self.test_dir, jobs=2),
+            analyze.get_scripts_stats_in_dir(self.test_dir, jobs=1))
 
-        with open(target_filepath, 'r') as t:
-            self.assertEqual(t.read(), expected_target_text)
+    def test_get_scripts_stats_in_dir_skip_untokenizable_file(self):
+        with open(path.join(self.test_dir, 'invalid.lua'), 'w') as f:
+            f.write('print("unfinished\n')
 
+        with self.assertLogs(level='WARNING') as cm:
+            scripts_stats = analyze.get_scripts_stats_in_dir(self.test_dir)
 
-class TestPrintStats(unittest.TestCase):
+        self.assertEqual([script_stats.module for script_stats in scripts_stats], ['engine/helper', 'main'])
+        self.assertIn('invalid.lua', cm.output[0])
 
-    def setUp(self):
-        # Create a temporary directory
-        self.test_dir = tempfile.mkdtemp()
+    def test_get_scripts_stats_in_dir_parallel_skip_untokenizable_file(self):
+        with open(path.join(self.test_dir, 'invalid.lua'), 'w') as f:
+            f.write('print("unfinished\n')
 
-    def tearDown(self):
-        # Remove the directory after the test
-        shutil.rmtree(self.test_dir)
+        scripts_stats = analyze.get_scripts_stats_in_dir(self.test_dir, jobs=2)
 
-    def test_print_stats(self):
-        cartridge_text = """pico-8 cartridge // http://www.pico-8.com
-version 16
-__lua__
-local a = 5
-"""
-        expected_stats_text = """cartridge.p8
-- version: 16
-- lines: 1
-- chars: 12
-- tokens: 3
-- compressed chars: 12
+        self.assertEqual([script_stats.module for script_stats in scripts_stats], ['engine/helper', 'main'])
 
-"""
+    def test_analyze_scripts_in_dir_text(self):
+        self.assertEqual(self.analyze_scripts_in_dir('text').split("\n\n")[1], "main.lua\n- lines: 1\n- chars: 12\n- tokens: 3\n- compressed bytes: 21")
 
-        cartridge_filepath = path.join(self.test_dir, 'cartridge.p8')
-        stats_filepath = path.join(self.test_dir, 'stats.txt')
+    def test_analyze_scripts_in_dir_json(self):
+        rows = json.loads(self.analyze_scripts_in_dir('json'))
+        self.assertEqual(rows[1], {'module': 'main', 'lines': 1, 'chars': 12, 'tokens': 3, 'compressed_bytes': 21})
 
-        with open(cartridge_filepath, 'w') as c:
-            c.write(cartridge_text)
+    def test_analyze_scripts_in_dir_csv(self):
+        lines = self.analyze_scripts_in_dir('csv').splitlines()
+        self.assertEqual(lines[0], "module,lines,chars,tokens,compressed_bytes")
+        self.assertEqual(lines[2], "main,1,12,3,21")
 
-        with open(stats_filepath, 'w') as s:
-            analyze.print_stats(cartridge_filepath, s)
+    def test_analyze_scripts_in_dir_unknown_format(self):
+        with self.assertRaises(ValueError):
+            self.analyze_scripts_in_dir('xml')
 
-        with open(stats_filepath, 'r') as s:
-            self.assertEqual(s.read(), expected_stats_text)
 
+class TestStatsHistory(unittest.TestCase):
+
+    def setUp(self):
+        # Create a temporary directory
+        self.test_dir = tempfile.mkdtemp()
+        self.db_filepath = path.join(self.test_dir, 'history.db')
+
+    def tearDown(self):
+        # Remove the directory after the test
+        shutil.rmtree(self.test_dir)
 
+    def test_get_current_commit_not_a_checkout(self):
+        with mock.patch(f'{__name__}.analyze.subprocess.check_output',
+                side_effect=analyze.subprocess.CalledProcessError(128, ['git', 'rev-parse', 'HEAD'])):
+            self.assertIsNone(analyze.get_current_commit())
+
+    def test_get_current_commit_git_not_found(self):
+        with mock.patch(f'{__name__}.analyze.subprocess.check_output', side_effect=FileNotFoundError('git')):
+            self.assertIsNone(analyze.get_current_commit())
+
+    def test_get_cartridge_stats(self):
+        cartridge_filepath = path.join(self.test_dir, 'game.p8')
+        with open(cartridge_filepath, 'w') as f:
+            f.write("pico-8 cartridge // http://www.pico-8.com\nversion 27\n__lua__\nlocal a = 5\n__gfx__\n0000\n")
+        self.assertEqual(analyze.get_cartridge_stats(cartridge_filepath), analyze.ScriptStats('game.p8', 1, 12, 3, 21))
+
+    def test_diff_records(self):
+        analyze.record_stats(self.db_filepath, 'aaa111', 'release', [
+            analyze.ScriptStats('a', 1, 10, 5, 20),
+            analyze.ScriptStats('b', 1, 10, 5, 20),
+            analyze.ScriptStats('removed', 1, 10, 5, 20),
+            analyze.ScriptStats('same', 1, 10, 5, 20),
+        ], analyze.ScriptStats('game.p8', 4, 40, 20, 60))
+        analyze.record_stats(self.db_filepath, 'bbb222', 'release', [
+            analyze.ScriptStats('a', 1, 12, 6, 21),
+            analyze.ScriptStats('b', 2, 30, 15, 30),
+            analyze.ScriptStats('added', 1, 12, 6, 25),
+            analyze.ScriptStats('same', 1, 10, 5, 20),
+        ], analyze.ScriptStats('game.p8', 5, 64, 32, 80))
+
+        self.assertEqual(analyze.diff_records(self.db_filepath, 'aaa', 'bbb222'), ([
+            analyze.ModuleStatsDiff('b', 5, 15, 10, 20, 10),
+            analyze.ModuleStatsDiff('added', 0, 6, 6, 12, 25),
+            analyze.ModuleStatsDiff('a', 5, 6, 1, 2, 1),
+            analyze.ModuleStatsDiff('removed', 5, 0, -5, -10, -20),
+        ], analyze.ModuleStatsDiff('cartridge', 20, 32, 12, 24, 20)))
+
+    def test_diff_records_without_cartridge(self):
+        analyze.record_stats(self.db_filepath, 'aaa111', 'release', [analyze.ScriptStats('a', 1, 10, 5, 20)])
+        analyze.record_stats(self.db_filepath, 'bbb222', 'release', [analyze.ScriptStats('a', 1, 10, 5, 20)],
+            analyze.ScriptStats('game.p8', 4, 40, 20, 60))
+        self.assertEqual(analyze.diff_records(self.db_filepath, 'aaa111', 'bbb222'), ([], None))
+
+    def test_record_stats_replaces_previous_record(self):
+        analyze.record_stats(self.db_filepath, 'aaa111', 'release', [analyze.ScriptStats('a', 1, 10, 5, 20)])
+        analyze.record_stats(self.db_filepath, 'aaa111', 'release', [analyze.ScriptStats('b', 1, 10, 5, 20)])
+        analyze.record_stats(self.db_filepath, 'bbb222', 'release', [])
+        self.assertEqual(analyze.diff_records(self.db_filepath, 'aaa111', 'bbb222'),
+            ([analyze.ModuleStatsDiff('b', 5, 0, -5, -10, -20)], None))
+
+    def test_diff_records_separate_configs(self):
+        analyze.record_stats(self.db_filepath, 'aaa111', 'release', [analyze.ScriptStats('a', 1, 10, 5, 20)])
+        analyze.record_stats(self.db_filepath, 'aaa111', 'debug', [analyze.ScriptStats('a', 1, 20, 10, 40)])
+        analyze.record_stats(self.db_filepath, 'bbb222', 'debug', [analyze.ScriptStats('a', 1, 20, 10, 40)])
+        self.assertEqual(analyze.diff_records(self.db_filepath, 'aaa111', 'bbb222', 'debug'), ([], None))
+        with self.assertRaisesRegex(ValueError, "no record"):
+            analyze.diff_records(self.db_filepath, 'aaa111', 'bbb222', 'release')
+
+    def test_diff_records_ambiguous_commit(self):
+        analyze.record_stats(self.db_filepath, 'aaa111', 'release', [])
+        analyze.record_stats(self.db_filepath, 'aaa222', 'release', [])
+        with self.assertRaisesRegex(ValueError, "ambiguous"):
+            analyze.diff_records(self.db_filepath, 'aaa', 'aaa222')
+
+    def test_write_stats_diff_text(self):
+        output_stream = io.StringIO()
+        analyze.write_stats_diff([analyze.ModuleStatsDiff('b', 5, 15, 10, 20, 10)],
+            analyze.ModuleStatsDiff('cartridge', 20, 32, 12, 24, 20), 'text', output_stream)
+        self.assertEqual(output_stream.getvalue(),
+            "   +12 tokens     +24 chars    +20 compressed bytes  cartridge (20 -> 32 tokens)\n"
+            "   +10 tokens     +20 chars    +10 compressed bytes  b (5 -> 15 tokens)\n")
+
+    def test_write_stats_diff_csv(self):
+        output_stream = io.StringIO()
+        analyze.write_stats_diff([analyze.ModuleStatsDiff('b', 5, 15, 10, 20, 10)], None, 'csv', output_stream)
+        self.assertEqual(output_stream.getvalue(),
+            "module,old_tokens,new_tokens,tokens,chars,compressed_bytes\nb,5,15,10,20,10\n")
+
+
+class TestGetCodeStats(unittest.TestCase):
+
+    def test_get_code_stats(self):
+        self.assertEqual(analyze.get_code_stats("local a = 5\nprint(a) -- comment\n"),
+            (2, 32, 6, analyze.pico8_compression.get_compressed_code_size("local a = 5\nprint(a) -- comment\n")))
+
+    def test_get_code_stats_no_final_newline(self):
+        self.assertEqual(analyze.get_code_stats("local a = 5")[:3], (1, 11, 3))
+
+    def test_get_code_stats_empty(self):
+        self.assertEqual(analyze.get_code_stats(""), (0, 0, 0, 8))
 
 
 if __name__ == '__main__':
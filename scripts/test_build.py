@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+import unittest
+from unittest import mock
+from . import build
+from . import cartridge
+
+import logging
+import os
+from os import path
+import shutil, tempfile
+
+
+class TestBuildCartridge(unittest.TestCase):
+
+    def setUp(self):
+        # Create a temporary directory with a game source, an engine source and data cartridges,
+        # and build from there since intermediate files are written relatively to the current working directory
+        self.test_dir = tempfile.mkdtemp()
+        self.original_cwd = os.getcwd()
+        os.chdir(self.test_dir)
+        self.addCleanup(os.chdir, self.original_cwd)
+
+        self.write_file('engine/engine/core/helper.lua',
+            'function help()\n  --#if debug\n  print("debug")\n  --#endif\nend\n\nfunction unused()\n  print("unused")\nend\n')
+        self.write_file('src/main.lua', 'require("engine/core/helper")\n--[[add_require]]\nfunction _init()\n  help()\nend\n')
+        self.write_file('src/itests/itest_a.lua', 'itest_a = true\n')
+        self.write_file('data.p8', 'pico-8 cartridge // http://www.pico-8.com\nversion 27\n__lua__\n\n__gfx__\n0123\n__sfx__\n4567\n')
+        self.write_file('metadata.p8', 'pico-8 cartridge // http://www.pico-8.com\nversion 27\n__lua__\n\n__label__\n89ab\n')
+
+    def tearDown(self):
+        # Remove the directory after the test
+        shutil.rmtree(self.test_dir)
+
+    def write_file(self, relative_filepath, content):
+        os.makedirs(path.dirname(relative_filepath) or '.', exist_ok=True)
+        with open(relative_filepath, 'w') as f:
+            f.write(content)
+
+    def read_lua_code(self, filepath):
+        return ''.join(cartridge.get_section_lines(cartridge.read_sections(filepath), 'lua'))
+
+    def build(self, *args, **kwargs):
+        return build.build_cartridge('src', 'main.lua', *args, engine_src_path='engine', **kwargs)
+
+    def test_build_cartridge(self):
+        output_filepath = self.build(output_path='build', config='debug', symbols=['debug'],
+            data_filepath='data.p8', metadata_filepath='metadata.p8', title='test game', author='tas')
+
+        self.assertEqual(output_filepath, path.join('build', 'game_debug.p8'))
+        sections = cartridge.read_sections(output_filepath)
+        self.assertEqual([name for name, lines in sections], [None, 'lua', 'gfx', 'label', 'sfx'])
+        self.assertEqual(cartridge.get_section_lines(sections, 'label'), ['89ab\n'])
+        self.assertEqual(cartridge.get_section_lines(sections, 'gfx'), ['0123\n'])
+        lua_code = ''.join(cartridge.get_section_lines(sections, 'lua'))
+        self.assertTrue(lua_code.startswith('-- test game\n-- by tas\npackage={loaded={},_c={}}\n'))
+        self.assertIn('print("debug")', lua_code)
+        self.assertIn('function unused()', lua_code)
+        self.assertNotIn('itest_a', lua_code)
+        # intermediate files are preprocessed for the config
+        self.assertTrue(path.isfile(path.join('intermediate', 'debug', 'pico-boots', 'engine', 'core', 'helper.lua')))
+
+    def test_build_cartridge_strips_undefined_symbols(self):
+        output_filepath = self.build()
+        self.assertEqual(output_filepath, path.join('.', 'game.p8'))
+        self.assertNotIn('print("debug")', self.read_lua_code(output_filepath))
+
+    def test_build_cartridge_add_require(self):
+        lua_code = self.read_lua_code(self.build('itests'))
+        self.assertIn('package._c["itests/itest_a"]=function()\nitest_a = true\nend\n', lua_code)
+        self.assertIn('--[[add_require]]\nrequire("itests/itest_a")\n', lua_code)
+
+    def test_build_cartridge_tree_shake(self):
+        self.write_file('keep.txt', 'kept\n')
+        self.write_file('engine/engine/core/helper.lua', 'function help() end\nfunction unused() end\nfunction kept() end\n')
+
+        lua_code = self.read_lua_code(self.build(use_tree_shake=True, tree_shake_keep_filepath='keep.txt'))
+
+        self.assertIn('function help() end', lua_code)
+        self.assertNotIn('function unused()', lua_code)
+        self.assertIn('function kept() end', lua_code)
+        # intermediate files are left untouched
+        with open(path.join('intermediate', 'pico-boots', 'engine', 'core', 'helper.lua'), 'r') as f:
+            self.assertIn('function unused()', f.read())
+
+    def test_build_cartridge_tree_shake_tokenize_error(self):
+        with mock.patch(f'{__name__}.build.tree_shake.tree_shake_sources',
+                side_effect=build.lua_tokenizer.LuaTokenizeError('unfinished string', 0, True)):
+            with self.assertLogs(level='WARNING') as cm:
+                lua_code = self.read_lua_code(self.build(use_tree_shake=True))
+
+        # like build_cartridge.sh, warn and build without removing any function
+        self.assertIn('no function will be removed', cm.output[0])
+        self.assertIn('function unused()', lua_code)
+
+    def test_build_cartridge_minify(self):
+        lua_code = self.read_lua_code(self.build(minify_level=1, minify_engine='python'))
+        self.assertNotIn('function unused()\n  print("unused")\nend', lua_code)
+        self.assertIn('help()', lua_code)
+
+    def test_build_cartridge_minify_compressed_size_exceeded_not_release(self):
+        with mock.patch(f'{__name__}.build.minify.pico8_compression.get_compressed_code_size',
+                return_value=build.pico8_compression.PICO8_MAX_COMPRESSED_CODE_SIZE + 1):
+            output_filepath = self.build(config='debug', minify_level=1, minify_engine='python')
+        self.assertTrue(path.isfile(output_filepath))
+
+    def test_build_cartridge_minify_compressed_size_exceeded_release(self):
+        self.write_file('game_release.p8', 'previous build\n')
+
+        with mock.patch(f'{__name__}.build.minify.pico8_compression.get_compressed_code_size',
+                return_value=build.pico8_compression.PICO8_MAX_COMPRESSED_CODE_SIZE + 1):
+            with self.assertRaises(build.BuildError):
+                self.build(config='release', minify_level=1, minify_engine='python')
+
+        # no cartridge is left at the output path
+        self.assertFalse(path.isfile('game_release.p8'))
+
+    def test_build_cartridge_release_token_count_exceeded(self):
+        self.write_file('src/main.lua', 'x = 1\n' * 3000)
+        self.write_file('game_release.p8', 'previous build\n')
+
+        with self.assertRaises(build.BuildError):
+            self.build(config='release')
+
+        # no cartridge is left at the output path
+        self.assertFalse(path.isfile('game_release.p8'))
+
+    def test_build_cartridge_unresolved_require(self):
+        self.write_file('src/main.lua', 'require("missing")\n')
+        with self.assertRaises(build.BuildError):
+            self.build()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.CRITICAL)
+    unittest.main()
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+import unittest
+from . import bundle
+from . import cartridge
+
+import logging
+import os
+from os import path
+import shutil, tempfile
+
+
+class TestGetBundledCode(unittest.TestCase):
+
+    def test_get_bundled_code(self):
+        self.assertEqual(bundle.get_bundled_code('require("a")\nrequire("b")\n', {'a': 'x = 1\n', 'b': 'return {}\n'}),
+            'package={loaded={},_c={}}\n'
+            'package._c["a"]=function()\nx = 1\nend\n'
+            'package._c["b"]=function()\nreturn {}\nend\n'
+            + bundle.REQUIRE_FUNCTION_CODE +
+            'require("a")\nrequire("b")\n')
+
+    def test_get_bundled_code_no_modules(self):
+        self.assertEqual(bundle.get_bundled_code('print(1)\n', {}), 'print(1)\n')
+
+    def test_get_bundled_code_module_ending_with_comment(self):
+        self.assertIn('package._c["a"]=function()\nx = 1 -- comment\nend\n',
+            bundle.get_bundled_code('require("a")\n', {'a': 'x = 1 -- comment'}))
+
+
+class TestMergeSections(unittest.TestCase):
+
+    def test_merge_sections_default_header(self):
+        self.assertEqual(bundle.merge_sections('print(1)\nprint(2)\n'), [
+            (None, bundle.DEFAULT_CARTRIDGE_HEADER_LINES),
+            ('lua', ['print(1)\n', 'print(2)\n']),
+        ])
+
+    def test_merge_sections_lua_without_final_newline(self):
+        self.assertEqual(bundle.merge_sections('print(1)')[1], ('lua', ['print(1)\n']))
+
+    def test_merge_sections_preserves_existing_sections_in_order(self):
+        existing_sections = [
+            (None, ['pico-8 cartridge // http://www.pico-8.com\n', 'version 16\n']),
+            ('lua', ['old code\n']),
+            ('gfx', ['0000\n']),
+            ('label', ['1111\n']),
+        ]
+        self.assertEqual(bundle.merge_sections('new code\n', existing_sections), [
+            (None, ['pico-8 cartridge // http://www.pico-8.com\n', 'version 16\n']),
+            ('lua', ['new code\n']),
+            ('gfx', ['0000\n']),
+            ('label', ['1111\n']),
+        ])
+
+    def test_merge_sections_data_sections_override_existing(self):
+        existing_sections = [
+            (None, bundle.DEFAULT_CARTRIDGE_HEADER_LINES),
+            ('lua', ['old code\n']),
+            ('gfx', ['0000\n']),
+            ('label', ['1111\n']),
+        ]
+        data_sections = [
+            (None, bundle.DEFAULT_CARTRIDGE_HEADER_LINES),
+            ('lua', ['data code\n']),
+            ('sfx', ['2222\n']),
+            ('gfx', ['3333\n']),
+            ('label', ['4444\n']),
+        ]
+        self.assertEqual(bundle.merge_sections('new code\n', existing_sections, data_sections), [
+            (None, bundle.DEFAULT_CARTRIDGE_HEADER_LINES),
+            ('lua', ['new code\n']),
+            ('gfx', ['3333\n']),
+            ('label', ['1111\n']),
+            ('sfx', ['2222\n']),
+        ])
+
+
+class TestBundleCartridge(unittest.TestCase):
+
+    def setUp(self):
+        # Create a temporary directory with a game root and an engine root
+        self.test_dir = tempfile.mkdtemp()
+        self.game_root = path.join(self.test_dir, 'src')
+        self.engine_root = path.join(self.test_dir, 'pico-boots')
+        self.main_filepath = self.write_module(self.game_root, 'main', 'require("engine/core/helper")\nhelp()\n')
+        self.write_module(self.engine_root, 'engine/core/helper', 'function help() end\n')
+        self.output_filepath = path.join(self.test_dir, 'game.p8')
+
+    def tearDown(self):
+        # Remove the directory after the test
+        shutil.rmtree(self.test_dir)
+
+    def write_module(self, root, module, code):
+        filepath = path.join(root, f"{module}.lua")
+        os.makedirs(path.dirname(filepath), exist_ok=True)
+        with open(filepath, 'w') as f:
+            f.write(code)
+        return filepath
+
+    def test_bundle_cartridge(self):
+        data_filepath = path.join(self.test_dir, 'data.p8')
+        with open(data_filepath, 'w') as f:
+            f.write("pico-8 cartridge // http://www.pico-8.com\nversion 27\n__lua__\n\n__gfx__\n0123\n")
+
+        bundle.bundle_cartridge(self.main_filepath, [self.game_root, self.engine_root], self.output_filepath, data_filepath)
+
+        sections = cartridge.read_sections(self.output_filepath)
+        self.assertEqual(''.join(cartridge.get_section_lines(sections, 'lua')),
+            bundle.get_bundled_code('require("engine/core/helper")\nhelp()\n', {'engine/core/helper': 'function help() end\n'}))
+        self.assertEqual(cartridge.get_section_lines(sections, 'gfx'), ['0123\n'])
+
+    def test_bundle_cartridge_unresolved_require(self):
+        self.write_module(self.game_root, 'main', 'require("missing")\n')
+        with self.assertRaises(bundle.BundleError):
+            bundle.bundle_cartridge(self.main_filepath, [self.game_root, self.engine_root], self.output_filepath)
+        self.assertFalse(path.isfile(self.output_filepath))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.CRITICAL)
+    unittest.main()
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+import unittest
+from . import cartridge
+
+import io
+import logging
+from os import path
+import shutil, tempfile
+
+
+cartridge_content = """pico-8 cartridge // http://www.pico-8.com
+version 27
+__lua__
+local a = 5
+local s = [[
+__text__
+]]
+__gfx__
+eeeeeeeee5eeeeeeeeee
+__label__
+55222222222222222222
+__meta:title__
+my game
+"""
+
+
+class TestSplitSections(unittest.TestCase):
+
+    def test_split_sections(self):
+        self.assertEqual(cartridge.split_sections(io.StringIO(cartridge_content)), [
+            (None, ['pico-8 cartridge // http://www.pico-8.com\n', 'version 27\n']),
+            ('lua', ['local a = 5\n', 'local s = [[\n', '__text__\n', ']]\n']),
+            ('gfx', ['eeeeeeeee5eeeeeeeeee\n']),
+            ('label', ['55222222222222222222\n']),
+            ('meta:title', ['my game\n']),
+        ])
+
+    def test_split_sections_header_only(self):
+        self.assertEqual(cartridge.split_sections(['pico-8 cartridge // http://www.pico-8.com\n']),
+            [(None, ['pico-8 cartridge // http://www.pico-8.com\n'])])
+
+
+class TestGetSectionLines(unittest.TestCase):
+
+    def test_get_section_lines(self):
+        sections = cartridge.split_sections(io.StringIO(cartridge_content))
+        self.assertEqual(cartridge.get_section_lines(sections, 'gfx'), ['eeeeeeeee5eeeeeeeeee\n'])
+
+    def test_get_section_lines_missing(self):
+        sections = cartridge.split_sections(io.StringIO(cartridge_content))
+        self.assertIsNone(cartridge.get_section_lines(sections, 'sfx'))
+
+
+class TestReplaceSectionLines(unittest.TestCase):
+
+    def test_replace_section_lines(self):
+        sections = cartridge.split_sections(io.StringIO(cartridge_content))
+        new_sections = cartridge.replace_section_lines(sections, 'lua', ['print(1)\n'])
+        self.assertEqual(cartridge.get_section_lines(new_sections, 'lua'), ['print(1)\n'])
+        # original sections are not modified
+        self.assertEqual(cartridge.get_section_lines(sections, 'lua')[0], 'local a = 5\n')
+
+    def test_replace_section_lines_missing(self):
+        sections = cartridge.split_sections(io.StringIO(cartridge_content))
+        with self.assertRaises(ValueError):
+            cartridge.replace_section_lines(sections, 'sfx', [])
+
+
+class TestReadWriteSections(unittest.TestCase):
+
+    def setUp(self):
+        # Create a temporary directory
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        # Remove the directory after the test
+        shutil.rmtree(self.test_dir)
+
+    def test_read_write_sections_round_trip(self):
+        cartridge_filepath = path.join(self.test_dir, 'cartridge.p8')
+        with open(cartridge_filepath, 'w') as f:
+            f.write(cartridge_content)
+
+        sections = cartridge.read_sections(cartridge_filepath)
+
+        output = io.StringIO()
+        cartridge.write_sections(output, sections)
+        self.assertEqual(output.getvalue(), cartridge_content)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.CRITICAL)
+    unittest.main()
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+import unittest
+from . import lua_minifier
+from .lua_tokenizer import Token, TokenType
+
+
+class TestMinifyLua(unittest.TestCase):
+
+    def test_minify_lua_strips_comments_and_whitespace(self):
+        self.assertEqual(lua_minifier.minify_lua('--[[ header ]]\nprint( "hi" )  -- comment\n'), 'print("hi")\n')
+
+    def test_minify_lua_renames_locals(self):
+        self.assertEqual(lua_minifier.minify_lua('local my_var = 1\nprint(my_var)'), 'local a=1\nprint(a)\n')
+
+    def test_minify_lua_renames_params_and_loop_variables(self):
+        self.assertEqual(lua_minifier.minify_lua('function f(x, y) for i = x, y do print(i) end end'),
+            'function f(a,b)for c=a,b do print(c)end end\n')
+
+    def test_minify_lua_same_name_same_short_name(self):
+        self.assertEqual(lua_minifier.minify_lua('function f(x) return x end\nfunction g(x) return x end'),
+            'function f(a)return a end\nfunction g(a)return a end\n')
+
+    def test_minify_lua_local_initialized_with_global_of_same_name(self):
+        # right side is evaluated before the local is declared
+        self.assertEqual(lua_minifier.minify_lua('local print = print\nprint(1)'), 'local a=print\na(1)\n')
+
+    def test_minify_lua_short_names_avoid_globals(self):
+        self.assertEqual(lua_minifier.minify_lua('local x = a + b'), 'local c=a+b\n')
+
+    def test_minify_lua_preserves_self(self):
+        self.assertEqual(lua_minifier.minify_lua('function obj:f(value) self.value = value end'),
+            'function obj:f(a)self.value=a end\n')
+
+    def test_minify_lua_repeat_until_sees_block_locals(self):
+        self.assertEqual(lua_minifier.minify_lua('repeat local done = f() until done'),
+            'repeat local a=f()until a\n')
+
+    def test_minify_lua_local_function_is_recursive(self):
+        self.assertEqual(lua_minifier.minify_lua('local function fact(n) return n * fact(n - 1) end'),
+            'local function a(b)return b*a(b-1)end\n')
+
+    def test_minify_lua_separates_inner_statements_only_when_required(self):
+        self.assertEqual(lua_minifier.minify_lua('do\n  x = 2\n  y = "a"\n  z = 3\nend'),
+            'do x=2\ny="a"z=3 end\n')
+
+    def test_minify_lua_no_separator_between_statements_when_not_required(self):
+        self.assertEqual(lua_minifier.minify_lua('x = {}\ny = "a"'), 'x={}y="a"\n')
+
+    def test_minify_lua_statement_starting_with_bracket(self):
+        self.assertEqual(lua_minifier.minify_lua('do f() ; (g or h)() end'), 'do f();(g or h)()end\n')
+
+    def test_minify_lua_tokens_that_would_merge(self):
+        self.assertEqual(lua_minifier.minify_lua('x = 1 - -2 .. 3 .. a[ [[s]] ]'), 'x=1- -2 ..3 ..a[ [[s]]]\n')
+
+    def test_minify_lua_table_constructor_separators(self):
+        self.assertEqual(lua_minifier.minify_lua('t = {1; 2, x = 3,}'), 't={1,2,x=3}\n')
+
+    def test_minify_lua_pico8_compound_assignment(self):
+        self.assertEqual(lua_minifier.minify_lua('local count = 0\ncount += 1'), 'local a=0\na+=1\n')
+
+    def test_minify_lua_keeps_labels(self):
+        self.assertEqual(lua_minifier.minify_lua('::continue::\ngoto continue'), '::continue::goto continue\n')
+
+    def test_minify_lua_member_names_preserved_by_default(self):
+        self.assertEqual(lua_minifier.minify_lua('local t = {key = 1}\nt.key = t:get()'),
+            'local a={key=1}a.key=a:get()\n')
+
+    def test_minify_lua_minify_member_names(self):
+        self.assertEqual(lua_minifier.minify_lua('local t = {key = 1, _kept = 2, ["str"] = 3}\nt.key = t:get()',
+            minify_member_names=True), 'local a={b=1,_kept=2,["str"]=3}a.b=a:c()\n')
+
+    def test_minify_lua_syntax_error(self):
+        with self.assertRaises(lua_minifier.LuaMinifyError) as cm:
+            lua_minifier.minify_lua('local a = }{')
+        self.assertEqual(cm.exception.position, 10)
+
+    def test_minify_lua_statement_without_call_error(self):
+        with self.assertRaises(lua_minifier.LuaMinifyError):
+            lua_minifier.minify_lua('x')
+
+    def test_minify_lua_unfinished_string_error(self):
+        with self.assertRaises(lua_minifier.LuaMinifyError) as cm:
+            lua_minifier.minify_lua('x = "abc')
+        self.assertEqual(cm.exception.position, 4)
+
+
+class TestGenerateIdentifiers(unittest.TestCase):
+
+    def test_generate_identifiers(self):
+        identifiers = lua_minifier.generate_identifiers()
+        first_identifiers = [next(identifiers) for _ in range(54)]
+        self.assertEqual(first_identifiers[:3], ['a', 'b', 'c'])
+        self.assertEqual(first_identifiers[51:], ['Z', 'aa', 'ab'])
+
+
+class TestIsSeparatorRequired(unittest.TestCase):
+
+    def is_separator_required(self, previous_token_type, previous_text, token_type, text):
+        return lua_minifier.is_separator_required(Token(previous_token_type, previous_text, 0), previous_text,
+            Token(token_type, text, 0), text)
+
+    def test_is_separator_required_words(self):
+        self.assertTrue(self.is_separator_required(TokenType.NUMBER, '2', TokenType.NAME, 'a'))
+
+    def test_is_separator_required_name_and_operator(self):
+        self.assertFalse(self.is_separator_required(TokenType.NAME, 'a', TokenType.OPERATOR, '='))
+
+    def test_is_separator_required_number_and_dot(self):
+        self.assertTrue(self.is_separator_required(TokenType.NUMBER, '1', TokenType.OPERATOR, '..'))
+
+    def test_is_separator_required_operators_merging(self):
+        self.assertTrue(self.is_separator_required(TokenType.OPERATOR, '<', TokenType.OPERATOR, '='))
+
+    def test_is_separator_required_operators_not_merging(self):
+        self.assertFalse(self.is_separator_required(TokenType.OPERATOR, '=', TokenType.OPERATOR, '-'))
+
+
+if __name__ == '__main__':
+    unittest.main()
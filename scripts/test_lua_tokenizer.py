@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+import unittest
+from . import lua_tokenizer
+from .lua_tokenizer import Token, TokenType
+
+
+class TestTokenize(unittest.TestCase):
+
+    def test_tokenize_simple_statement(self):
+        self.assertEqual(list(lua_tokenizer.tokenize('x = "a" -- b')), [
+            Token(TokenType.NAME, 'x', 0),
+            Token(TokenType.WHITESPACE, ' ', 1),
+            Token(TokenType.OPERATOR, '=', 2),
+            Token(TokenType.WHITESPACE, ' ', 3),
+            Token(TokenType.STRING, '"a"', 4),
+            Token(TokenType.WHITESPACE, ' ', 7),
+            Token(TokenType.COMMENT, '-- b', 8),
+        ])
+
+    def test_tokenize_keywords_and_names(self):
+        self.assertEqual([(token.token_type, token.text) for token in lua_tokenizer.tokenize('local function_name')], [
+            (TokenType.KEYWORD, 'local'),
+            (TokenType.WHITESPACE, ' '),
+            (TokenType.NAME, 'function_name'),
+        ])
+
+    def test_tokenize_numbers(self):
+        self.assertEqual([token.text for token in lua_tokenizer.tokenize('0x1f.8 0b101 .5 3e-2')
+            if token.token_type is TokenType.NUMBER], ['0x1f.8', '0b101', '.5', '3e-2'])
+
+    def test_tokenize_pico8_operators(self):
+        self.assertEqual([token.text for token in lua_tokenizer.tokenize('a!=b a+=1 a\\b a^^b a>>>=1')
+            if token.token_type is TokenType.OPERATOR], ['!=', '+=', '\\', '^^', '>>>='])
+
+    def test_tokenize_short_comment_stops_before_newline(self):
+        self.assertEqual([(token.token_type, token.text) for token in lua_tokenizer.tokenize('-- comment\nx')], [
+            (TokenType.COMMENT, '-- comment'),
+            (TokenType.WHITESPACE, '\n'),
+            (TokenType.NAME, 'x'),
+        ])
+
+    def test_tokenize_long_comment(self):
+        self.assertEqual([(token.token_type, token.text) for token in lua_tokenizer.tokenize('--[==[ a ]] \n]==]x')], [
+            (TokenType.COMMENT, '--[==[ a ]] \n]==]'),
+            (TokenType.NAME, 'x'),
+        ])
+
+    def test_tokenize_long_string(self):
+        self.assertEqual([(token.token_type, token.text) for token in lua_tokenizer.tokenize('[[a\n"b"]]')], [
+            (TokenType.STRING, '[[a\n"b"]]'),
+        ])
+
+    def test_tokenize_string_with_escaped_quote(self):
+        self.assertEqual([(token.token_type, token.text) for token in lua_tokenizer.tokenize("'a\\'b'")], [
+            (TokenType.STRING, "'a\\'b'"),
+        ])
+
+    def test_tokenize_unknown_character(self):
+        self.assertEqual([(token.token_type, token.text) for token in lua_tokenizer.tokenize('print("🐱")`')][-1],
+            (TokenType.UNKNOWN, '`'))
+
+    def test_tokenize_lossless(self):
+        source = 'function f(a, ...)\n  --[[ long ]] return a..[=[b]=] -- c\nend\n'
+        self.assertEqual("".join(token.text for token in lua_tokenizer.tokenize(source)), source)
+
+    def test_tokenize_unfinished_string_at_end(self):
+        with self.assertRaises(lua_tokenizer.LuaTokenizeError) as cm:
+            list(lua_tokenizer.tokenize('x = "abc'))
+        self.assertTrue(cm.exception.is_unfinished)
+        self.assertEqual(cm.exception.position, 4)
+
+    def test_tokenize_string_interrupted_by_newline(self):
+        with self.assertRaises(lua_tokenizer.LuaTokenizeError) as cm:
+            list(lua_tokenizer.tokenize('x = "abc\n"'))
+        self.assertFalse(cm.exception.is_unfinished)
+
+    def test_tokenize_unfinished_long_comment(self):
+        with self.assertRaises(lua_tokenizer.LuaTokenizeError) as cm:
+            list(lua_tokenizer.tokenize('--[[ abc\n'))
+        self.assertTrue(cm.exception.is_unfinished)
+
+
+class TestFindShortStringEnd(unittest.TestCase):
+
+    def test_find_short_string_end(self):
+        self.assertEqual(lua_tokenizer.find_short_string_end('x("a)b", 1)', 2), 7)
+
+    def test_find_short_string_end_escaped_newline(self):
+        self.assertEqual(lua_tokenizer.find_short_string_end('"a\\\nb" ', 0), 6)
+
+
+class TestIsBlankToken(unittest.TestCase):
+
+    def test_is_blank_token_whitespace(self):
+        self.assertTrue(lua_tokenizer.is_blank_token(Token(TokenType.WHITESPACE, ' ', 0)))
+
+    def test_is_blank_token_comment(self):
+        self.assertTrue(lua_tokenizer.is_blank_token(Token(TokenType.COMMENT, '-- a', 0)))
+
+    def test_is_blank_token_name(self):
+        self.assertFalse(lua_tokenizer.is_blank_token(Token(TokenType.NAME, 'a', 0)))
+
+
+if __name__ == '__main__':
+    unittest.main()
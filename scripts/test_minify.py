@@ -1,9 +1,72 @@
 import unittest
+from unittest import mock
 from . import minify
 
 import logging
+import os
 from os import path
 import shutil, tempfile
+import threading
+
+
+# Fake luamin command-line script, to test the luamin worker without luamin installed
+fake_luamin_script = """#!/usr/bin/env node
+var fs = require('fs');
+var args = process.argv.slice(2);
+var code = fs.readFileSync(args[1], 'utf8');
+if (code.indexOf('}{') >= 0) {
+  console.error('[1:10] unexpected symbol');
+  process.exit(1);
+}
+console.log(args[0] + ' ' + code.trim());
+"""
+
+
+minify_test_clean_lua_code = """local my_table =
+{
+    key1 = 1,
+    key2 = "hello",
+    _preserved = {},
+    ["preserved"] = true
+}
+if true then
+  my_table.key1 = 2
+  my_table.key2 = "world"
+  my_table._preserved.key1 = 4
+  my_table["preserved"] = False
+end
+
+"""
+
+# we use newlines instead of ';' but no aggressive minification
+minify_test_expected_minified_lua_code = """local a={key1=1,key2="hello",_preserved={},["preserved"]=true}\
+if true then a.key1=2
+a.key2="world"a._preserved.key1=4
+a["preserved"]=False end
+"""
+
+minify_test_aggressive_clean_lua_code = """local my_table =
+{
+    key1 = 1,
+    key2 = "hello",
+    _preserved = {},
+    ["preserved"] = true
+}
+if true then
+  my_table.key1 = 2
+  my_table.key2 = "world"
+  my_table._preserved.key1 = 4  -- key with same name should be minified the same
+  my_table["preserved"] = False
+end
+
+"""
+
+# we use newlines instead of ';' and minify member names and table key strings
+minify_test_expected_aggressive_minified_lua_code = """local a={b=1,c="hello",_preserved={},["preserved"]=true}\
+if true then a.b=2
+a.c="world"a._preserved.b=4
+a["preserved"]=False end
+"""
 
 
 class TestMinify(unittest.TestCase):
@@ -17,7 +80,6 @@ class TestMinify(unittest.TestCase):
         shutil.rmtree(self.test_dir)
 
     def test_extract_lua(self):
-        # We actually test p8tool listrawlua
         cartridge_content = """pico-8 cartridge // http://www.pico-8.com
 version 27
 __lua__
@@ -40,12 +102,10 @@ __music__
 
 """
 
-        # p8tool adds an extra line after each line, but we ignore them in extract_lua already
         expected_extracted_code = """local a = 5
 local s = [[
 text
 ]]
-
 """
         cartridge_filepath = path.join(self.test_dir, 'cartridge.p8')
         extracted_code_filepath = path.join(self.test_dir, 'extracted_code.lua')
@@ -59,7 +119,7 @@ text
             self.assertEqual(extracted_code_file.read(), expected_extracted_code)
 
     def test_extract_lua_error(self):
-        # We actually test p8tool listrawlua
+        # no __lua__ section
         cartridge_content = """pico-8 cartridge // http://www.pico-8.com
 version 27
 __gfx__
@@ -83,7 +143,7 @@ __music__
             l.write(cartridge_content)
 
         with open(extracted_code_filepath, 'w') as extracted_code_file:
-            with self.assertRaises(SystemExit):
+            with self.assertRaises(minify.MinifyError):
                 minify.extract_lua(cartridge_filepath, extracted_code_file)
 
     def test_clean_lua(self):
@@ -116,88 +176,43 @@ if l[p]==nil then l[p]=true end
             self.assertEqual(cl.read(), expected_clean_lua_code)
 
     # in test_minify_lua_*, we are mostly testing luamin itself, with various parameters
+    # the python engine must produce the same output
 
-    def test_minify_lua_not_aggressive(self):
-        clean_lua_code = """local my_table =
-{
-    key1 = 1,
-    key2 = "hello",
-    _preserved = {},
-    ["preserved"] = true
-}
-if true then
-  my_table.key1 = 2
-  my_table.key2 = "world"
-  my_table._preserved.key1 = 4
-  my_table["preserved"] = False
-end
-
-"""
-
-        # we use newlines instead of ';' but no aggressive minification
-        expected_minified_lua_code = """local a={key1=1,key2="hello",_preserved={},["preserved"]=true}\
-if true then a.key1=2
-a.key2="world"a._preserved.key1=4
-a["preserved"]=False end
-"""
-
+    def minify_lua_code(self, clean_lua_code, use_aggressive_minification, engine=minify.DEFAULT_MINIFY_ENGINE):
         clean_lua_filepath = path.join(self.test_dir, 'clean_lua.p8')
         min_lua_filepath = path.join(self.test_dir, 'lua.p8')
         with open(clean_lua_filepath, 'w') as cl:
             cl.write(clean_lua_code)
 
         with open(min_lua_filepath, 'w') as ml:
-            minify.minify_lua(clean_lua_filepath, ml, use_aggressive_minification=False)
+            minify.minify_lua(clean_lua_filepath, ml, use_aggressive_minification=use_aggressive_minification, engine=engine)
 
         with open(min_lua_filepath, 'r') as ml:
-            self.assertEqual(ml.read(), expected_minified_lua_code)
+            return ml.read()
 
-    def test_minify_lua_aggressive(self):
-        clean_lua_code = """local my_table =
-{
-    key1 = 1,
-    key2 = "hello",
-    _preserved = {},
-    ["preserved"] = true
-}
-if true then
-  my_table.key1 = 2
-  my_table.key2 = "world"
-  my_table._preserved.key1 = 4  -- key with same name should be minified the same
-  my_table["preserved"] = False
-end
+    def test_minify_lua_not_aggressive(self):
+        self.assertEqual(self.minify_lua_code(minify_test_clean_lua_code, False),
+            minify_test_expected_minified_lua_code)
 
-"""
+    def test_minify_lua_not_aggressive_python_engine(self):
+        self.assertEqual(self.minify_lua_code(minify_test_clean_lua_code, False, engine='python'),
+            minify_test_expected_minified_lua_code)
 
-        # we use newlines instead of ';' and minify member names and table key strings
-        expected_minified_lua_code = """local a={b=1,c="hello",_preserved={},["preserved"]=true}\
-if true then a.b=2
-a.c="world"a._preserved.b=4
-a["preserved"]=False end
-"""
-
-        clean_lua_filepath = path.join(self.test_dir, 'clean_lua.p8')
-        min_lua_filepath = path.join(self.test_dir, 'lua.p8')
-        with open(clean_lua_filepath, 'w') as cl:
-            cl.write(clean_lua_code)
-
-        with open(min_lua_filepath, 'w') as ml:
-            minify.minify_lua(clean_lua_filepath, ml, use_aggressive_minification=True)
+    def test_minify_lua_aggressive(self):
+        self.assertEqual(self.minify_lua_code(minify_test_aggressive_clean_lua_code, True),
+            minify_test_expected_aggressive_minified_lua_code)
 
-        with open(min_lua_filepath, 'r') as ml:
-            self.assertEqual(ml.read(), expected_minified_lua_code)
+    def test_minify_lua_aggressive_python_engine(self):
+        self.assertEqual(self.minify_lua_code(minify_test_aggressive_clean_lua_code, True, engine='python'),
+            minify_test_expected_aggressive_minified_lua_code)
 
     def test_minify_lua_invalid_source(self):
-        invalid_lua_code = """local a = }{"""
-
-        invalid_lua_filepath = path.join(self.test_dir, 'invalid_lua.p8')
-        min_lua_filepath = path.join(self.test_dir, 'lua.p8')
-        with open(invalid_lua_filepath, 'w') as cl:
-            cl.write(invalid_lua_code)
+        with self.assertRaises(minify.MinifyError):
+            self.minify_lua_code("""local a = }{""", False)
 
-        with open(min_lua_filepath, 'w') as ml:
-            with self.assertRaises(SystemExit):
-                minify.minify_lua(invalid_lua_filepath, ml, use_aggressive_minification=False)
+    def test_minify_lua_invalid_source_python_engine(self):
+        with self.assertRaises(minify.MinifyError):
+            self.minify_lua_code("""local a = }{""", False, engine='python')
 
     def test_inject_minified_lua_in_p8(self):
         source_text = """pico-8 cartridge // http://www.pico-8.com
@@ -258,6 +273,333 @@ __music__
         with open(target_filepath, 'r') as t:
             self.assertEqual(t.read(), expected_target_text)
 
+    def test_inject_minified_lua_in_p8_without_gfx(self):
+        source_text = """pico-8 cartridge // http://www.pico-8.com
+version 27
+__lua__
+local long_name = 5
+__sfx__
+010c00002d340293402d
+"""
+
+        min_lua_code = """local a=5
+"""
+
+        expected_target_text = """pico-8 cartridge // http://www.pico-8.com
+version 27
+__lua__
+local a=5
+__sfx__
+010c00002d340293402d
+"""
+
+        source_filepath = path.join(self.test_dir, 'source.p8')
+        target_filepath = path.join(self.test_dir, 'target.p8')
+        min_lua_filepath = path.join(self.test_dir, 'min_lua.lua')
+        with open(source_filepath, 'w') as s:
+            s.write(source_text)
+        with open(min_lua_filepath, 'w') as l:
+            l.write(min_lua_code)
+
+        with open(source_filepath, 'r') as s, open(target_filepath, 'w') as t, open(min_lua_filepath, 'r') as l:
+            minify.inject_minified_lua_in_p8(s, t, l)
+
+        with open(target_filepath, 'r') as t:
+            self.assertEqual(t.read(), expected_target_text)
+
+    def test_minify_lua_in_p8_python_engine(self):
+        cartridge_content = """pico-8 cartridge // http://www.pico-8.com
+version 27
+__lua__
+local long_name = 5 -- comment
+if (long_name) print(long_name)
+__gfx__
+eeeeeeeee5eeeeeeeeee
+"""
+
+        expected_cartridge_content = """pico-8 cartridge // http://www.pico-8.com
+version 27
+__lua__
+local a=5
+if a then print(a)end
+__gfx__
+eeeeeeeee5eeeeeeeeee
+"""
+
+        cartridge_filepath = path.join(self.test_dir, 'cartridge.p8')
+        with open(cartridge_filepath, 'w') as f:
+            f.write(cartridge_content)
+
+        minify.minify_lua_in_p8(cartridge_filepath, False, engine='python')
+
+        with open(cartridge_filepath, 'r') as f:
+            self.assertEqual(f.read(), expected_cartridge_content)
+        # no intermediate files left
+        self.assertEqual(os.listdir(self.test_dir), ['cartridge.p8'])
+
+    def test_minify_lua_in_p8_invalid_source_leaves_cartridge_untouched(self):
+        cartridge_content = """pico-8 cartridge // http://www.pico-8.com
+version 27
+__lua__
+local a = }{
+__gfx__
+eeeeeeeee5eeeeeeeeee
+"""
+
+        cartridge_filepath = path.join(self.test_dir, 'cartridge.p8')
+        with open(cartridge_filepath, 'w') as f:
+            f.write(cartridge_content)
+
+        with self.assertRaises(minify.MinifyError):
+            minify.minify_lua_in_p8(cartridge_filepath, False, engine='python')
+
+        with open(cartridge_filepath, 'r') as f:
+            self.assertEqual(f.read(), cartridge_content)
+        self.assertEqual(os.listdir(self.test_dir), ['cartridge.p8'])
+
+    def test_minify_lua_in_p8_exceeds_max_compressed_size(self):
+        cartridge_content = """pico-8 cartridge // http://www.pico-8.com
+version 27
+__lua__
+print("hello")
+"""
+
+        cartridge_filepath = path.join(self.test_dir, 'cartridge.p8')
+        with open(cartridge_filepath, 'w') as f:
+            f.write(cartridge_content)
+
+        with self.assertRaises(minify.MinifyError):
+            minify.minify_lua_in_p8(cartridge_filepath, False, engine='python', max_compressed_size=10)
+
+        with open(cartridge_filepath, 'r') as f:
+            self.assertEqual(f.read(), cartridge_content)
+
+
+    def test_minify_lua_in_p8_exceeds_pico8_compressed_size_warning_only(self):
+        cartridge_filepath = path.join(self.test_dir, 'cartridge.p8')
+        with open(cartridge_filepath, 'w') as f:
+            f.write("pico-8 cartridge // http://www.pico-8.com\nversion 27\n__lua__\nprint(\"hello\")\n")
+
+        with mock.patch(f'{__name__}.minify.pico8_compression.get_compressed_code_size',
+                return_value=minify.pico8_compression.PICO8_MAX_COMPRESSED_CODE_SIZE + 1), \
+                self.assertLogs(level='WARNING') as cm:
+            minify.minify_lua_in_p8(cartridge_filepath, False, engine='python')
+
+        self.assertIn('Maximum compressed size', cm.output[0])
+        with open(cartridge_filepath, 'r') as f:
+            self.assertIn('print("hello")', f.read())
+
+class TestMinifyCache(unittest.TestCase):
+
+    def setUp(self):
+        # Create a temporary directory
+        self.test_dir = tempfile.mkdtemp()
+        self.cache_dirpath = path.join(self.test_dir, 'cache')
+        self.clean_lua_filepath = path.join(self.test_dir, 'clean_lua.lua')
+        self.min_lua_filepath = path.join(self.test_dir, 'min_lua.lua')
+
+    def tearDown(self):
+        # Remove the directory after the test
+        shutil.rmtree(self.test_dir)
+
+    def minify_with_cache(self, clean_lua_code, use_aggressive_minification=False, cache_max_size=minify.DEFAULT_MINIFY_CACHE_MAX_SIZE):
+        with open(self.clean_lua_filepath, 'w') as cl:
+            cl.write(clean_lua_code)
+        with open(self.min_lua_filepath, 'w') as ml:
+            minify.minify_lua(self.clean_lua_filepath, ml, use_aggressive_minification,
+                cache_dirpath=self.cache_dirpath, cache_max_size=cache_max_size)
+        with open(self.min_lua_filepath, 'r') as ml:
+            return ml.read()
+
+    @mock.patch(f"{__name__}.minify.get_luamin_version", return_value="1.0.0")
+    def test_minify_lua_miss_then_hit(self, _get_luamin_version_mock):
+        with mock.patch(f"{__name__}.minify.run_luamin", return_value="local a=5\n") as run_luamin_mock:
+            self.assertEqual(self.minify_with_cache('local long_name = 5\n'), "local a=5\n")
+            run_luamin_mock.assert_called_once()
+
+        # second time, minified code should be served from cache without running luamin
+        with mock.patch(f"{__name__}.minify.run_luamin") as run_luamin_mock:
+            self.assertEqual(self.minify_with_cache('local long_name = 5\n'), "local a=5\n")
+            run_luamin_mock.assert_not_called()
+
+    @mock.patch(f"{__name__}.minify.get_luamin_version", return_value="1.0.0")
+    def test_minify_lua_miss_on_other_options(self, _get_luamin_version_mock):
+        with mock.patch(f"{__name__}.minify.run_luamin", return_value="local a=5\n"):
+            self.minify_with_cache('local long_name = 5\n', use_aggressive_minification=False)
+
+        with mock.patch(f"{__name__}.minify.run_luamin", return_value="local a=5\n") as run_luamin_mock:
+            self.minify_with_cache('local long_name = 5\n', use_aggressive_minification=True)
+            run_luamin_mock.assert_called_once_with("-fnmk", 'local long_name = 5\n', True)
+
+    def test_minify_lua_python_engine_cache_key_differs_from_luamin(self):
+        with mock.patch(f"{__name__}.minify.get_luamin_version", return_value="1.0.0"), \
+             mock.patch(f"{__name__}.minify.run_luamin", return_value="local a=5\n"):
+            self.minify_with_cache('local long_name = 5\n')
+
+        # the luamin entry must not be reused by the python engine
+        with open(self.clean_lua_filepath, 'w') as cl:
+            cl.write('local long_name = 5\n')
+        with open(self.min_lua_filepath, 'w') as ml:
+            minify.minify_lua(self.clean_lua_filepath, ml, cache_dirpath=self.cache_dirpath, engine='python')
+        self.assertEqual(len(os.listdir(self.cache_dirpath)), 2)
+
+    @mock.patch(f"{__name__}.minify.get_luamin_version", return_value=None)
+    def test_minify_lua_no_cache_without_luamin_version(self, _get_luamin_version_mock):
+        with mock.patch(f"{__name__}.minify.run_luamin", return_value="local a=5\n"):
+            self.minify_with_cache('local long_name = 5\n')
+        self.assertFalse(path.exists(self.cache_dirpath))
+
+    @mock.patch(f"{__name__}.minify.get_luamin_version", return_value="1.0.0")
+    def test_minify_lua_evicts_entries_beyond_max_size(self, _get_luamin_version_mock):
+        with mock.patch(f"{__name__}.minify.run_luamin", return_value="local a=5\n"):
+            self.minify_with_cache('local long_name = 5\n', cache_max_size=10)
+            self.minify_with_cache('local long_name = 6\n', cache_max_size=10)
+        self.assertEqual(len(os.listdir(self.cache_dirpath)), 1)
+
+    def test_compute_minify_cache_key_depends_on_code_options_and_version(self):
+        key = minify.compute_minify_cache_key('local a = 5\n', '-fn', '1.0.0')
+        self.assertNotEqual(minify.compute_minify_cache_key('local a = 6\n', '-fn', '1.0.0'), key)
+        self.assertNotEqual(minify.compute_minify_cache_key('local a = 5\n', '-fnmk', '1.0.0'), key)
+        self.assertNotEqual(minify.compute_minify_cache_key('local a = 5\n', '-fn', '1.0.1'), key)
+
+    def test_evict_minify_cache_entries_least_recently_used(self):
+        os.makedirs(self.cache_dirpath)
+        for i, name in enumerate(['old', 'recent', 'newest']):
+            entry_path = path.join(self.cache_dirpath, name + minify.MINIFY_CACHE_ENTRY_EXTENSION)
+            with open(entry_path, 'w') as f:
+                f.write('12345')
+            os.utime(entry_path, (1000 + i, 1000 + i))
+        # reading marks entry as recently used
+        self.assertEqual(minify.read_minify_cache_entry(self.cache_dirpath, 'old'), '12345')
+
+        self.assertEqual(minify.evict_minify_cache_entries(self.cache_dirpath, 10), 1)
+        self.assertEqual(sorted(os.listdir(self.cache_dirpath)),
+            ['newest' + minify.MINIFY_CACHE_ENTRY_EXTENSION, 'old' + minify.MINIFY_CACHE_ENTRY_EXTENSION])
+
+    def test_get_luamin_version(self):
+        luamin_package_path = path.join(self.test_dir, 'package.json')
+        with open(luamin_package_path, 'w') as f:
+            f.write('{"name": "luamin", "version": "1.0.4", "_resolved": "github:hsandt/luamin#84b33c4"}')
+        self.assertEqual(minify.get_luamin_version(luamin_package_path), "1.0.4 github:hsandt/luamin#84b33c4")
+
+    def test_get_luamin_version_not_installed(self):
+        self.assertIsNone(minify.get_luamin_version(path.join(self.test_dir, 'missing.json')))
+
+
+class TestLuaminWorkerSocketPath(unittest.TestCase):
+
+    def setUp(self):
+        # Create a temporary directory
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        # Remove the directory after the test
+        shutil.rmtree(self.test_dir)
+
+    def test_get_luamin_worker_socket_path_in_runtime_dir(self):
+        with mock.patch.dict(os.environ, {'XDG_RUNTIME_DIR': self.test_dir}):
+            socket_path = minify.get_luamin_worker_socket_path('luamin')
+        self.assertEqual(path.dirname(socket_path), path.join(self.test_dir, 'pico-boots'))
+        self.assertEqual(os.stat(path.dirname(socket_path)).st_mode & 0o777, 0o700)
+
+    def test_get_luamin_worker_socket_path_in_temp_dir(self):
+        with mock.patch.dict(os.environ, {'XDG_RUNTIME_DIR': ''}), \
+                mock.patch(f'{__name__}.minify.tempfile.gettempdir', return_value=self.test_dir):
+            socket_path = minify.get_luamin_worker_socket_path('luamin')
+        self.assertEqual(path.dirname(socket_path), path.join(self.test_dir, f'pico-boots-{os.getuid()}'))
+        self.assertEqual(os.stat(path.dirname(socket_path)).st_mode & 0o777, 0o700)
+
+    def test_get_luamin_worker_socket_path_refuse_shared_dir(self):
+        os.mkdir(path.join(self.test_dir, 'pico-boots'), 0o777)
+        os.chmod(path.join(self.test_dir, 'pico-boots'), 0o777)
+        with mock.patch.dict(os.environ, {'XDG_RUNTIME_DIR': self.test_dir}):
+            self.assertIsNone(minify.get_luamin_worker_socket_path('luamin'))
+
+    def test_get_luamin_worker_socket_path_refuse_dir_of_other_user(self):
+        with mock.patch.dict(os.environ, {'XDG_RUNTIME_DIR': self.test_dir}), \
+                mock.patch(f'{__name__}.minify.os.getuid', return_value=os.getuid() + 1):
+            self.assertIsNone(minify.get_luamin_worker_socket_path('luamin'))
+
+    def test_try_connect_unix_socket_refuse_file(self):
+        socket_path = path.join(self.test_dir, 'luamin.sock')
+        with open(socket_path, 'w') as f:
+            f.write('not a socket')
+        self.assertIsNone(minify.try_connect_unix_socket(socket_path))
+
+
+@unittest.skipUnless(shutil.which('node'), "node is required to run the luamin worker")
+class TestLuaminWorker(unittest.TestCase):
+
+    def setUp(self):
+        # Create a temporary directory
+        self.test_dir = tempfile.mkdtemp()
+        self.luamin_script_path = path.join(self.test_dir, 'luamin')
+        with open(self.luamin_script_path, 'w') as f:
+            f.write(fake_luamin_script)
+        self.socket_path = path.join(self.test_dir, 'luamin.sock')
+        self.lua_filepath = path.join(self.test_dir, 'clean_lua.lua')
+
+    def tearDown(self):
+        minify.stop_luamin_worker(self.socket_path)
+        # Remove the directory after the test
+        shutil.rmtree(self.test_dir)
+
+    def run_worker(self, lua_code):
+        with open(self.lua_filepath, 'w') as f:
+            f.write(lua_code)
+        return minify.run_luamin_worker(['-fn', self.lua_filepath],
+            luamin_script_path=self.luamin_script_path, socket_path=self.socket_path, idle_timeout=10)
+
+    def test_run_luamin_worker(self):
+        self.assertEqual(self.run_worker('local a = 5\n'), ('-fn local a = 5\n', ''))
+
+    def test_run_luamin_worker_reused(self):
+        self.run_worker('local a = 5\n')
+        self.assertTrue(path.exists(self.socket_path))
+        self.assertEqual(self.run_worker('local b = 6\n'), ('-fn local b = 6\n', ''))
+
+    def test_run_luamin_worker_error(self):
+        # worker must survive luamin calling process.exit
+        self.assertEqual(self.run_worker('local a = }{'), ('', '[1:10] unexpected symbol\n'))
+        self.assertEqual(self.run_worker('local a = 5\n'), ('-fn local a = 5\n', ''))
+
+    def test_run_luamin_worker_missing_luamin(self):
+        self.assertIsNone(minify.run_luamin_worker(['-fn', self.lua_filepath],
+            luamin_script_path=path.join(self.test_dir, 'missing'), socket_path=self.socket_path))
+
+    def test_run_luamin_worker_refuse_socket_of_other_user(self):
+        self.run_worker('local a = 5\n')
+        with mock.patch(f'{__name__}.minify.os.getuid', return_value=os.getuid() + 1):
+            self.assertIsNone(minify.try_connect_unix_socket(self.socket_path))
+
+    def test_run_luamin_worker_concurrent_start(self):
+        results = [None, None]
+
+        def run_worker_thread(index):
+            results[index] = minify.run_luamin_worker(['-fn', self.lua_filepath],
+                luamin_script_path=self.luamin_script_path, socket_path=self.socket_path, idle_timeout=10)
+
+        with open(self.lua_filepath, 'w') as f:
+            f.write('local a = 5\n')
+        with mock.patch(f'{__name__}.minify.subprocess.check_call', wraps=minify.subprocess.check_call) as check_call_mock:
+            threads = [threading.Thread(target=run_worker_thread, args=(index,)) for index in range(2)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        # only one worker was started, and both builds used it
+        self.assertEqual(check_call_mock.call_count, 1)
+        self.assertEqual(results, [('-fn local a = 5\n', '')] * 2)
+
+    def test_stop_luamin_worker(self):
+        self.run_worker('local a = 5\n')
+        self.assertTrue(minify.stop_luamin_worker(self.socket_path))
+        self.assertIsNone(minify.try_connect_unix_socket(self.socket_path))
+
+    def test_stop_luamin_worker_not_running(self):
+        self.assertFalse(minify.stop_luamin_worker(self.socket_path))
+
 
 if __name__ == '__main__':
     # we don't want to see errors triggered on purpose during tests,
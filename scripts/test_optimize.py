@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+import unittest
+from . import lua_tokenizer, optimize
+
+import logging
+import os
+from os import path
+import shutil, tempfile
+
+
+def evaluate(expression):
+    """Helper to evaluate an expression source with evaluate_constant_expression"""
+    tokens = list(lua_tokenizer.tokenize(expression))
+    return optimize.evaluate_constant_expression(optimize.get_significant_tokens(tokens, 0, len(tokens)))
+
+
+class TestEvaluateConstantExpression(unittest.TestCase):
+
+    def test_evaluate_constant_expression_literals(self):
+        self.assertEqual([evaluate(expression) for expression in ['true', 'false', 'nil', '0x0000.8', '"a"']],
+            [True, False, None, 0.5, 'a'])
+
+    def test_evaluate_constant_expression_not(self):
+        self.assertEqual(evaluate('not nil'), True)
+
+    def test_evaluate_constant_expression_zero_is_truthy(self):
+        self.assertEqual(evaluate('not 0'), False)
+
+    def test_evaluate_constant_expression_and_or(self):
+        self.assertEqual(evaluate('false or nil and true'), None)
+
+    def test_evaluate_constant_expression_comparison(self):
+        self.assertEqual(evaluate('(1 < 2) == true and -1 ~= 1 and "a" != 1'), True)
+
+    def test_evaluate_constant_expression_fixed_point_equality(self):
+        self.assertEqual(evaluate('0x0000.0444 == 0.01666259765625'), True)
+
+    def test_evaluate_constant_expression_short_circuit_name(self):
+        self.assertEqual(evaluate('false and x'), False)
+
+    def test_evaluate_constant_expression_unknown_name(self):
+        self.assertIs(evaluate('x and false'), optimize.UNKNOWN)
+
+    def test_evaluate_constant_expression_unknown_call(self):
+        self.assertIs(evaluate('false and f()'), optimize.UNKNOWN)
+
+    def test_evaluate_constant_expression_unknown_arithmetic(self):
+        self.assertIs(evaluate('1 + 1 == 2'), optimize.UNKNOWN)
+
+    def test_evaluate_constant_expression_unknown_string_order(self):
+        self.assertIs(evaluate('"a" < "b"'), optimize.UNKNOWN)
+
+
+class TestOptimizeSource(unittest.TestCase):
+
+    def test_optimize_source_remove_false_if(self):
+        self.assertEqual(optimize.optimize_source('a()\nif false then\n  b()\nend\nc()\n'), 'a()\n\nc()\n')
+
+    def test_optimize_source_collapse_true_if(self):
+        self.assertEqual(optimize.optimize_source('if true then\n  b()\nelse\n  c()\nend\n'), '\n  b()\n\n')
+
+    def test_optimize_source_false_if_with_else(self):
+        self.assertEqual(optimize.optimize_source('if nil then b() else c() end'), ' c() ')
+
+    def test_optimize_source_remove_false_elseif(self):
+        self.assertEqual(optimize.optimize_source('if x then a() elseif false then b() elseif y then c() end'),
+            'if x then a() elseif y then c() end')
+
+    def test_optimize_source_true_elseif_becomes_else(self):
+        self.assertEqual(optimize.optimize_source('if x then a() elseif true then b() else c() end'),
+            'if x then a() else b() end')
+
+    def test_optimize_source_unknown_condition_preserved(self):
+        source = 'if f() and false then a() end'
+        self.assertEqual(optimize.optimize_source(source), source)
+
+    def test_optimize_source_nested(self):
+        self.assertEqual(optimize.optimize_source('if x then\n  if false then b() end\nend'), 'if x then\n  \nend')
+
+    def test_optimize_source_nested_blocks_in_body(self):
+        self.assertEqual(optimize.optimize_source('if true then for i=1,2 do f(i) end repeat g() until h() end'),
+            ' for i=1,2 do f(i) end repeat g() until h() ')
+
+    def test_optimize_source_keep_scope_of_locals(self):
+        self.assertEqual(optimize.optimize_source('if true then local x = 1 end'), 'do local x = 1 end')
+
+    def test_optimize_source_keep_block_for_return(self):
+        self.assertEqual(optimize.optimize_source('if 1 == 1 then return end'), 'do return end')
+
+    def test_optimize_source_keep_block_for_leading_bracket(self):
+        self.assertEqual(optimize.optimize_source('if true then (f)() end'), 'do (f)() end')
+
+    def test_optimize_source_local_in_nested_function_doesnt_keep_block(self):
+        self.assertEqual(optimize.optimize_source('if true then f(function() local x end) end'), ' f(function() local x end) ')
+
+    def test_optimize_source_shorthand_if_preserved(self):
+        source = 'if not debug then\n  if (x) y=1 else z=2\nend'
+        self.assertEqual(optimize.optimize_source(source), source)
+
+    def test_optimize_source_shorthand_if_inside_collapsed_if(self):
+        self.assertEqual(optimize.optimize_source('if true then\n  if (x) y=1 else z=2\nend'), '\n  if (x) y=1 else z=2\n')
+
+    def test_optimize_source_multiline_bracketed_condition_is_not_shorthand_if(self):
+        source = 'if false then\n if (a and\n b) then\n c()\n end\n d()\nend\ne()'
+        self.assertEqual(optimize.optimize_source(source), '\ne()')
+
+    def test_is_shorthand_if(self):
+        for source, expected in [
+                ('if (x) y=1', True),
+                ('if (f(x)) y=1 -- comment\nz=2', True),
+                ('if (x) then y=1 end', False),
+                ('if (x) and z then y=1 end', False),
+                ('if (a and\n b) then\n c()\n end', False),
+                ('if (x)\nthen y=1 end', False),
+                ('if x then y=1 end', False),
+            ]:
+            tokens = list(lua_tokenizer.tokenize(source))
+            self.assertEqual(optimize.is_shorthand_if(tokens, 0), expected, source)
+
+    def test_optimize_source_ignore_strings_and_comments(self):
+        source = 's = "if false then end" -- if false then end\n'
+        self.assertEqual(optimize.optimize_source(source), source)
+
+
+class TestOptimizeDir(unittest.TestCase):
+
+    def setUp(self):
+        # Create a temporary directory
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        # Remove the directory after the test
+        shutil.rmtree(self.test_dir)
+
+    def test_optimize_dir(self):
+        optimized_filepath = path.join(self.test_dir, 'optimized.lua')
+        with open(optimized_filepath, 'w') as f:
+            f.write('if false then\n  a()\nend\nb()\n')
+        unchanged_filepath = path.join(self.test_dir, 'unchanged.lua')
+        with open(unchanged_filepath, 'w') as f:
+            f.write('if x then\n  a()\nend\n')
+        os.utime(optimized_filepath, ns=(1000000000, 1000000000))
+        os.utime(unchanged_filepath, ns=(1000000000, 1000000000))
+
+        self.assertEqual(optimize.optimize_dir(self.test_dir), 1)
+
+        with open(optimized_filepath, 'r') as f:
+            self.assertEqual(f.read(), '\nb()\n')
+        with open(unchanged_filepath, 'r') as f:
+            self.assertEqual(f.read(), 'if x then\n  a()\nend\n')
+        # modification time is preserved, so incremental preprocessing still considers the file up to date
+        self.assertEqual(os.stat(optimized_filepath).st_mtime_ns, 1000000000)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.CRITICAL)
+    unittest.main()
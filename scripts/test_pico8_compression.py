@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import unittest
+from . import pico8_compression
+
+
+class TestCompressCode(unittest.TestCase):
+
+    def test_compress_code_empty(self):
+        self.assertEqual(pico8_compression.compress_code(""), b"\0pxa\x00\x00\x00\x08")
+
+    def test_compress_code_single_literal(self):
+        # 'a' is at index 97 = 16 + 32 + 49 in the initial move-to-front list, so it takes prefix 110 and 6 bits:
+        # bits 1 110 100011 (49 lowest bit first) -> bytes 0b00010111 0b00000011
+        self.assertEqual(pico8_compression.compress_code("a"), b"\0pxa\x00\x01\x00\x0a\x17\x03")
+
+    def test_compress_code_uses_back_references(self):
+        code = "print('hello')\n" * 100
+        # 15 literals, then a single back-reference whose length takes 3 bits per 7 characters
+        self.assertLess(len(pico8_compression.compress_code(code)), 120)
+
+    def test_compress_code_too_long(self):
+        with self.assertRaises(ValueError):
+            pico8_compression.compress_code("a" * 65536)
+
+    def test_compress_decompress_round_trip(self):
+        code = """local function f(a, b)
+  -- some comment with a glyph: █
+  if a > b then return a..b end
+  return f(b, a + 1) -- recursion
+end
+""" * 20 + "".join(chr(32 + (i * 7919) % 95) for i in range(3000))
+        self.assertEqual(pico8_compression.decompress_code(pico8_compression.compress_code(code)),
+            pico8_compression.encode_pico8_chars(code))
+
+    def test_compress_decompress_round_trip_long_match(self):
+        code = "a" * 1000 + "b" + "a" * 1000
+        self.assertEqual(pico8_compression.decompress_code(pico8_compression.compress_code(code)),
+            pico8_compression.encode_pico8_chars(code))
+
+
+class TestDecompressCode(unittest.TestCase):
+
+    def test_decompress_code_missing_header(self):
+        with self.assertRaises(ValueError):
+            pico8_compression.decompress_code(b":c:\0\x00\x01\x00\x00")
+
+    def test_decompress_code_truncated(self):
+        with self.assertRaises(ValueError):
+            pico8_compression.decompress_code(b"\0pxa\x00\x02\x00\x0a\x17\x03")
+
+
+class TestEncodePico8Chars(unittest.TestCase):
+
+    def test_encode_pico8_chars_ascii(self):
+        self.assertEqual(pico8_compression.encode_pico8_chars("aB1\n"), b"aB1\n")
+
+    def test_encode_pico8_chars_glyphs(self):
+        self.assertEqual(pico8_compression.encode_pico8_chars("█▒█"), bytes([128, 129, 128]))
+
+
+class TestGetLiteralBitCount(unittest.TestCase):
+
+    def test_get_literal_bit_count(self):
+        self.assertEqual(pico8_compression.get_literal_bit_count(0), 6)
+        self.assertEqual(pico8_compression.get_literal_bit_count(15), 6)
+        self.assertEqual(pico8_compression.get_literal_bit_count(16), 8)
+        self.assertEqual(pico8_compression.get_literal_bit_count(97), 10)
+
+
+class TestGetCompressedCodeSize(unittest.TestCase):
+
+    def test_get_compressed_code_size(self):
+        self.assertEqual(pico8_compression.get_compressed_code_size("a"), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+import unittest
+from . import pico8_tokens
+
+import shutil, tempfile
+from os import path
+
+
+class TestCountTokens(unittest.TestCase):
+
+    def test_count_tokens_local_assignment(self):
+        # local doesn't count
+        self.assertEqual(pico8_tokens.count_tokens('local a = 5'), 3)
+
+    def test_count_tokens_ignores_comments_and_whitespace(self):
+        self.assertEqual(pico8_tokens.count_tokens('--[[ long\ncomment ]]\nx = 1 -- short comment\n'), 3)
+
+    def test_count_tokens_ignores_punctuation_and_closing_brackets(self):
+        # f ( a b c d e (
+        self.assertEqual(pico8_tokens.count_tokens('f(a, b.c, d:e());'), 8)
+
+    def test_count_tokens_table_constructor(self):
+        # t = { 1 2 [ 3 = 4
+        self.assertEqual(pico8_tokens.count_tokens('t = {1, 2; [3] = 4}'), 9)
+
+    def test_count_tokens_end_does_not_count(self):
+        self.assertEqual(pico8_tokens.count_tokens('if x then y() end'), 5)
+
+    def test_count_tokens_string_counts_once(self):
+        self.assertEqual(pico8_tokens.count_tokens('print("a, b, c") print([[end]])'), 6)
+
+    def test_count_tokens_negative_literal(self):
+        self.assertEqual(pico8_tokens.count_tokens('x = -1'), 3)
+
+    def test_count_tokens_binary_minus_before_literal(self):
+        self.assertEqual(pico8_tokens.count_tokens('x = a - 1'), 5)
+        self.assertEqual(pico8_tokens.count_tokens('x = f() - 1'), 6)
+
+    def test_count_tokens_negative_literal_after_operator(self):
+        self.assertEqual(pico8_tokens.count_tokens('x = a * -1'), 5)
+
+    def test_count_tokens_unary_minus_before_name(self):
+        self.assertEqual(pico8_tokens.count_tokens('x = -a'), 4)
+
+    def test_count_tokens_label_and_goto(self):
+        self.assertEqual(pico8_tokens.count_tokens('::a:: goto a'), 3)
+
+    def test_count_tokens_glyph_counts_once(self):
+        self.assertEqual(pico8_tokens.count_tokens('btn(⬅️)'), 3)
+
+
+class TestCountTokensInFile(unittest.TestCase):
+
+    def setUp(self):
+        # Create a temporary directory
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        # Remove the directory after the test
+        shutil.rmtree(self.test_dir)
+
+    def test_count_tokens_in_file_lua(self):
+        lua_filepath = path.join(self.test_dir, 'source.lua')
+        with open(lua_filepath, 'w') as f:
+            f.write('local a = 5\n')
+        self.assertEqual(pico8_tokens.count_tokens_in_file(lua_filepath), 3)
+
+    def test_count_tokens_in_file_p8(self):
+        cartridge_filepath = path.join(self.test_dir, 'cartridge.p8')
+        with open(cartridge_filepath, 'w') as f:
+            f.write("""pico-8 cartridge // http://www.pico-8.com
+version 27
+__lua__
+local a = 5
+__gfx__
+eeeeeeeee5eeeeeeeeee
+""")
+        self.assertEqual(pico8_tokens.count_tokens_in_file(cartridge_filepath), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
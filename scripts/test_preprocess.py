@@ -1,10 +1,13 @@
 import unittest
+from unittest import mock
 from . import preprocess
 
 import logging
+import os
 from os import path
-import re
 import shutil, tempfile
+import subprocess
+import sys
 
 
 class TestGetStrippedFunctions(unittest.TestCase):
@@ -22,25 +25,46 @@ class TestGetStrippedFunctions(unittest.TestCase):
         self.assertEqual(preprocess.get_stripped_functions(['assert', 'log']), [])
 
 
-class TestGenerateStrippedFunctionCallPattern(unittest.TestCase):
+class TestGetPreservedLogCategories(unittest.TestCase):
 
-    def test_generate_stripped_function_call_pattern_no_stripped_functions(self):
-        self.assertEqual(preprocess.generate_stripped_function_call_pattern([]), None)
+    def test_get_preserved_log_categories_no_log(self):
+        self.assertIsNone(preprocess.get_preserved_log_categories(['log_physics']))
 
-    def test_generate_stripped_function_call_pattern_assert(self):
-        self.assertEqual(preprocess.generate_stripped_function_call_pattern(['assert']), re.compile('^\\s*(?:assert)\\(.*\\)\\s*(?:--.*)?$'))
+    def test_get_preserved_log_categories_log_without_categories(self):
+        self.assertIsNone(preprocess.get_preserved_log_categories(['log']))
 
-    def test_generate_stripped_function_call_pattern_assert_log_warn_err(self):
-        self.assertEqual(preprocess.generate_stripped_function_call_pattern(['assert', 'log', 'warn', 'err']), re.compile('^\\s*(?:assert|log|warn|err)\\(.*\\)\\s*(?:--.*)?$'))
+    def test_get_preserved_log_categories_log_with_categories(self):
+        self.assertEqual(preprocess.get_preserved_log_categories(['log', 'log_physics', 'log_flow', 'assert']), {'physics', 'flow'})
 
 
-class TestMatchStrippedFunctionCall(unittest.TestCase):
+class TestSplitCallArguments(unittest.TestCase):
 
-    def test_match_stripped_function_call_dont_strip_log_functions(self):
-        self.assertFalse(preprocess.match_stripped_function_call('warn("message (inside brackets)")', ['log']))
+    def test_split_call_arguments(self):
+        self.assertEqual(preprocess.split_call_arguments('log("a, b" .. f(1, 2), "flow")  -- comment\n'), ['"a, b" .. f(1, 2)', '"flow"'])
 
-    def test_match_stripped_function_call_strip_log_functions(self):
-        self.assertTrue(preprocess.match_stripped_function_call('warn("message (inside brackets)")', []))
+    def test_split_call_arguments_no_arguments(self):
+        self.assertEqual(preprocess.split_call_arguments('log()\n'), [])
+
+    def test_split_call_arguments_multiline_with_comments(self):
+        self.assertEqual(preprocess.split_call_arguments('log({1, 2}, -- c\n  "x" )\n'), ['{1, 2}', '"x"'])
+
+    def test_split_call_arguments_unfinished(self):
+        self.assertIsNone(preprocess.split_call_arguments('log(x,\n'))
+
+
+class TestGetLogCallCategory(unittest.TestCase):
+
+    def test_get_log_call_category_literal(self):
+        self.assertEqual(preprocess.get_log_call_category("warn('a', 'physics')"), 'physics')
+
+    def test_get_log_call_category_no_category(self):
+        self.assertEqual(preprocess.get_log_call_category('log("a")'), 'default')
+
+    def test_get_log_call_category_nil(self):
+        self.assertEqual(preprocess.get_log_call_category('log("a", nil)'), 'default')
+
+    def test_get_log_call_category_not_literal(self):
+        self.assertIsNone(preprocess.get_log_call_category('log("a", category)'))
 
 
 class TestPreprocessLines(unittest.TestCase):
@@ -475,6 +499,614 @@ class TestPreprocessLines(unittest.TestCase):
         ]
         self.assertEqual(preprocess.preprocess_lines(test_lines, ['']), expected_processed_lines)
 
+    def test_preprocess_lines_strip_multiline_call(self):
+        test_lines = [
+            'print("start")\n',
+            'log(sum(1, 2)\n',
+            '.."!")\n',
+            'assert(x > 0,\n',
+            '  "x is not positive (got "..x..")")  -- comment\n',
+            'print("end")\n',
+        ]
+        expected_processed_lines = [
+            'print("start")\n',
+            'print("end")\n',
+        ]
+        self.assertEqual(preprocess.preprocess_lines(test_lines, []), expected_processed_lines)
+
+    def test_preprocess_lines_dont_strip_multiline_call(self):
+        test_lines = [
+            'print("start")\n',
+            'log(sum(1, 2)\n',
+            '.."!")\n',
+            'print("end")\n',
+        ]
+        self.assertEqual(preprocess.preprocess_lines(test_lines, ['log']), test_lines)
+
+    def test_preprocess_lines_strip_call_ignore_brackets_in_strings_and_comments(self):
+        test_lines = [
+            'log("(" --[[ ) ]] .. [==[\n',
+            ')]==] -- )\n',
+            '.. \')\')\n',
+            'print("end")\n',
+        ]
+        expected_processed_lines = [
+            'print("end")\n',
+        ]
+        self.assertEqual(preprocess.preprocess_lines(test_lines, []), expected_processed_lines)
+
+    def test_preprocess_lines_preserve_lines_inside_long_string(self):
+        test_lines = [
+            'local help_text = [==[\n',
+            'log("not a call")\n',
+            '--#if debug\n',
+            ']==] log("still in string") --[[\n',
+            'assert(false)\n',
+            ']]\n',
+            'log("stripped")\n',
+            'print(help_text)\n',
+        ]
+        expected_processed_lines = test_lines[:6] + ['print(help_text)\n']
+        self.assertEqual(preprocess.preprocess_lines(test_lines, []), expected_processed_lines)
+        self.assertEqual(preprocess.evaluate_directive_tree(preprocess.parse_lines(test_lines), []), expected_processed_lines)
+
+    def test_preprocess_lines_preserve_lines_inside_long_string_after_preserved_call(self):
+        test_lines = [
+            'log("a") text = [[\n',
+            'log("b")\n',
+            ']]\n',
+        ]
+        self.assertEqual(preprocess.preprocess_lines(test_lines, []), test_lines)
+        self.assertEqual(preprocess.evaluate_directive_tree(preprocess.parse_lines(test_lines), []), test_lines)
+
+    def test_find_unclosed_long_bracket(self):
+        self.assertEqual(preprocess.find_unclosed_long_bracket('text = [==[start\n'), ']==]')
+        self.assertEqual(preprocess.find_unclosed_long_bracket('x = 1 --[[ comment\n'), ']]')
+        self.assertIsNone(preprocess.find_unclosed_long_bracket('x = t[ [[a]] ] -- [[\n'))
+        self.assertIsNone(preprocess.find_unclosed_long_bracket('x = "[[" .. \'[[\'\n'))
+
+    def test_preprocess_lines_call_followed_by_code_preserved(self):
+        test_lines = [
+            'log("a") print("b")\n',
+            'log("c",\n',
+            '"d") print("e")\n',
+        ]
+        with self.assertLogs(level='WARNING') as cm:
+            self.assertEqual(preprocess.preprocess_lines(test_lines, []), test_lines)
+        self.assertEqual(len(cm.output), 2)
+
+    def test_preprocess_lines_unfinished_call_preserved(self):
+        test_lines = [
+            'print("start")\n',
+            'log("a",\n',
+            '"b"\n',
+        ]
+        with self.assertLogs(level='WARNING') as cm:
+            self.assertEqual(preprocess.preprocess_lines(test_lines, []), test_lines)
+        self.assertIn("file ended inside a call", cm.output[0])
+
+    def test_preprocess_lines_strip_log_by_category(self):
+        test_lines = [
+            'log("physics", "physics")\n',
+            'warn("flow",\n',
+            '  "flow")\n',
+            'err("default")\n',
+            'log("dynamic", category)\n',
+            'assert(true, "assert is not affected")\n',
+        ]
+        expected_processed_lines = [
+            'log("physics", "physics")\n',
+            'log("dynamic", category)\n',
+            'assert(true, "assert is not affected")\n',
+        ]
+        self.assertEqual(preprocess.preprocess_lines(test_lines, ['assert', 'log', 'log_physics']), expected_processed_lines)
+
+    def test_preprocess_lines_log_categories_ignored_without_log(self):
+        test_lines = [
+            'log("physics", "physics")\n',
+            'print("end")\n',
+        ]
+        self.assertEqual(preprocess.preprocess_lines(test_lines, ['log_physics']), ['print("end")\n'])
+
+    def test_preprocess_lines_rewrite_lazy_assert(self):
+        test_lines = [
+            '  assert(x > 0, "x is not positive: "..x)  -- comment\n',
+            'assert(y, "constant message")\n',
+            'assert(z,\n',
+            '  "multi-line: "..z)\n',
+        ]
+        expected_processed_lines = [
+            '  if not (x > 0) then assert(false, "x is not positive: "..x) end  -- comment\n',
+            'assert(y, "constant message")\n',
+            'assert(z,\n',
+            '  "multi-line: "..z)\n',
+        ]
+        self.assertEqual(preprocess.preprocess_lines(test_lines, ['assert']), expected_processed_lines)
+
+    def test_preprocess_lines_define(self):
+        test_lines = [
+            'print(screen_width)\n',
+            '--#define tile_size 8\n',
+            'local x = tile_size * screen_width  -- tile_size\n',
+            '--#if debug\n',
+            '--#define tile_size 16\n',
+            '--#endif\n',
+            'print(tile_size)\n',
+        ]
+        expected_processed_lines = [
+            'print(128)\n',
+            'local x = 8 * 128  -- tile_size\n',
+            'print(8)\n',
+        ]
+        self.assertEqual(preprocess.preprocess_lines(test_lines, ['screen_width=128']), expected_processed_lines)
+
+    def test_preprocess_lines_define_counts_as_symbol(self):
+        test_lines = [
+            '--#if tile_size\n',
+            'print(tile_size)\n',
+            '--#endif\n',
+        ]
+        self.assertEqual(preprocess.preprocess_lines(test_lines, ['tile_size=8']), ['print(8)\n'])
+
+    def test_preprocess_lines_define_without_value_ignored(self):
+        test_lines = [
+            '--#define tile_size\n',
+            'print(tile_size)\n',
+        ]
+        with self.assertLogs(level='WARNING'):
+            self.assertEqual(preprocess.preprocess_lines(test_lines, []), ['print(tile_size)\n'])
+
+
+class TestSplitSymbolsAndDefines(unittest.TestCase):
+
+    def test_split_symbols_and_defines(self):
+        self.assertEqual(preprocess.split_symbols_and_defines(['debug', 'screen_width=128', 'title="a=b"']),
+            (['debug', 'screen_width', 'title'], {'screen_width': '128', 'title': '"a=b"'}))
+
+
+class TestSubstituteDefines(unittest.TestCase):
+
+    defines = {'screen_width': '128', 'offset': '-1', 'dt': '1/60'}
+
+    def test_substitute_defines(self):
+        self.assertEqual(preprocess.substitute_defines('x = screen_width / 2\n', self.defines), 'x = 128 / 2\n')
+
+    def test_substitute_defines_preserve_strings_and_comments(self):
+        self.assertEqual(preprocess.substitute_defines('s = "screen_width"  -- screen_width\n', self.defines),
+            's = "screen_width"  -- screen_width\n')
+
+    def test_substitute_defines_preserve_fields_locals_and_assignments(self):
+        source = 't.screen_width = self:screen_width()\nlocal screen_width\nscreen_width = 1\nscreen_width += 1\n'
+        self.assertEqual(preprocess.substitute_defines(source, self.defines), source)
+
+    def test_substitute_defines_warn_shadowing_local(self):
+        source = 'local x, screen_width = 1, screen_width\nlocal function f() end\n'
+        with self.assertLogs(level='WARNING') as cm:
+            self.assertEqual(preprocess.substitute_defines(source, self.defines),
+                'local x, screen_width = 1, 128\nlocal function f() end\n')
+        self.assertEqual(len(cm.output), 1)
+        self.assertIn("define 'screen_width' is shadowed", cm.output[0])
+        self.assertIn('local x, screen_width = 1, screen_width', cm.output[0])
+
+    def test_substitute_defines_warn_shadowing_local_function_and_parameters(self):
+        source = 'local function dt(x, offset)\n  return offset\nend\n'
+        with self.assertLogs(level='WARNING') as cm:
+            self.assertEqual(preprocess.substitute_defines(source, self.defines),
+                'local function dt(x, offset)\n  return (-1)\nend\n')
+        self.assertEqual(len(cm.output), 2)
+
+    def test_substitute_defines_warn_shadowing_for_variables(self):
+        source = 'for i, screen_width in pairs(t) do end\nfor offset = 1, screen_width do end\n'
+        with self.assertLogs(level='WARNING') as cm:
+            self.assertEqual(preprocess.substitute_defines(source, self.defines),
+                'for i, screen_width in pairs(t) do end\nfor offset = 1, 128 do end\n')
+        self.assertEqual(len(cm.output), 2)
+
+    def test_substitute_defines_preserve_multiple_assignment_targets(self):
+        source = 'screen_width, b = 1, 2\na, t.x, t[i], offset = screen_width, 1, 2, 3\n'
+        with mock.patch('logging.warning') as warning_mock:
+            self.assertEqual(preprocess.substitute_defines(source, self.defines),
+                'screen_width, b = 1, 2\na, t.x, t[i], offset = 128, 1, 2, 3\n')
+        warning_mock.assert_not_called()
+
+    def test_substitute_defines_multiple_values_not_assigned(self):
+        self.assertEqual(preprocess.substitute_defines('f(screen_width, b)\nx = screen_width\nb, c = 1, 2\n', self.defines),
+            'f(128, b)\nx = 128\nb, c = 1, 2\n')
+
+    def test_substitute_defines_no_warning_for_global_function_and_next_statement(self):
+        source = 'function screen_width() end\nlocal x\nscreen_width = 1\ny = f(screen_width)\n'
+        with mock.patch('logging.warning') as warning_mock:
+            self.assertEqual(preprocess.substitute_defines(source, self.defines),
+                'function screen_width() end\nlocal x\nscreen_width = 1\ny = f(128)\n')
+        warning_mock.assert_not_called()
+
+    def test_substitute_defines_table_constructor(self):
+        self.assertEqual(preprocess.substitute_defines('{screen_width = screen_width}', self.defines), '{screen_width = 128}')
+
+    def test_substitute_defines_comparison(self):
+        self.assertEqual(preprocess.substitute_defines('if screen_width == x then', self.defines), 'if 128 == x then')
+
+    def test_substitute_defines_multiple_tokens_value_in_brackets(self):
+        self.assertEqual(preprocess.substitute_defines('a = 2^offset + dt*x-offset', self.defines), 'a = 2^(-1) + (1/60)*x-(-1)')
+
+
+class TestGenerateSubstitutedLines(unittest.TestCase):
+
+    def test_generate_substituted_lines_no_defines(self):
+        test_lines = ['print(screen_width)\n']
+        self.assertEqual(list(preprocess.generate_substituted_lines(test_lines, {})), test_lines)
+
+    def test_generate_substituted_lines_preserve_multiline_long_string(self):
+        test_lines = [
+            's = [[\n',
+            'screen_width]] .. screen_width\n',
+            'print(screen_width)\n',
+        ]
+        expected_lines = [
+            's = [[\n',
+            'screen_width]] .. 128\n',
+            'print(128)\n',
+        ]
+        self.assertEqual(list(preprocess.generate_substituted_lines(test_lines, {'screen_width': '128'})), expected_lines)
+
+    def test_generate_substituted_lines_unfinished_long_comment(self):
+        test_lines = [
+            '--[[\n',
+            'screen_width\n',
+        ]
+        self.assertEqual(list(preprocess.generate_substituted_lines(test_lines, {'screen_width': '128'})), test_lines)
+
+
+class TestReadDefinesFile(unittest.TestCase):
+
+    def setUp(self):
+        # Create a temporary directory
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        # Remove the directory after the test
+        shutil.rmtree(self.test_dir)
+
+    def test_read_defines_file(self):
+        defines_filepath = path.join(self.test_dir, 'constants.lua')
+        with open(defines_filepath, 'w') as f:
+            f.write("""-- screen
+screen_width = 128
+delta_time60 = 0x0000.0444  -- 1/60
+title = "my game"
+offset = -1
+
+colors = {}
+""")
+        with self.assertLogs(level='WARNING') as cm:
+            self.assertEqual(preprocess.read_defines_file(defines_filepath),
+                ['screen_width=128', 'delta_time60=0x0000.0444', 'title="my game"', 'offset=-1'])
+        self.assertEqual(len(cm.output), 1)
+
+
+class TestRewriteLazyAssert(unittest.TestCase):
+
+    def test_rewrite_lazy_assert(self):
+        self.assertEqual(preprocess.rewrite_lazy_assert('  assert(f(a, b) == 2, "bad: "..a)  -- comment\n'),
+            '  if not (f(a, b) == 2) then assert(false, "bad: "..a) end  -- comment\n')
+
+    def test_rewrite_lazy_assert_no_message(self):
+        self.assertEqual(preprocess.rewrite_lazy_assert('assert(x)\n'), 'assert(x)\n')
+
+    def test_rewrite_lazy_assert_single_token_message(self):
+        self.assertEqual(preprocess.rewrite_lazy_assert('assert(x, message)\n'), 'assert(x, message)\n')
+
+
+class TestScanCall(unittest.TestCase):
+
+    def test_scan_call_standalone(self):
+        self.assertEqual(preprocess.scan_call('log("a")\n'), preprocess.CallScanResult.STANDALONE)
+
+    def test_scan_call_standalone_with_comment(self):
+        self.assertEqual(preprocess.scan_call('  log("a(")  -- comment )\n'), preprocess.CallScanResult.STANDALONE)
+
+    def test_scan_call_standalone_with_long_comment(self):
+        self.assertEqual(preprocess.scan_call('log("a") --[[ comment ]] -- ok\n'), preprocess.CallScanResult.STANDALONE)
+
+    def test_scan_call_standalone_multiline(self):
+        self.assertEqual(preprocess.scan_call('log(sum(1, 2)\n.."!")\n'), preprocess.CallScanResult.STANDALONE)
+
+    def test_scan_call_standalone_escaped_quote(self):
+        self.assertEqual(preprocess.scan_call('log("\\")")\n'), preprocess.CallScanResult.STANDALONE)
+
+    def test_scan_call_standalone_indexed_argument(self):
+        self.assertEqual(preprocess.scan_call('log(t[(1)])\n'), preprocess.CallScanResult.STANDALONE)
+
+    def test_scan_call_unfinished_bracket(self):
+        self.assertEqual(preprocess.scan_call('log(sum(1, 2)\n'), preprocess.CallScanResult.UNFINISHED)
+
+    def test_scan_call_unfinished_long_string(self):
+        self.assertEqual(preprocess.scan_call('log([[ ) \n'), preprocess.CallScanResult.UNFINISHED)
+
+    def test_scan_call_unfinished_line_comment(self):
+        self.assertEqual(preprocess.scan_call('log(x -- )'), preprocess.CallScanResult.UNFINISHED)
+
+    def test_scan_call_not_standalone_followed_by_code(self):
+        self.assertEqual(preprocess.scan_call('log("a") print("b")\n'), preprocess.CallScanResult.NOT_STANDALONE)
+
+    def test_scan_call_not_standalone_newline_in_string(self):
+        self.assertEqual(preprocess.scan_call('log("a\n")\n'), preprocess.CallScanResult.NOT_STANDALONE)
+
+
+class TestGeneratePreprocessedLines(unittest.TestCase):
+
+    def test_generate_preprocessed_lines_yields_lines_as_soon_as_accepted(self):
+        consumed_lines = []
+
+        def generate_test_lines():
+            for line in ['print("always")\n', '--#if debug\n', 'print("debug")\n', '--#endif\n', 'print("end")\n']:
+                consumed_lines.append(line)
+                yield line
+
+        preprocessed_lines_generator = preprocess.generate_preprocessed_lines(generate_test_lines(), [])
+        self.assertEqual(next(preprocessed_lines_generator), 'print("always")\n')
+        # only the first line should have been consumed so far
+        self.assertEqual(consumed_lines, ['print("always")\n'])
+        self.assertEqual(next(preprocessed_lines_generator), 'print("end")\n')
+        self.assertEqual(list(preprocessed_lines_generator), [])
+
+    def test_preprocess_stdin_to_stdout(self):
+        test_code = """print("always")
+--#if debug
+print("debug")
+--#endif
+log("message")
+"""
+        script_filepath = path.join(path.dirname(path.abspath(__file__)), 'preprocess.py')
+        completed_process = subprocess.run([sys.executable, script_filepath, '-', '--symbols', 'debug'],
+            input=test_code, stdout=subprocess.PIPE, universal_newlines=True, check=True)
+        self.assertEqual(completed_process.stdout, 'print("always")\nprint("debug")\n')
+
+
+class TestClassifyLine(unittest.TestCase):
+
+    def test_classify_line_code(self):
+        self.assertEqual(preprocess.classify_line('  print("hello")  -- comment\n'), (preprocess.LineType.CODE, None))
+
+    def test_classify_line_comment(self):
+        self.assertEqual(preprocess.classify_line('  -- log("commented")\n'), (preprocess.LineType.CODE, None))
+
+    def test_classify_line_if(self):
+        self.assertEqual(preprocess.classify_line('  --#if debug\n'), (preprocess.LineType.IF, 'debug'))
+
+    def test_classify_line_ifn(self):
+        self.assertEqual(preprocess.classify_line('--#ifn debug\n'), (preprocess.LineType.IFN, 'debug'))
+
+    def test_classify_line_endif(self):
+        self.assertEqual(preprocess.classify_line('--#endif\n'), (preprocess.LineType.ENDIF, None))
+
+    def test_classify_line_pico8_start(self):
+        self.assertEqual(preprocess.classify_line('--[==[#pico8\n'), (preprocess.LineType.PICO8_START, None))
+
+    def test_classify_line_pico8_end(self):
+        self.assertEqual(preprocess.classify_line('--#pico8]==]\n'), (preprocess.LineType.PICO8_END, None))
+
+    def test_classify_line_strippable_call(self):
+        self.assertEqual(preprocess.classify_line('  warn("message")  -- comment\n'), (preprocess.LineType.STRIPPABLE_CALL, 'warn'))
+
+    def test_classify_line_define(self):
+        self.assertEqual(preprocess.classify_line('--#define tile_size 8  \n'), (preprocess.LineType.DEFINE, ('tile_size', '8')))
+
+    def test_classify_line_strippable_function_prefix_but_not_call(self):
+        self.assertEqual(preprocess.classify_line('logger = {}\n'), (preprocess.LineType.CODE, None))
+
+    def test_classify_line_directive_after_non_blank(self):
+        self.assertEqual(preprocess.classify_line('text before --#if debug\n'), (preprocess.LineType.CODE, None))
+
+
+class TestDirectiveTree(unittest.TestCase):
+
+    test_lines = [
+        'print("always")\n',
+        '--#if debug\n',
+        'print("debug")\n',
+        '--#ifn log\n',
+        'print("debug but no log")\n',
+        '--#endif\n',
+        '--#endif\n',
+        '--[[#pico8\n',
+        '--#if log\n',
+        'log("pico8 only")\n',
+        '--#endif\n',
+        '--#pico8]]\n',
+        'assert(x > 0, "x is not positive")  -- comment\n',
+        'warn("warning")\n',
+        'log("multi",\n',
+        '  "line")\n',
+        '--#define tile_size 8\n',
+        'print("end", tile_size)\n',
+    ]
+
+    def test_parse_lines(self):
+        self.assertEqual(preprocess.parse_lines(self.test_lines), [
+            (preprocess.DirectiveNodeType.LINE, 'print("always")\n'),
+            (preprocess.DirectiveNodeType.IF_BLOCK, 'debug', False, [
+                (preprocess.DirectiveNodeType.LINE, 'print("debug")\n'),
+                (preprocess.DirectiveNodeType.IF_BLOCK, 'log', True, [
+                    (preprocess.DirectiveNodeType.LINE, 'print("debug but no log")\n'),
+                ]),
+            ]),
+            (preprocess.DirectiveNodeType.PICO8_START,),
+            (preprocess.DirectiveNodeType.IF_BLOCK, 'log', False, [
+                (preprocess.DirectiveNodeType.STRIPPABLE_CALL, 'log', ['log("pico8 only")\n'], preprocess.CallScanResult.STANDALONE),
+            ]),
+            (preprocess.DirectiveNodeType.PICO8_END,),
+            (preprocess.DirectiveNodeType.STRIPPABLE_CALL, 'assert', ['assert(x > 0, "x is not positive")  -- comment\n'], preprocess.CallScanResult.STANDALONE),
+            (preprocess.DirectiveNodeType.STRIPPABLE_CALL, 'warn', ['warn("warning")\n'], preprocess.CallScanResult.STANDALONE),
+            (preprocess.DirectiveNodeType.STRIPPABLE_CALL, 'log', ['log("multi",\n', '  "line")\n'], preprocess.CallScanResult.STANDALONE),
+            (preprocess.DirectiveNodeType.DEFINE, 'tile_size', '8'),
+            (preprocess.DirectiveNodeType.LINE, 'print("end", tile_size)\n'),
+        ])
+
+    def test_evaluate_directive_tree_same_as_preprocess_lines(self):
+        directive_tree = preprocess.parse_lines(self.test_lines)
+        for defined_symbols in [[], ['debug'], ['log'], ['assert'], ['debug', 'log'], ['debug', 'assert', 'log'], ['log', 'log_default'], ['debug=1']]:
+            self.assertEqual(preprocess.evaluate_directive_tree(directive_tree, defined_symbols),
+                preprocess.preprocess_lines(self.test_lines, defined_symbols))
+
+    def test_evaluate_directive_tree_missing_endif_ignored(self):
+        test_lines = [
+            'print("always")\n',
+            '--#if debug\n',
+            'print("debug")\n',
+        ]
+        # this will also trigger a warning, but we don't test it
+        directive_tree = preprocess.parse_lines(test_lines)
+        self.assertEqual(preprocess.evaluate_directive_tree(directive_tree, []), ['print("always")\n'])
+        self.assertEqual(preprocess.evaluate_directive_tree(directive_tree, ['debug']), ['print("always")\n', 'print("debug")\n'])
+
+
+class TestPreprocessDirMulti(unittest.TestCase):
+
+    def setUp(self):
+        # Create a temporary directory
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        # Remove the directory after the test
+        shutil.rmtree(self.test_dir)
+
+    def test_preprocess_dir_multi(self):
+        test_code = """print("always")
+--#if debug
+print("debug")
+--#endif
+log("message")
+"""
+        expected_processed_code_debug = """print("always")
+print("debug")
+log("message")
+"""
+        expected_processed_code_release = """print("always")
+"""
+
+        src_dirpath = path.join(self.test_dir, 'src')
+        os.makedirs(path.join(src_dirpath, 'sub'))
+        with open(path.join(src_dirpath, 'sub', 'test.lua'), 'w') as f:
+            f.write(test_code)
+        debug_dirpath = path.join(self.test_dir, 'debug')
+        release_dirpath = path.join(self.test_dir, 'release')
+
+        with mock.patch(f"{__name__}.preprocess.parse_lines", wraps=preprocess.parse_lines) as parse_lines_mock:
+            preprocess.preprocess_dir_multi(src_dirpath, {debug_dirpath: ['debug', 'log'], release_dirpath: []})
+            # single parsing for both configs
+            parse_lines_mock.assert_called_once()
+
+        with open(path.join(debug_dirpath, 'sub', 'test.lua'), 'r') as f:
+            self.assertEqual(f.read(), expected_processed_code_debug)
+        with open(path.join(release_dirpath, 'sub', 'test.lua'), 'r') as f:
+            self.assertEqual(f.read(), expected_processed_code_release)
+        # source is untouched
+        with open(path.join(src_dirpath, 'sub', 'test.lua'), 'r') as f:
+            self.assertEqual(f.read(), test_code)
+
+    def test_preprocess_dir_multi_with_cache(self):
+        test_code = """print("always")
+--#if debug
+print("debug")
+--#endif
+"""
+        src_dirpath = path.join(self.test_dir, 'src')
+        os.mkdir(src_dirpath)
+        with open(path.join(src_dirpath, 'test.lua'), 'w') as f:
+            f.write(test_code)
+        cache_dirpath = path.join(self.test_dir, 'cache')
+        defined_symbols_by_output_dirpath = {
+            path.join(self.test_dir, 'debug'): ['debug'],
+            path.join(self.test_dir, 'release'): [],
+        }
+
+        preprocess.preprocess_dir_multi(src_dirpath, defined_symbols_by_output_dirpath, cache_dirpath)
+
+        # all configs are cached, so second time the file should not be parsed at all
+        with mock.patch(f"{__name__}.preprocess.parse_lines") as parse_lines_mock:
+            preprocess.preprocess_dir_multi(src_dirpath, defined_symbols_by_output_dirpath, cache_dirpath)
+            parse_lines_mock.assert_not_called()
+
+        with open(path.join(self.test_dir, 'release', 'test.lua'), 'r') as f:
+            self.assertEqual(f.read(), 'print("always")\n')
+
+
+class TestPreprocessDirOutOfPlace(unittest.TestCase):
+
+    test_code = """print("always")
+--#if debug
+print("debug")
+--#endif
+"""
+
+    def setUp(self):
+        # Create a temporary directory
+        self.test_dir = tempfile.mkdtemp()
+        self.src_dirpath = path.join(self.test_dir, 'src')
+        self.output_dirpath = path.join(self.test_dir, 'intermediate')
+        os.mkdir(self.src_dirpath)
+        self.test_filepath = path.join(self.src_dirpath, 'test.lua')
+        with open(self.test_filepath, 'w') as f:
+            f.write(self.test_code)
+
+    def tearDown(self):
+        # Remove the directory after the test
+        shutil.rmtree(self.test_dir)
+
+    def test_preprocess_dir_multi_preserves_source_mtime(self):
+        preprocess.preprocess_dir_multi(self.src_dirpath, {self.output_dirpath: []})
+
+        self.assertEqual(os.stat(path.join(self.output_dirpath, 'test.lua')).st_mtime_ns, os.stat(self.test_filepath).st_mtime_ns)
+
+    def test_preprocess_dir_multi_skips_up_to_date_files(self):
+        preprocess.preprocess_dir_multi(self.src_dirpath, {self.output_dirpath: []})
+
+        with mock.patch(f"{__name__}.preprocess.preprocess_file_multi") as preprocess_file_multi_mock:
+            preprocess.preprocess_dir_multi(self.src_dirpath, {self.output_dirpath: []})
+            preprocess_file_multi_mock.assert_not_called()
+
+    def test_preprocess_dir_multi_up_to_date_files_start_no_process(self):
+        for i in range(4):
+            with open(path.join(self.src_dirpath, f'test{i}.lua'), 'w') as f:
+                f.write(self.test_code)
+        preprocess.preprocess_dir_multi(self.src_dirpath, {self.output_dirpath: []})
+
+        with mock.patch(f"{__name__}.preprocess.ProcessPoolExecutor") as process_pool_executor_mock:
+            preprocess.preprocess_dir_multi(self.src_dirpath, {self.output_dirpath: []}, jobs=4)
+            process_pool_executor_mock.assert_not_called()
+
+    def test_preprocess_dir_multi_reprocesses_modified_source(self):
+        preprocess.preprocess_dir_multi(self.src_dirpath, {self.output_dirpath: []})
+
+        with open(self.test_filepath, 'w') as f:
+            f.write('print("modified")\n')
+        # make sure modification time changed even on file systems with low time resolution
+        os.utime(self.test_filepath, ns=(0, os.stat(self.test_filepath).st_mtime_ns + 1000000000))
+        preprocess.preprocess_dir_multi(self.src_dirpath, {self.output_dirpath: []})
+
+        with open(path.join(self.output_dirpath, 'test.lua'), 'r') as f:
+            self.assertEqual(f.read(), 'print("modified")\n')
+
+    def test_preprocess_dir_multi_reprocesses_all_files_when_symbols_change(self):
+        preprocess.preprocess_dir_multi(self.src_dirpath, {self.output_dirpath: []})
+        preprocess.preprocess_dir_multi(self.src_dirpath, {self.output_dirpath: ['debug']})
+
+        with open(path.join(self.output_dirpath, 'test.lua'), 'r') as f:
+            self.assertEqual(f.read(), 'print("always")\nprint("debug")\n')
+
+    def test_preprocess_dir_multi_removes_stale_output_files(self):
+        os.makedirs(path.join(self.output_dirpath, 'removed'))
+        stale_filepath = path.join(self.output_dirpath, 'removed', 'stale.lua')
+        with open(stale_filepath, 'w') as f:
+            f.write('print("stale")\n')
+
+        preprocess.preprocess_dir_multi(self.src_dirpath, {self.output_dirpath: []})
+
+        self.assertFalse(path.exists(stale_filepath))
+        self.assertFalse(path.exists(path.join(self.output_dirpath, 'removed')))
+        self.assertTrue(path.exists(path.join(self.output_dirpath, 'test.lua')))
+
 
 class TestPreprocessFile(unittest.TestCase):
 
@@ -653,6 +1285,133 @@ if true:
         with open(test_filepath2, 'r') as f2:
             self.assertEqual(f2.read(), expected_processed_code2)
 
+class TestPreprocessDirParallel(unittest.TestCase):
+
+    def setUp(self):
+        # Create a temporary directory
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        # Remove the directory after the test
+        shutil.rmtree(self.test_dir)
+
+    def test_find_lua_filepaths(self):
+        os.mkdir(path.join(self.test_dir, 'sub'))
+        for relative_filepath in ['b.lua', 'a.lua', 'sub/c.lua', 'data.p8']:
+            with open(path.join(self.test_dir, relative_filepath), 'w') as f:
+                pass
+
+        self.assertEqual(preprocess.find_lua_filepaths(self.test_dir), [
+            path.join(self.test_dir, 'a.lua'),
+            path.join(self.test_dir, 'b.lua'),
+            path.join(self.test_dir, 'sub', 'c.lua'),
+        ])
+
+    def test_preprocess_dir_parallel(self):
+        test_code_template = """print("file{0}")
+--#if debug
+print("debug{0}")
+--#endif
+"""
+        test_filepaths = [path.join(self.test_dir, f'test{i}.lua') for i in range(8)]
+        for i, test_filepath in enumerate(test_filepaths):
+            with open(test_filepath, 'w') as f:
+                f.write(test_code_template.format(i))
+
+        preprocess.preprocess_dir(self.test_dir, [], jobs=4)
+
+        for i, test_filepath in enumerate(test_filepaths):
+            with open(test_filepath, 'r') as f:
+                self.assertEqual(f.read(), f'print("file{i}")\n')
+
+    def test_preprocess_dir_parallel_logs_warnings_in_file_order(self):
+        test_filepaths = [path.join(self.test_dir, f'test{i}.lua') for i in range(4)]
+        for test_filepath in test_filepaths:
+            with open(test_filepath, 'w') as f:
+                f.write('--#endif\n')
+
+        with self.assertLogs(level='WARNING') as log_context:
+            preprocess.preprocess_dir(self.test_dir, [], jobs=2)
+
+        self.assertEqual(log_context.output, [
+            f'WARNING:root:{test_filepath}: an --#endif was encountered outside an --#if block. Make sure the block starts with an --#if directive'
+            for test_filepath in test_filepaths
+        ])
+
+
+class TestPreprocessCache(unittest.TestCase):
+
+    def setUp(self):
+        # Create a temporary directory
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        # Remove the directory after the test
+        shutil.rmtree(self.test_dir)
+
+    def test_compute_cache_key_ignores_symbols_order_and_duplicates(self):
+        self.assertEqual(preprocess.compute_cache_key('print("hi")\n', ['log', 'assert']),
+            preprocess.compute_cache_key('print("hi")\n', ['assert', 'log', 'log']))
+
+    def test_compute_cache_key_depends_on_symbols(self):
+        self.assertNotEqual(preprocess.compute_cache_key('print("hi")\n', ['log']),
+            preprocess.compute_cache_key('print("hi")\n', []))
+
+    def test_compute_cache_key_depends_on_content(self):
+        self.assertNotEqual(preprocess.compute_cache_key('print("hi")\n', []),
+            preprocess.compute_cache_key('print("hello")\n', []))
+
+    def test_compute_cache_key_depends_on_version(self):
+        key = preprocess.compute_cache_key('print("hi")\n', [])
+        with mock.patch(f"{__name__}.preprocess.PREPROCESSOR_VERSION", preprocess.PREPROCESSOR_VERSION + 1):
+            self.assertNotEqual(preprocess.compute_cache_key('print("hi")\n', []), key)
+
+    def test_get_or_preprocess_cached_content_miss_then_hit(self):
+        test_code = """print("always")
+--#if debug
+print("debug")
+--#endif
+"""
+        expected_processed_code = """print("always")
+"""
+        cache_dirpath = path.join(self.test_dir, 'cache')
+
+        self.assertEqual(preprocess.get_or_preprocess_cached_content(test_code, [], cache_dirpath), expected_processed_code)
+
+        # second time, content should be served from cache without parsing
+        with mock.patch(f"{__name__}.preprocess.preprocess_lines") as preprocess_lines_mock:
+            self.assertEqual(preprocess.get_or_preprocess_cached_content(test_code, [], cache_dirpath), expected_processed_code)
+            preprocess_lines_mock.assert_not_called()
+
+    def test_preprocess_dir_with_cache(self):
+        test_code = """print("always")
+--#if debug
+print("debug")
+--#endif
+"""
+        expected_processed_code = """print("always")
+"""
+        cache_dirpath = path.join(self.test_dir, 'cache')
+        src_dirpath = path.join(self.test_dir, 'src')
+        test_filepath = path.join(src_dirpath, 'test.lua')
+        os.mkdir(src_dirpath)
+
+        # first build fills the cache
+        with open(test_filepath, 'w') as f:
+            f.write(test_code)
+        preprocess.preprocess_dir(src_dirpath, [], cache_dirpath)
+
+        # simulate fresh copy of the source, as done by the build script before preprocessing
+        with open(test_filepath, 'w') as f:
+            f.write(test_code)
+        with mock.patch(f"{__name__}.preprocess.preprocess_lines") as preprocess_lines_mock:
+            preprocess.preprocess_dir(src_dirpath, [], cache_dirpath)
+            preprocess_lines_mock.assert_not_called()
+
+        with open(test_filepath, 'r') as f:
+            self.assertEqual(f.read(), expected_processed_code)
+
+
 if __name__ == '__main__':
     logging.basicConfig(level=logging.CRITICAL)
     unittest.main()
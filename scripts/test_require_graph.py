@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+import unittest
+from . import require_graph
+
+import io
+import json
+import logging
+import os
+from os import path
+import shutil, tempfile
+
+
+class TestFindRequires(unittest.TestCase):
+
+    def test_find_requires(self):
+        self.assertEqual(require_graph.find_requires('require("a/b")\nlocal c = require "c"\nrequire(\'d\')'), ['a/b', 'c', 'd'])
+
+    def test_find_requires_ignores_comments_and_strings(self):
+        self.assertEqual(require_graph.find_requires('-- require("a")\n--[[\nrequire("b")\n]]\nprint("require(\'c\')")'), [])
+
+    def test_find_requires_ignores_member_calls(self):
+        self.assertEqual(require_graph.find_requires('obj.require("a")\nobj:require("b")'), [])
+
+    def test_find_requires_expression(self):
+        self.assertEqual(require_graph.find_requires('require(prefix.."a")\nrequire(name)'), [None, None])
+
+    def test_find_requires_require_not_called(self):
+        self.assertEqual(require_graph.find_requires('local r = require\nr("a")'), [])
+
+    def test_find_requires_top_level_only(self):
+        code = ('require("a")\nfunction f()\n  require("b")\nend\nif x then require("c") end\n'
+            'if (x) require("d")\nfor i = 1, 2 do require("e") end\nrequire("f")\n')
+        self.assertEqual(require_graph.find_requires(code), ['a', 'b', 'c', 'd', 'e', 'f'])
+        self.assertEqual(require_graph.find_requires(code, top_level_only=True), ['a', 'f'])
+
+    def test_find_requires_top_level_only_multiline_bracketed_condition(self):
+        code = 'if (a and\n b) then\n require("a")\nend\nrequire("b")\n'
+        self.assertEqual(require_graph.find_requires(code, top_level_only=True), ['b'])
+
+
+class TestRequireGraph(unittest.TestCase):
+
+    def setUp(self):
+        # Create a temporary directory with a game root and an engine root
+        self.test_dir = tempfile.mkdtemp()
+        self.game_root = path.join(self.test_dir, 'game')
+        self.engine_root = path.join(self.test_dir, 'engine_src')
+        self.write_module(self.game_root, 'main', 'require("engine/common")\nrequire("engine/core/math")\nrequire("game/menu")\nrequire("busted")')
+        self.write_module(self.game_root, 'game/menu', 'require("engine/core/class")\nmenu = new_class()')
+        self.write_module(self.engine_root, 'engine/common', 'require("engine/core/class")\nrequire("engine/core/math")\nrequire("engine/debug/empty")')
+        self.write_module(self.engine_root, 'engine/core/class', 'function new_class() return {} end')
+        self.write_module(self.engine_root, 'engine/core/math', 'function sqr(x) return x * x end\nrequire("engine/core/class")')
+        self.write_module(self.engine_root, 'engine/debug/empty', '-- stripped in release\n')
+        self.roots = [self.game_root, self.engine_root]
+
+    def tearDown(self):
+        # Remove the directory after the test
+        shutil.rmtree(self.test_dir)
+
+    def write_module(self, root, module, code):
+        filepath = path.join(root, f"{module}.lua")
+        os.makedirs(path.dirname(filepath), exist_ok=True)
+        with open(filepath, 'w') as f:
+            f.write(code)
+
+    def test_build_require_graph(self):
+        graph = require_graph.build_require_graph(path.join(self.game_root, 'main.lua'), self.roots)
+        self.assertEqual(graph.entry_module, 'main')
+        self.assertEqual(list(graph.nodes), ['main', 'engine/common', 'engine/core/math', 'game/menu',
+            'engine/core/class', 'engine/debug/empty'])
+        self.assertEqual(graph.nodes['engine/common'].requires, ['engine/core/class', 'engine/core/math', 'engine/debug/empty'])
+        self.assertEqual(graph.nodes['engine/core/class'].filepath, path.join(self.engine_root, 'engine/core/class.lua'))
+        self.assertEqual(graph.nodes['engine/core/class'].tokens, 5)
+        self.assertEqual(graph.unresolved_requires, [('main', 'busted')])
+
+    def test_build_require_graph_entry_module(self):
+        graph = require_graph.build_require_graph('game/menu', self.roots)
+        self.assertEqual(list(graph.nodes), ['game/menu', 'engine/core/class'])
+
+    def test_build_require_graph_entry_not_found(self):
+        with self.assertRaises(ValueError):
+            require_graph.build_require_graph('missing', self.roots)
+
+    def test_build_require_graph_first_root_has_priority(self):
+        self.write_module(self.game_root, 'engine/core/class', 'function new_class() end')
+        graph = require_graph.build_require_graph('main', self.roots)
+        self.assertEqual(graph.nodes['engine/core/class'].filepath, path.join(self.game_root, 'engine/core/class.lua'))
+
+    def test_get_transitive_cost_counts_shared_modules_once(self):
+        graph = require_graph.build_require_graph('main', self.roots)
+        class_tokens = graph.nodes['engine/core/class'].tokens
+        math_tokens = graph.nodes['engine/core/math'].tokens
+        common_tokens = graph.nodes['engine/common'].tokens
+        self.assertEqual(graph.get_transitive_cost('engine/core/math')[0], math_tokens + class_tokens)
+        self.assertEqual(graph.get_transitive_cost('engine/common')[0], common_tokens + math_tokens + class_tokens)
+
+    def test_get_edge_removed_cost(self):
+        graph = require_graph.build_require_graph('main', self.roots)
+        self.assertEqual(graph.get_edge_removed_cost(('main', 'game/menu')), graph.get_cost(['game/menu']))
+        # class is also required by math and menu
+        self.assertEqual(graph.get_edge_removed_cost(('engine/common', 'engine/core/class')), (0, 0))
+
+    def test_get_empty_modules(self):
+        graph = require_graph.build_require_graph('main', self.roots)
+        self.assertEqual(graph.get_empty_modules(), ['engine/debug/empty'])
+
+    def test_get_report(self):
+        report = require_graph.get_report(require_graph.build_require_graph('main', self.roots))
+        self.assertEqual(report['modules'][0]['module'], 'main')
+        self.assertEqual(report['total_tokens'], report['modules'][0]['transitive_tokens'])
+        self.assertEqual([module_info['required_by'] for module_info in report['modules'] if module_info['module'] == 'engine/core/class'], [3])
+        # cutting common also cuts the empty module, but math and class are required elsewhere
+        self.assertEqual(report['edges'][:2], [
+            {'module': 'main', 'required_module': 'engine/common', 'removed_tokens': 9, 'removed_chars': 109},
+            {'module': 'main', 'required_module': 'game/menu', 'removed_tokens': 7, 'removed_chars': 47},
+        ])
+        self.assertEqual(report['unresolved_requires'], [{'module': 'main', 'required_module': 'busted'}])
+
+    def test_write_report_json(self):
+        report = require_graph.get_report(require_graph.build_require_graph('main', self.roots))
+        output_stream = io.StringIO()
+        require_graph.write_report(report, 'json', output_stream)
+        self.assertEqual(json.loads(output_stream.getvalue()), report)
+
+    def test_write_report_text(self):
+        report = require_graph.get_report(require_graph.build_require_graph('main', self.roots))
+        output_stream = io.StringIO()
+        require_graph.write_report(report, 'text', output_stream)
+        text = output_stream.getvalue()
+        self.assertIn("engine/common -> engine/core/class  (redundant)\n", text)
+        self.assertIn("\nEmpty modules (required, but without code):\nengine/debug/empty\n", text)
+        self.assertIn("\nUnresolved requires:\nmain -> busted\n", text)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.CRITICAL)
+    unittest.main()
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+import unittest
+from . import tree_shake
+from . import lua_tokenizer
+
+import logging
+import os
+from os import path
+import shutil, tempfile
+
+
+class TestTreeShakeSources(unittest.TestCase):
+
+    def tree_shake_main(self, source, kept_names=()):
+        """Return source of module 'main' after tree shaking it alone"""
+        shaken_sources_by_module, _ = tree_shake.tree_shake_sources({'main': source}, kept_names)
+        return shaken_sources_by_module.get('main', source)
+
+    def test_tree_shake_sources_removes_unused_global_function(self):
+        self.assertEqual(self.tree_shake_main('function used() end\n\nfunction unused()\n  print(1)\nend\n\nused()\n'),
+            'function used() end\n\n\nused()\n')
+
+    def test_tree_shake_sources_keeps_functions_used_by_used_functions(self):
+        source = 'function a() b() end\nfunction b() end\na()\n'
+        self.assertEqual(self.tree_shake_main(source), source)
+
+    def test_tree_shake_sources_removes_unused_recursive_functions(self):
+        self.assertEqual(self.tree_shake_main('function a() b() end\nfunction b() a() end\nprint(1)\n'), 'print(1)\n')
+
+    def test_tree_shake_sources_removes_functions_only_used_by_unused_functions(self):
+        self.assertEqual(self.tree_shake_main('function a() b() end\nfunction b() end\n'), '')
+
+    def test_tree_shake_sources_member_functions(self):
+        self.assertEqual(self.tree_shake_main('function v:used() end\nfunction v.unused() end\nfunction v.w:unused2() end\nv:used()\n'),
+            'function v:used() end\nv:used()\n')
+
+    def test_tree_shake_sources_local_functions(self):
+        self.assertEqual(self.tree_shake_main('local function used() end\nlocal function unused() end\nused()\n'),
+            'local function used() end\nused()\n')
+
+    def test_tree_shake_sources_keeps_dynamically_accessed_function(self):
+        source = 'function on_jump() end\ncallbacks["on_jump"]()\n'
+        self.assertEqual(self.tree_shake_main(source), source)
+
+    def test_tree_shake_sources_keeps_kept_names(self):
+        source = 'function on_jump() end\n'
+        self.assertEqual(self.tree_shake_main(source, ['on_jump']), source)
+
+    def test_tree_shake_sources_keeps_metamethods_and_pico8_callbacks(self):
+        source = 'function vector.__add(a, b) end\nfunction _init() end\nfunction _update60() end\nfunction _draw() end\n'
+        self.assertEqual(self.tree_shake_main(source), source)
+
+    def test_tree_shake_sources_keeps_functions_not_at_top_level(self):
+        source = 'if debug then\n  function unused() end\nend\nlocal unused2 = function() end\n'
+        self.assertEqual(self.tree_shake_main(source), source)
+
+    def test_tree_shake_sources_removes_comment_lines_above(self):
+        self.assertEqual(self.tree_shake_main('--[[\nheader\n--]]\n\n-- unused\n-- function\nfunction unused()\nend\n'),
+            '--[[\nheader\n--]]\n\n')
+
+    def test_tree_shake_sources_keeps_directives_above(self):
+        self.assertEqual(self.tree_shake_main('--#if itest\n-- unused\nfunction unused() end\n--#endif\n'),
+            '--#if itest\n--#endif\n')
+
+    def test_tree_shake_sources_keeps_code_on_same_line(self):
+        self.assertEqual(self.tree_shake_main('x = 1 function unused() end y = 2\nprint(x, y)\n'),
+            'x = 1   y = 2\nprint(x, y)\n')
+
+    def test_tree_shake_sources_shorthand_if_inside_function(self):
+        self.assertEqual(self.tree_shake_main('function unused(x)\n  if (x) return\n  print(x)\nend\nprint(1)\n'), 'print(1)\n')
+
+    def test_tree_shake_sources_across_modules(self):
+        shaken_sources_by_module, removed_names_by_module = tree_shake.tree_shake_sources({
+            'main': 'require("helper")\nhelp()\n',
+            'helper': 'function help() end\nfunction unused() end\n',
+        })
+        self.assertEqual(shaken_sources_by_module, {'helper': 'function help() end\n'})
+        self.assertEqual(removed_names_by_module, {'helper': ['unused']})
+
+    def test_tree_shake_sources_invalid_source(self):
+        with self.assertRaises(lua_tokenizer.LuaTokenizeError):
+            tree_shake.tree_shake_sources({'main': 'x = "unfinished'})
+
+
+class TestTreeShake(unittest.TestCase):
+
+    def setUp(self):
+        # Create a temporary directory with a game root and an engine root
+        self.test_dir = tempfile.mkdtemp()
+        self.game_root = path.join(self.test_dir, 'src')
+        self.engine_root = path.join(self.test_dir, 'pico-boots')
+        self.main_filepath = self.write_module(self.game_root, 'main', 'require("engine/core/helper")\nfunction _init() help() end\n')
+        self.helper_filepath = self.write_module(self.engine_root, 'engine/core/helper',
+            'function help() end\n\n-- unused\nfunction unused(a, b)\n  return a + b\nend\n')
+        # not required, so never modified
+        self.other_filepath = self.write_module(self.engine_root, 'engine/core/other', 'function unused3() end\n')
+
+    def tearDown(self):
+        # Remove the directory after the test
+        shutil.rmtree(self.test_dir)
+
+    def write_module(self, root, module, code):
+        filepath = path.join(root, f"{module}.lua")
+        os.makedirs(path.dirname(filepath), exist_ok=True)
+        with open(filepath, 'w') as f:
+            f.write(code)
+        return filepath
+
+    def read(self, filepath):
+        with open(filepath, 'r') as f:
+            return f.read()
+
+    def test_tree_shake(self):
+        removals, saved_token_count = tree_shake.tree_shake(self.main_filepath, [self.game_root, self.engine_root])
+        self.assertEqual(removals, [tree_shake.TreeShakeRemoval('engine/core/helper', self.helper_filepath, 'unused')])
+        self.assertEqual(saved_token_count, 9)
+        self.assertEqual(self.read(self.helper_filepath), 'function help() end\n\n')
+        self.assertEqual(self.read(self.main_filepath), 'require("engine/core/helper")\nfunction _init() help() end\n')
+        self.assertEqual(self.read(self.other_filepath), 'function unused3() end\n')
+
+    def test_tree_shake_kept_names(self):
+        removals, saved_token_count = tree_shake.tree_shake(self.main_filepath, [self.game_root, self.engine_root], ['unused'])
+        self.assertEqual((removals, saved_token_count), ([], 0))
+        self.assertIn('function unused(a, b)', self.read(self.helper_filepath))
+
+    def test_tree_shake_invalid_module_removes_nothing(self):
+        self.write_module(self.game_root, 'main', 'require("engine/core/helper")\nx = "unfinished\n')
+        self.assertEqual(tree_shake.tree_shake(self.main_filepath, [self.game_root, self.engine_root]), ([], 0))
+        self.assertIn('function unused(a, b)', self.read(self.helper_filepath))
+
+    def test_read_kept_names_file(self):
+        keep_filepath = path.join(self.test_dir, 'keep.txt')
+        with open(keep_filepath, 'w') as f:
+            f.write("# dynamically called\non_jump\n\n  on_land  \n")
+        self.assertEqual(tree_shake.read_kept_names_file(keep_filepath), ['on_jump', 'on_land'])
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.CRITICAL)
+    unittest.main()
@@ -0,0 +1,374 @@
+#!/usr/bin/env python3.6
+# -*- coding: utf-8 -*-
+import argparse
+import logging
+import re
+import sys
+from collections import defaultdict, namedtuple
+
+try:
+    from . import lua_tokenizer
+    from . import optimize
+    from . import pico8_tokens
+    from . import require_graph
+    from .lua_tokenizer import TokenType
+except ImportError:
+    # script run directly, not as part of the scripts package
+    import lua_tokenizer
+    import optimize
+    import pico8_tokens
+    import require_graph
+    from lua_tokenizer import TokenType
+
+
+# This script removes function definitions that are never referenced in the modules required from an entry script,
+# in-place. It is meant to be run as a build step after preprocess.py, optimize.py and add_require.py, and before
+# bundle.py, on the intermediate directories, so engine modules only ship the functions the game actually uses.
+
+# Process:
+# 1. Find the modules reachable from the entry script through requires across the roots (see require_graph.py)
+# 2. In each module, find function definitions at the top level of the module:
+#    "function name(...) ... end", "function a.b.name(...) ... end", "function a:name(...) ... end"
+#    and "local function name(...) ... end", identified by their last name (e.g. "name")
+# 3. Mark as used all the names (and simple string literals looking like names, for dynamic access like t["name"])
+#    appearing in code outside these definitions, then mark as used all the definitions whose name is used,
+#    as well as the names appearing in them, recursively
+# 4. Remove the definitions whose name is not used, along with their lines and the comment lines right above them
+#    if nothing else remains on them
+
+# Extra notes:
+
+# a. References are matched by name only, without type analysis: "function vector:magnitude()" is kept as soon as
+# "magnitude" appears anywhere in used code, even as a field of an unrelated table, so the result is conservative.
+# Definitions that are not top-level function statements (e.g. "name = function() ... end", or functions defined
+# inside a do/if block) are never removed, but the names used inside them are marked as used.
+
+# b. Names built at runtime (e.g. self["on_"..event_name]) cannot be detected: pass such names as kept names
+# (--keep or --keep-file) so their definitions are never removed. Metamethods (names starting with "__")
+# and PICO-8 callbacks (see pico8_callback_names) are always kept.
+
+# c. If any module cannot be tokenized, no function is removed at all, as its references would be unknown.
+
+# d. Modified files are written without preserving their modification time, so if they are preprocessed files,
+# preprocess.py considers them out of date on the next build and produces them again from their source
+# (see OUTPUT_STAMP_FILENAME in preprocess.py), since a function removed in one build may be used in the next one.
+# To keep incremental preprocessing, build_cartridge.sh runs this script on a copy of the intermediate files instead.
+
+# Usage:
+# tree_shake.py entry --roots root1 [root2 ...] [--keep name1 ...] [--keep-file keep_filepath]
+# entry:        path of the entry script (e.g. intermediate/release/src/main.lua)
+# roots:        paths of the directories from which required modules are resolved, in order of priority
+# keep_filepath path of a file listing names to keep, one per line (blank lines and lines starting with '#' are ignored)
+
+
+# PICO-8 callbacks, which are called by PICO-8 itself
+pico8_callback_names = {'_init', '_update', '_update60', '_draw'}
+
+simple_name_pattern = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+long_comment_pattern = re.compile(r"^--\[=*\[")
+
+# name          str     last name of the defined function (e.g. "magnitude" for "function vector:magnitude()")
+# start         int     index of the first token of the definition ("function", or "local" for a local function)
+# end           int     index of the final "end" token of the definition
+# name_index    int     index of the token of the name
+FunctionDefinition = namedtuple('FunctionDefinition', ['name', 'start', 'end', 'name_index'])
+
+# module            str     module name, as in require
+# filepath          str     path of the module script
+# name              str     name of the removed function
+TreeShakeRemoval = namedtuple('TreeShakeRemoval', ['module', 'filepath', 'name'])
+
+
+def tree_shake(entry, roots, kept_names=()):
+    """
+    Remove unused function definitions from the modules reachable from entry, the path of the entry script
+    or its module name, resolving required modules in roots (list of directory paths, in order of priority), in-place.
+    Definitions of kept_names are never removed.
+    Return (list of TreeShakeRemoval, number of tokens saved), or ([], 0) if some module could not be tokenized.
+    Raise ValueError if the entry script cannot be found.
+
+    """
+    try:
+        graph = require_graph.build_require_graph(entry, roots)
+    except lua_tokenizer.LuaTokenizeError as e:
+        logging.warning(f"could not tokenize a required module ({e}), no function will be removed")
+        return [], 0
+
+    sources_by_module = {}
+    for node in graph.nodes.values():
+        with open(node.filepath, 'r') as lua_file:
+            sources_by_module[node.module] = lua_file.read()
+
+    shaken_sources_by_module, removed_names_by_module = tree_shake_sources(sources_by_module, kept_names)
+
+    removals = []
+    saved_token_count = 0
+    for module, shaken_source in shaken_sources_by_module.items():
+        node = graph.nodes[module]
+        with open(node.filepath, 'w') as lua_file:
+            lua_file.write(shaken_source)
+        removals += [TreeShakeRemoval(module, node.filepath, name) for name in removed_names_by_module[module]]
+        saved_token_count += node.tokens - pico8_tokens.count_tokens(shaken_source)
+
+    return removals, saved_token_count
+
+
+def tree_shake_sources(sources_by_module, kept_names=()):
+    """
+    Return (dict of source without unused function definitions by module, dict of list of removed function names
+    by module), only for modules where some definition has been removed.
+    sources_by_module is a dict of source code by module, containing all the modules of the program.
+    Definitions of kept_names are never removed.
+    Raise LuaTokenizeError if some source cannot be tokenized.
+
+    >>> tree_shake_sources({'main': 'function used() end\\nfunction unused() end\\nused()\\n'})
+    ({'main': 'function used() end\\nused()\\n'}, {'main': ['unused']})
+
+    """
+    tokens_by_module = {module: list(lua_tokenizer.tokenize(source)) for module, source in sources_by_module.items()}
+
+    # list of (module, FunctionDefinition) by name
+    definitions_by_name = defaultdict(list)
+    used_names = set(kept_names) | pico8_callback_names
+    for module, tokens in tokens_by_module.items():
+        definitions = find_function_definitions(tokens)
+        for definition in definitions:
+            definitions_by_name[definition.name].append((module, definition))
+            if definition.name.startswith('__'):
+                used_names.add(definition.name)
+        used_names |= get_referenced_names(tokens, definitions)
+
+    # mark definitions of used names as used, and the names they reference in turn
+    used_definitions = set()
+    names_to_visit = list(used_names)
+    while names_to_visit:
+        name = names_to_visit.pop()
+        for module, definition in definitions_by_name.get(name, []):
+            if (module, definition) in used_definitions:
+                continue
+            used_definitions.add((module, definition))
+            for referenced_name in get_definition_referenced_names(tokens_by_module[module], definition):
+                if referenced_name not in used_names:
+                    used_names.add(referenced_name)
+                    names_to_visit.append(referenced_name)
+
+    unused_definitions_by_module = defaultdict(list)
+    for name, module_definitions in definitions_by_name.items():
+        for module, definition in module_definitions:
+            if (module, definition) not in used_definitions:
+                unused_definitions_by_module[module].append(definition)
+
+    shaken_sources_by_module = {}
+    removed_names_by_module = {}
+    for module, unused_definitions in unused_definitions_by_module.items():
+        unused_definitions.sort(key=lambda definition: definition.start)
+        shaken_sources_by_module[module] = remove_definitions(sources_by_module[module], tokens_by_module[module], unused_definitions)
+        removed_names_by_module[module] = [definition.name for definition in unused_definitions]
+
+    return shaken_sources_by_module, removed_names_by_module
+
+
+def find_function_definitions(tokens):
+    """Return the list of FunctionDefinition for function statements at the top level of tokens, in order"""
+    definitions = []
+    depth = 0
+    index = 0
+    token_count = len(tokens)
+    while index < token_count:
+        token = tokens[index]
+        if token.token_type is not TokenType.KEYWORD:
+            index += 1
+            continue
+
+        text = token.text
+        if text == 'function' and depth == 0:
+            definition = parse_function_definition(tokens, index)
+            if definition is not None:
+                definitions.append(definition)
+                index = definition.end + 1
+                continue
+
+        if text == 'if':
+            if optimize.is_shorthand_if(tokens, index):
+                index = optimize.find_line_end(tokens, index)
+                continue
+            depth += 1
+        elif text in optimize.block_opening_keywords:
+            depth += 1
+        elif text in optimize.block_closing_keywords:
+            depth -= 1
+        index += 1
+
+    return definitions
+
+
+def parse_function_definition(tokens, function_index):
+    """
+    Return the FunctionDefinition of the function statement starting with the keyword at tokens[function_index],
+    or None if it is an anonymous function or it is malformed
+
+    """
+    start = function_index
+    previous_index = find_previous_significant_token_index(tokens, function_index - 1)
+    if previous_index is not None and tokens[previous_index].text == 'local':
+        start = previous_index
+
+    # function name: name {'.' name} [':' name]
+    name_index = optimize.find_next_significant_token_index(tokens, function_index + 1)
+    if name_index is None or tokens[name_index].token_type is not TokenType.NAME:
+        return None
+    while True:
+        separator_index = optimize.find_next_significant_token_index(tokens, name_index + 1)
+        if separator_index is None or tokens[separator_index].text not in ('.', ':') or start != function_index:
+            break
+        next_name_index = optimize.find_next_significant_token_index(tokens, separator_index + 1)
+        if next_name_index is None or tokens[next_name_index].token_type is not TokenType.NAME:
+            return None
+        name_index = next_name_index
+        if tokens[separator_index].text == ':':
+            break
+
+    end_index = optimize.find_block_keyword(tokens, name_index + 1, {'end'})
+    if end_index is None:
+        return None
+
+    return FunctionDefinition(tokens[name_index].text, start, end_index, name_index)
+
+
+def find_previous_significant_token_index(tokens, start):
+    """Return the index of the last token until tokens[start] that is neither a whitespace nor a comment, or None"""
+    for index in range(start, -1, -1):
+        if not lua_tokenizer.is_blank_token(tokens[index]):
+            return index
+    return None
+
+
+def get_token_referenced_name(token):
+    """Return the name referenced by token (a name, or a string literal containing a name), or None"""
+    if token.token_type is TokenType.NAME:
+        return token.text
+    if token.token_type is TokenType.STRING:
+        value = optimize.parse_simple_string_literal(token.text)
+        if value is not None and simple_name_pattern.match(value):
+            return value
+    return None
+
+
+def get_referenced_names(tokens, definitions):
+    """Return the set of names referenced in tokens, outside the ranges of definitions"""
+    referenced_names = set()
+    definition_index = 0
+    index = 0
+    token_count = len(tokens)
+    while index < token_count:
+        if definition_index < len(definitions) and index == definitions[definition_index].start:
+            index = definitions[definition_index].end + 1
+            definition_index += 1
+            continue
+        name = get_token_referenced_name(tokens[index])
+        if name is not None:
+            referenced_names.add(name)
+        index += 1
+    return referenced_names
+
+
+def get_definition_referenced_names(tokens, definition):
+    """Return the set of names referenced in definition, except its own name where it is defined"""
+    referenced_names = set()
+    for index in range(definition.start, definition.end + 1):
+        if index == definition.name_index:
+            continue
+        name = get_token_referenced_name(tokens[index])
+        if name is not None:
+            referenced_names.add(name)
+    return referenced_names
+
+
+def remove_definitions(source, tokens, definitions):
+    """
+    Return source without the code of definitions (list of FunctionDefinition, sorted by start),
+    also removing the lines of definitions when nothing else remains on them
+
+    """
+    texts = []
+    copy_start = 0
+    min_token_index = 0
+    for definition in definitions:
+        remove_start = tokens[definition.start].start
+        remove_end = tokens[definition.end].start + len(tokens[definition.end].text)
+
+        line_start = source.rfind("\n", 0, remove_start) + 1
+        line_end = source.find("\n", remove_end)
+        if line_end == -1:
+            line_end = len(source)
+        if line_start >= copy_start and not source[line_start:remove_start].strip() and not source[remove_end:line_end].strip():
+            # nothing else on the lines of the definition, remove them entirely (with final newline if any),
+            # with the comment lines right above, which document the definition
+            comment_lines_start_index = find_comment_lines_start_index(tokens, definition.start, min_token_index)
+            remove_start = source.rfind("\n", 0, tokens[comment_lines_start_index].start) + 1
+            remove_end = min(line_end + 1, len(source))
+            replacement = ""
+        else:
+            # keep a separator with the surrounding code
+            replacement = " "
+
+        texts.append(source[copy_start:remove_start])
+        texts.append(replacement)
+        copy_start = remove_end
+        min_token_index = definition.end + 1
+
+    texts.append(source[copy_start:])
+    return "".join(texts)
+
+
+def find_comment_lines_start_index(tokens, start, min_index):
+    """
+    Return the index of the first token of the block of short comments right above tokens[start], each on its own line,
+    without blank lines in-between, not before min_index, or start if there is none.
+    Long comments and preprocessor directives ("--#") are not considered.
+
+    """
+    while start - 2 >= min_index:
+        whitespace_token = tokens[start - 1]
+        comment_token = tokens[start - 2]
+        if whitespace_token.token_type is not TokenType.WHITESPACE or whitespace_token.text.count("\n") != 1 or \
+                comment_token.token_type is not TokenType.COMMENT or long_comment_pattern.match(comment_token.text) or \
+                comment_token.text.startswith("--#"):
+            break
+        # the comment must start its line
+        if start - 3 >= 0 and (tokens[start - 3].token_type is not TokenType.WHITESPACE or "\n" not in tokens[start - 3].text):
+            break
+        start -= 2
+    return start
+
+
+def read_kept_names_file(keep_filepath):
+    """Return the list of names in the keep file at keep_filepath, ignoring blank lines and lines starting with '#'"""
+    with open(keep_filepath, 'r') as keep_file:
+        return [line.strip() for line in keep_file if line.strip() and not line.strip().startswith('#')]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Remove function definitions never referenced from an entry script, in-place.')
+    parser.add_argument('entry', type=str, help='path of the entry script, or its module name relative to a root')
+    parser.add_argument('-r', '--roots', type=str, nargs='+', required=True,
+        help='paths of the directories from which required modules are resolved, in order of priority')
+    parser.add_argument('-k', '--keep', type=str, nargs='*', default=[],
+        help="names of functions to keep, because they are accessed dynamically (optional)")
+    parser.add_argument('--keep-file', type=str,
+        help="path of a file listing names of functions to keep, one per line (optional)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    kept_names = args.keep + (read_kept_names_file(args.keep_file) if args.keep_file else [])
+    try:
+        removals, saved_token_count = tree_shake(args.entry, args.roots, kept_names)
+    except ValueError as e:
+        logging.error(e)
+        sys.exit(1)
+
+    for removal in removals:
+        logging.info(f"{removal.filepath}: removed unused function '{removal.name}'")
+    print(f"Removed {len(removals)} unused function(s) in {len({removal.module for removal in removals})} file(s), "
+        f"saving {saved_token_count} tokens.")